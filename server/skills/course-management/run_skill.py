@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 import argparse
+import inspect
 import json
+import os
 import sys
+import time
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent
@@ -12,31 +15,193 @@ sys.path.insert(0, str(SCRIPTS_DIR))
 from student_manager import StudentManager
 from schedule_manager import ScheduleManager
 from attendance_manager import AttendanceManager
+from attendance_alerts import AttendanceAlerts
 from assessment_manager import AssessmentManager
+from payment_manager import PaymentManager
+from availability import AvailabilityEngine
+from archive_manager import ArchiveManager
+from backup_manager import BackupManager
+from change_feed import ChangeFeed
+from integrity_checker import IntegrityChecker
+from parallel_executor import ParallelExecutor
+from shard_router import ShardRouter
+from init_database import ensure_schema
+from storage import get_backend
+from unit_of_work import UnitOfWork, unit_of_work
+from response_writer import ResponseWriter, FORMATS
+
+# 可跨中心合併查詢的動作及其排序欄位（與各管理器 ORDER BY 一致）
+FAN_OUT_ACTIONS = {
+    'list_students': ('name',),
+    'get_weekly_schedule': ('weekday', 'start_time'),
+}
+
+# 可跨中心合併的統計：各分片平行讀取原始數值，合併後一次計算
+FAN_OUT_STATS = {'cohort_stats'}
+
+# 唯讀動作：parallel 時可在執行緒池同時執行；其他動作（含會寫入快取的統計）視為寫入
+READ_ACTIONS = {
+    'get_student', 'list_students',
+    'get_student_schedules', 'get_weekly_schedule', 'get_daily_agenda',
+    'find_open_slots', 'utilization_heatmap',
+    'get_attendance', 'get_leaves', 'get_pending_notes',
+    'get_assessments', 'get_latest_assessment', 'compare_assessments',
+    'get_payments', 'get_payment_balance', 'list_outstanding_payments', 'get_monthly_payment_totals',
+    'changes_since',
+}
 
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument('--db', dest='db_path', default=str(BASE_DIR / 'course_management.db'))
+    parser.add_argument('--db', dest='db_path', default=str(BASE_DIR / 'course_management.db'),
+                        help='SQLite 檔案路徑或 postgresql:// 連線字串')
+    parser.add_argument('--shards', dest='shards_path',
+                        help='多中心分片設定檔 (JSON: {"中心代碼": "資料庫路徑"})')
+    parser.add_argument('--format', dest='output_format', choices=FORMATS, default='json',
+                        help='輸出格式：json（預設）或 msgpack')
+    parser.add_argument('--writer-lock', action='store_true',
+                        help='SQLite 寫入交易經由鎖定檔排隊（多個程序同時寫入時使用）')
+    parser.add_argument('--stats', action='store_true',
+                        help='將執行與序列化耗時、輸出大小、最高記憶體用量以 JSON 寫到 stderr')
     args = parser.parse_args()
+    if args.writer_lock:
+        os.environ['SKILL_SQLITE_WRITER_LOCK'] = '1'
+
+    try:
+        writer = ResponseWriter(fmt=args.output_format)
+    except ValueError as exc:
+        ResponseWriter().write(False, error=str(exc))
+        sys.exit(1)
 
+    started = time.perf_counter()
     try:
         raw = sys.stdin.read().strip()
         payload = json.loads(raw) if raw else {}
         action = payload.get('action')
         params = payload.get('args', {})
 
-        if not action:
+        router = ShardRouter.from_config(args.shards_path) if args.shards_path else None
+        if 'parallel' in payload:
+            result = run_parallel(payload['parallel'], args.db_path, router,
+                                  int(payload.get('max_workers', 4)))
+        elif not action:
             raise ValueError('Missing action')
-
-        result = run_action(action, params, args.db_path)
-        print(json.dumps({'ok': True, 'result': result}, ensure_ascii=False))
+        elif router is not None:
+            result = run_sharded_action(router, action, params)
+        else:
+            result = run_action(action, params, args.db_path)
+        ok, error = True, None
     except Exception as exc:
-        print(json.dumps({'ok': False, 'error': str(exc)}, ensure_ascii=False))
+        ok, result, error = False, None, str(exc)
+    action_ms = round((time.perf_counter() - started) * 1000, 1)
+
+    # PostgreSQL 後端會回傳 date/datetime 物件，由編碼器轉為字串
+    stats = writer.write(ok, result, error)
+    # 逐筆寫出途中讀取失敗：輸出已以 "ok": false 結束
+    ok = ok and 'stream_error' not in stats
+    if args.stats:
+        stats = dict(stats, action_ms=action_ms)
+        backend = get_backend(args.db_path)
+        if backend.dialect == 'sqlite' and not args.shards_path:
+            stats['lock'] = backend.stats
+        print(json.dumps(stats, ensure_ascii=False), file=sys.stderr)
+    if not ok:
         sys.exit(1)
 
 
+def run_parallel(calls, db_path, router=None, max_workers=4):
+    """
+    執行一組動作：唯讀動作在執行緒池同時執行，寫入動作依序執行，結果依原順序回傳
+
+    Args:
+        calls: [{'action': 動作, 'args': {...}}, ...]
+    """
+    if router is not None:
+        # 工作執行緒使用唯讀連線，遷移須在開始前由呼叫端執行緒完成
+        for shard_path in router.shards.values():
+            ensure_schema(shard_path)
+        run = lambda action, params: materialize(run_sharded_action(router, action, params))
+        return ParallelExecutor(run, READ_ACTIONS.__contains__, max_workers).execute(calls)
+
+    # 結構檢查只需做一次；整批動作共用一個工作單元（各執行緒進入同一單元，學員查詢結果共用）
+    ensure_schema(db_path)
+    with UnitOfWork(db_path) as unit:
+        def run(action, params):
+            with unit:
+                return materialize(dispatch_action(action, params, db_path))
+
+        return ParallelExecutor(run, READ_ACTIONS.__contains__, max_workers).execute(calls)
+
+
+def run_sharded_action(router, action, params):
+    """
+    依 center 參數路由到對應分片；未指定 center 的跨中心查詢則平行展開後合併
+    """
+    params = dict(params)
+    center = params.pop('center', None)
+
+    if center is None and action in FAN_OUT_STATS and len(router.shards) > 1:
+        return run_sharded_stats(router, action, params)
+
+    if center is None and action in FAN_OUT_ACTIONS and len(router.shards) > 1:
+        sort_fields = FAN_OUT_ACTIONS[action]
+        fields = params.get('fields')
+        if fields is not None:
+            # 合併排序需要排序欄位，先一併查詢，合併後再移除
+            fields = fields.split(',') if isinstance(fields, str) else list(fields)
+            fields = [field.strip() for field in fields]
+            params['fields'] = fields + [field for field in sort_fields if field not in fields]
+
+        rows = router.fan_out(
+            lambda db_path: materialize(run_action(action, params, db_path)),
+            sort_key=lambda row: tuple(row[field] for field in sort_fields),
+        )
+        if fields is not None:
+            keep = set(fields) | {'center'}
+            rows = [{key: value for key, value in row.items() if key in keep} for row in rows]
+        return rows
+
+    return run_action(action, params, router.db_path_for(center))
+
+
+def run_sharded_stats(router, action, params):
+    """
+    跨中心統計：百分位數無法由各中心的結果合併，各分片平行讀取原始數值後合併計算
+    """
+    from cohort_stats import CohortStats
+
+    def load(db_path):
+        ensure_schema(db_path)
+        return CohortStats(db_path).load_rows()
+
+    return CohortStats.combine(
+        router.map_shards(load),
+        params.get('group_by'),
+        params.get('period', 'year'),
+        params.get('percentiles', (10, 25, 50, 75, 90)),
+    )
+
+
+def materialize(result):
+    """
+    將逐筆輸出的產生器讀成列表：平行與跨分片執行時結果在工作執行緒內讀完，
+    產生器使用的連線不會留到執行緒（或唯讀連線）結束之後
+    """
+    if inspect.isgenerator(result):
+        return list(result)
+    if isinstance(result, dict) and any(inspect.isgenerator(value) for value in result.values()):
+        return {key: list(value) if inspect.isgenerator(value) else value for key, value in result.items()}
+    return result
+
+
 def run_action(action, params, db_path):
+    ensure_schema(db_path)
+    # 同一次呼叫內各管理器共用連線與學員查詢結果
+    with unit_of_work(db_path):
+        return dispatch_action(action, params, db_path)
+
+
+def dispatch_action(action, params, db_path):
     if action == 'add_student':
         sm = StudentManager(db_path)
         student_id = sm.add_student(
@@ -53,7 +218,7 @@ def run_action(action, params, db_path):
 
     if action == 'list_students':
         sm = StudentManager(db_path)
-        return sm.list_all_students(params.get('status'))
+        return sm.iter_all_students(params.get('status'), params.get('fields'))
 
     if action == 'update_student':
         sm = StudentManager(db_path)
@@ -80,6 +245,36 @@ def run_action(action, params, db_path):
         sch = ScheduleManager(db_path)
         return sch.get_weekly_schedule(params.get('weekday'))
 
+    if action == 'get_daily_agenda':
+        sch = ScheduleManager(db_path)
+        return sch.get_daily_agenda(params.get('date', '今天'))
+
+    if action == 'find_open_slots':
+        engine = AvailabilityEngine(
+            db_path,
+            granularity=int(params.get('granularity', 10)),
+            capacity=int(params.get('capacity', 1)),
+        )
+        return engine.find_open_slots(
+            int(params.get('duration', 100)),
+            params.get('weekdays'),
+            int(params.get('count', 2)),
+        )
+
+    if action == 'utilization_heatmap':
+        # 延後匯入：numpy 載入約需 100ms，其他動作不必負擔
+        from utilization import UtilizationAnalyzer
+        analyzer = UtilizationAnalyzer(
+            db_path,
+            int(params.get('granularity', 30)),
+            int(params.get('capacity', 1)),
+        )
+        return analyzer.heatmap(
+            params.get('start_date'),
+            params.get('end_date'),
+            params.get('student_types'),
+        )
+
     if action == 'delete_schedule':
         sch = ScheduleManager(db_path)
         success = sch.delete_schedule(params['schedule_id'])
@@ -100,6 +295,20 @@ def run_action(action, params, db_path):
         )
         return {'attendance_id': record_id}
 
+    if action == 'upsert_attendance_many':
+        am = AttendanceManager(db_path)
+        return am.upsert_attendance_many(params['records'])
+
+    if action == 'compress_text':
+        am = AttendanceManager(db_path)
+        return am.compress_text_columns(
+            params.get('train', True),
+            int(params.get('sample_size', 1000)),
+            int(params.get('chunk_size', 500)),
+            int(params.get('benchmark_students', 50)),
+            params.get('vacuum', False),
+        )
+
     if action == 'add_leave':
         am = AttendanceManager(db_path)
         leave_id = am.add_leave(
@@ -111,15 +320,16 @@ def run_action(action, params, db_path):
 
     if action == 'get_attendance':
         am = AttendanceManager(db_path)
-        return am.get_student_attendance(
+        return am.iter_student_attendance(
             params['student'],
             params.get('start_date'),
             params.get('end_date'),
+            params.get('fields'),
         )
 
     if action == 'get_leaves':
         am = AttendanceManager(db_path)
-        return am.get_student_leaves(params['student'])
+        return am.get_student_leaves(params['student'], params.get('fields'))
 
     if action == 'add_class_note':
         am = AttendanceManager(db_path)
@@ -131,6 +341,24 @@ def run_action(action, params, db_path):
         )
         return {'note_id': note_id}
 
+    if action == 'complete_class_note':
+        am = AttendanceManager(db_path)
+        return {'completed': am.complete_class_note(int(params['note_id']))}
+
+    if action == 'get_pending_notes':
+        am = AttendanceManager(db_path)
+        return am.get_pending_notes(params.get('student'), params.get('as_of'))
+
+    if action == 'attendance_alerts':
+        alerts = AttendanceAlerts(db_path)
+        return alerts.evaluate(
+            int(params.get('min_streak', 3)),
+            float(params.get('rate_drop', 0.3)),
+            int(params.get('min_sessions', 3)),
+            params.get('as_of'),
+            params.get('full', False),
+        )
+
     if action == 'add_assessment':
         asm = AssessmentManager(db_path)
         assessment_id = asm.add_assessment(
@@ -150,16 +378,124 @@ def run_action(action, params, db_path):
 
     if action == 'get_assessments':
         asm = AssessmentManager(db_path)
-        return asm.get_student_assessments(params['student'])
+        return asm.get_student_assessments(params['student'], params.get('fields'))
 
     if action == 'get_latest_assessment':
         asm = AssessmentManager(db_path)
-        return asm.get_latest_assessment(params['student'])
+        return asm.get_latest_assessment(params['student'], params.get('fields'))
 
     if action == 'compare_assessments':
         asm = AssessmentManager(db_path)
         return asm.compare_assessments(params['student'])
 
+    if action == 'add_payment':
+        pm = PaymentManager(db_path)
+        payment_id = pm.add_payment(
+            student_id=params['student'],
+            amount=params['amount'],
+            status=params.get('status', '未繳'),
+            invoice_status=params.get('invoice_status', '未開立'),
+            paid_at=params.get('paid_at'),
+            method=params.get('method', '現金'),
+            invoice_no=params.get('invoice_no'),
+            sessions_count=params.get('sessions_count'),
+            month_ref=params.get('month_ref'),
+            note=params.get('note'),
+        )
+        return {'payment_id': payment_id}
+
+    if action == 'get_payments':
+        pm = PaymentManager(db_path)
+        return pm.get_student_payments(params['student'], params.get('fields'))
+
+    if action == 'update_payment':
+        pm = PaymentManager(db_path)
+        payment_id = params['payment_id']
+        updates = {k: v for k, v in params.items() if k != 'payment_id'}
+        success = pm.update_payment(payment_id, **updates)
+        return {'updated': success}
+
+    if action == 'delete_payment':
+        pm = PaymentManager(db_path)
+        success = pm.delete_payment(params['payment_id'])
+        return {'deleted': success}
+
+    if action == 'get_payment_balance':
+        pm = PaymentManager(db_path)
+        return pm.get_balance(params['student'])
+
+    if action == 'list_outstanding_payments':
+        pm = PaymentManager(db_path)
+        return pm.list_outstanding(params.get('limit'))
+
+    if action == 'get_monthly_payment_totals':
+        pm = PaymentManager(db_path)
+        return pm.get_monthly_totals(params.get('start_month'), params.get('end_month'))
+
+    if action == 'cohort_stats':
+        from cohort_stats import CohortStats
+        stats = CohortStats(db_path)
+        return stats.compute(
+            params.get('group_by'),
+            params.get('period', 'year'),
+            params.get('percentiles', (10, 25, 50, 75, 90)),
+            params.get('use_cache', True),
+        )
+
+    if action == 'get_kpi_snapshot':
+        from kpi_snapshot import KpiSnapshot
+        kpi = KpiSnapshot(db_path)
+        return kpi.snapshot(
+            params.get('as_of'),
+            params.get('retest_months', 6),
+            params.get('use_cache', True),
+        )
+
+    if action == 'archive':
+        archiver = ArchiveManager(db_path, params.get('archive_path'))
+        return archiver.archive(
+            params.get('cutoff_date'),
+            int(params.get('older_than_days', 365)),
+            params.get('include_departed', True),
+            int(params.get('chunk_size', 1000)),
+        )
+
+    if action == 'maintenance':
+        from maintenance import MaintenanceManager
+        manager = MaintenanceManager(db_path)
+        return manager.run(
+            int(params.get('max_pages', 2000)),
+            int(params.get('step_pages', 100)),
+            int(params.get('sleep_ms', 20)),
+            int(params.get('analysis_limit', 1000)),
+            params.get('rebuild', False),
+        )
+
+    if action == 'backup':
+        backup = BackupManager(db_path, params.get('backup_dir'))
+        return backup.backup(
+            int(params.get('pages', 256)),
+            int(params.get('sleep_ms', 50)),
+            int(params.get('keep', 7)),
+            params.get('vacuum', False),
+        )
+
+    if action == 'changes_since':
+        feed = ChangeFeed(db_path)
+        return feed.stream_changes_since(
+            int(params.get('seq', 0)),
+            int(params.get('limit', 500)),
+            params.get('include_rows', True),
+        )
+
+    if action == 'check_integrity':
+        checker = IntegrityChecker(db_path, int(params.get('sample_size', 10)))
+        return checker.check(params.get('checks'), params.get('repair', False))
+
+    if action == 'compact_changes':
+        feed = ChangeFeed(db_path)
+        return feed.compact(int(params.get('retention_days', 30)))
+
     raise ValueError(f'Unknown action: {action}')
 
 
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+冷熱資料分離：將舊的上課/請假記錄及離室學員的歷史移到附加的封存資料庫
+"""
+from datetime import datetime, timedelta
+from pathlib import Path
+import json
+
+from storage import get_backend
+from time_columns import TIME_COLUMNS, column_sql
+
+# 可封存的表格及其日期欄位
+ARCHIVE_TABLES = {
+    'attendance_records': 'class_date',
+    'leave_records': 'leave_date',
+}
+
+class ArchiveManager:
+    PATH_KEY = 'archive_path'
+    CUTOFF_KEY = 'archive_cutoff'
+    # 只在搬移的交易中存在：刪除觸發器見到此旗標時，變更記錄改記 archive（見 init_database 遷移 13）
+    ARCHIVING_KEY = 'archive_in_progress'
+
+    def __init__(self, db_path='course_management.db', archive_path=None):
+        """
+        Args:
+            db_path: 主資料庫路徑
+            archive_path: 封存資料庫路徑，預設為主資料庫旁的 <名稱>.archive.db
+        """
+        self.db_path = db_path
+        self.archive_path = archive_path
+
+    def _get_connection(self, **kwargs):
+        return get_backend(self.db_path).connect(**kwargs)
+
+    def _default_archive_path(self):
+        path = Path(self.db_path)
+        return str(path.with_name(f"{path.stem}.archive{path.suffix or '.db'}"))
+
+    def _get_meta(self, cursor):
+        """回傳 (封存路徑, 封存截止日)；尚未封存過則為 (None, None)"""
+        cursor.execute('SELECT key, value FROM skill_meta WHERE key IN (?, ?)',
+                       (self.PATH_KEY, self.CUTOFF_KEY))
+        meta = dict(cursor.fetchall())
+        return meta.get(self.PATH_KEY), meta.get(self.CUTOFF_KEY)
+
+    def _set_meta(self, cursor, key, value):
+        cursor.execute('''
+            INSERT INTO skill_meta (key, value) VALUES (?, ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value
+        ''', (key, value))
+
+    def _columns(self, cursor, schema, table):
+        """一般欄位（不含生成欄位），依表格定義順序"""
+        cursor.execute(f'PRAGMA {schema}.table_xinfo({table})')
+        return [(row[1], row[2]) for row in cursor.fetchall() if row[6] == 0]
+
+    def _sync_archive_table(self, cursor, table, date_column):
+        """在封存資料庫建立與主表相同欄位的表格，主表新增的欄位也一併補上"""
+        columns = self._columns(cursor, 'main', table)
+        definitions = ', '.join(
+            'id INTEGER PRIMARY KEY' if name == 'id' else f'{name} {col_type}'
+            for name, col_type in columns
+        )
+        cursor.execute(f'CREATE TABLE IF NOT EXISTS archive.{table} ({definitions})')
+
+        existing = {name for name, _ in self._columns(cursor, 'archive', table)}
+        for name, col_type in columns:
+            if name not in existing:
+                cursor.execute(f'ALTER TABLE archive.{table} ADD COLUMN {name} {col_type}')
+
+        cursor.execute(f'''
+            CREATE INDEX IF NOT EXISTS archive.idx_{table}_student
+            ON {table}(student_id, {date_column})
+        ''')
+        return [name for name, _ in columns]
+
+    def archive(self, cutoff_date=None, older_than_days=365, include_departed=True, chunk_size=1000):
+        """
+        封存舊資料
+
+        Args:
+            cutoff_date: 早於此日期的記錄移到封存資料庫（YYYY-MM-DD），預設為 older_than_days 天前
+            older_than_days: 未指定 cutoff_date 時的保留天數
+            include_departed: 是否一併封存離室學員的全部記錄
+            chunk_size: 每個交易搬移的筆數，避免長時間鎖住資料庫
+
+        Returns:
+            {'archive_path': 封存資料庫, 'cutoff': 截止日, 'moved': {表格: 筆數}}
+        """
+        if get_backend(self.db_path).dialect != 'sqlite':
+            raise ValueError("封存功能僅支援 SQLite 資料庫")
+
+        if cutoff_date is None:
+            cutoff_date = (datetime.now() - timedelta(days=older_than_days)).date().isoformat()
+        else:
+            cutoff_date = str(cutoff_date).replace('/', '-')
+
+        conn = self._get_connection(isolation_level=None)
+        cursor = conn.cursor()
+
+        stored_path, stored_cutoff = self._get_meta(cursor)
+        archive_path = self.archive_path or stored_path or self._default_archive_path()
+        cursor.execute('ATTACH DATABASE ? AS archive', (archive_path,))
+
+        moved = {}
+        try:
+            for table, date_column in ARCHIVE_TABLES.items():
+                columns = self._sync_archive_table(cursor, table, date_column)
+                column_list = ', '.join(columns)
+
+                condition = f'{date_column} < ?'
+                params = [cutoff_date]
+                if include_departed:
+                    condition += " OR student_id IN (SELECT id FROM students WHERE status = '離室')"
+
+                moved[table] = 0
+                while True:
+                    cursor.execute('BEGIN IMMEDIATE')
+                    cursor.execute(f'''
+                        SELECT id FROM main.{table}
+                        WHERE {condition}
+                        ORDER BY id
+                        LIMIT ?
+                    ''', params + [chunk_size])
+                    ids = [row[0] for row in cursor.fetchall()]
+                    if not ids:
+                        cursor.execute('COMMIT')
+                        break
+
+                    placeholders = ', '.join('?' for _ in ids)
+                    cursor.execute(f'''
+                        INSERT OR REPLACE INTO archive.{table} ({column_list})
+                        SELECT {column_list} FROM main.{table} WHERE id IN ({placeholders})
+                    ''', ids)
+                    self._set_meta(cursor, self.ARCHIVING_KEY, '1')
+                    cursor.execute(f'DELETE FROM main.{table} WHERE id IN ({placeholders})', ids)
+                    cursor.execute('DELETE FROM skill_meta WHERE key = ?', (self.ARCHIVING_KEY,))
+                    cursor.execute('COMMIT')
+                    moved[table] += len(ids)
+
+            # 封存資料庫包含截止日以前的全部記錄；截止日只往後推
+            cursor.execute('BEGIN IMMEDIATE')
+            self._set_meta(cursor, self.PATH_KEY, archive_path)
+            self._set_meta(cursor, self.CUTOFF_KEY, max(cutoff_date, stored_cutoff or cutoff_date))
+            cursor.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                cursor.execute('ROLLBACK')
+            raise
+        finally:
+            cursor.execute('DETACH DATABASE archive')
+            conn.close()
+
+        return {
+            'archive_path': archive_path,
+            'cutoff': cutoff_date,
+            'moved': moved,
+        }
+
+    def read_source(self, conn, table, student_id, start_date=None, columns=None):
+        """
+        讀取時使用的資料來源：查詢範圍早於封存截止日，或學員已離室時，
+        在同一連線附加封存資料庫並以 UNION ALL 合併
+
+        Args:
+            columns: 只合併這些欄位（預設全部），讓兩邊都能由涵蓋索引回答
+
+        Returns:
+            可放在 FROM 之後的表格或子查詢
+        """
+        if table not in ARCHIVE_TABLES or get_backend(self.db_path).dialect != 'sqlite':
+            return table
+
+        cursor = conn.cursor()
+        archive_path, cutoff = self._get_meta(cursor)
+        if archive_path is None or not Path(archive_path).exists():
+            return table
+
+        if start_date is not None and str(start_date).replace('/', '-') >= cutoff:
+            cursor.execute('SELECT status FROM students WHERE id = ?', (student_id,))
+            row = cursor.fetchone()
+            if row is None or row[0] != '離室':
+                return table
+
+        cursor.execute('PRAGMA database_list')
+        if 'archive' not in {row[1] for row in cursor.fetchall()}:
+            cursor.execute('ATTACH DATABASE ? AS archive', (archive_path,))
+
+        # 時間的整數欄位由來源欄位計算：遷移前封存的資料沒有這些值
+        derived = TIME_COLUMNS.get(table, {})
+        if columns is None:
+            columns = [name for name, _ in self._columns(cursor, 'archive', table)]
+            columns += [name for name in derived if name not in columns]
+        archive_list = ', '.join(
+            f'{column_sql(table, name)} AS {name}' if name in derived else name for name in columns)
+        return f'''(
+            SELECT {', '.join(columns)} FROM main.{table}
+            UNION ALL
+            SELECT {archive_list} FROM archive.{table}
+        )'''
+
+
+def main():
+    """命令列介面"""
+    import sys
+
+    if len(sys.argv) < 2:
+        print("用法:")
+        print("  封存舊資料: python archive_manager.py archive [截止日YYYY-MM-DD]")
+        return
+
+    manager = ArchiveManager()
+    action = sys.argv[1]
+
+    if action == 'archive':
+        cutoff = sys.argv[2] if len(sys.argv) > 2 else None
+        result = manager.archive(cutoff)
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+
+if __name__ == '__main__':
+    main()
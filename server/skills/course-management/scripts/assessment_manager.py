@@ -2,16 +2,46 @@
 """
 檢測記錄管理功能
 """
-import sqlite3
 from datetime import datetime
 import json
 
+from storage import get_backend
+from projection import Projection
+
+# 查詢檢測記錄可用的欄位：輸出鍵 → SQL 欄位
+ASSESSMENT_FIELDS = {
+    'id': 'ar.id',
+    'date': 'ar.assessment_date',
+    'type': 'ar.assessment_type',
+    'visual_age': ['ar.visual_age_year', 'ar.visual_age_month'],
+    'auditory_age': ['ar.auditory_age_year', 'ar.auditory_age_month'],
+    'motor_age': ['ar.motor_age_year', 'ar.motor_age_month'],
+    'ratios': ['ar.visual_ratio', 'ar.auditory_ratio', 'ar.motor_ratio', 'ar.academic_ratio'],
+    'notes': 'ar.notes',
+    'student_name': 'st.name',
+}
+
+def _format_age(year, month):
+    return f"{year}-{month:02d}"
+
+ASSESSMENT_FORMATTERS = {
+    'visual_age': _format_age,
+    'auditory_age': _format_age,
+    'motor_age': _format_age,
+    'ratios': lambda visual, auditory, motor, academic: {
+        'visual': visual,
+        'auditory': auditory,
+        'motor': motor,
+        'academic': academic
+    },
+}
+
 class AssessmentManager:
     def __init__(self, db_path='course_management.db'):
         self.db_path = db_path
     
     def _get_connection(self):
-        return sqlite3.connect(self.db_path)
+        return get_backend(self.db_path).connect()
     
     def _parse_age(self, age_str):
         """
@@ -116,16 +146,19 @@ class AssessmentManager:
         
         return assessment_id
     
-    def get_student_assessments(self, student_id):
+    def get_student_assessments(self, student_id, fields=None):
         """
         查詢學員的所有檢測記錄
         
         Args:
             student_id: 學員ID或姓名
+            fields: 只回傳這些欄位（可選），如 ['date', 'type']
         
         Returns:
             檢測記錄列表，按日期降序排列
         """
+        projection = Projection(ASSESSMENT_FIELDS, fields, ASSESSMENT_FORMATTERS)
+        
         # 如果是姓名，轉換為ID
         if isinstance(student_id, str):
             from student_manager import StudentManager
@@ -138,47 +171,23 @@ class AssessmentManager:
         conn = self._get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT ar.id, ar.assessment_date, ar.assessment_type,
-                   ar.visual_age_year, ar.visual_age_month,
-                   ar.auditory_age_year, ar.auditory_age_month,
-                   ar.motor_age_year, ar.motor_age_month,
-                   ar.visual_ratio, ar.auditory_ratio, 
-                   ar.motor_ratio, ar.academic_ratio,
-                   ar.notes, st.name
+        join = 'JOIN students st ON ar.student_id = st.id' if projection.uses('st.') else ''
+        cursor.execute(f'''
+            SELECT {projection.select_list}
             FROM assessment_records ar
-            JOIN students st ON ar.student_id = st.id
+            {join}
             WHERE ar.student_id = ?
-            ORDER BY ar.assessment_date DESC
+            ORDER BY ar.assessment_day DESC
         ''', (student_id,))
         
         results = cursor.fetchall()
         conn.close()
         
-        assessments = []
-        for row in results:
-            assessments.append({
-                'id': row[0],
-                'date': row[1],
-                'type': row[2],
-                'visual_age': f"{row[3]}-{row[4]:02d}",
-                'auditory_age': f"{row[5]}-{row[6]:02d}",
-                'motor_age': f"{row[7]}-{row[8]:02d}",
-                'ratios': {
-                    'visual': row[9],
-                    'auditory': row[10],
-                    'motor': row[11],
-                    'academic': row[12]
-                },
-                'notes': row[13],
-                'student_name': row[14]
-            })
-        
-        return assessments
+        return [projection.to_dict(row) for row in results]
     
-    def get_latest_assessment(self, student_id):
+    def get_latest_assessment(self, student_id, fields=None):
         """取得學員最新的檢測記錄"""
-        assessments = self.get_student_assessments(student_id)
+        assessments = self.get_student_assessments(student_id, fields)
         return assessments[0] if assessments else None
     
     def compare_assessments(self, student_id):
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+出席警示：連續缺席/請假與出席率驟降
+
+所有學員一次以視窗函數計算，結果存在 attendance_alert_state；
+之後只重新計算上次之後有變更（change_log）或有課程日期剛過去的學員
+"""
+from datetime import date, datetime, timedelta
+import json
+import time
+
+from storage import get_backend
+from change_feed import ChangeFeed
+from time_columns import day_number, day_sql, from_day_number
+
+# 影響警示的表格：學員被刪除或離室、課程新增或停用時也要重新計算
+SOURCE_TABLES = ('attendance_records', 'leave_records', 'schedules', 'students')
+
+STATE_KEY = 'attendance_alerts_state'
+
+# 沒有出席過的學員從最早的記錄開始算
+_NO_ATTENDANCE = -1000000
+
+# 沒有上課記錄的排定課程最多往回展開幾週（連續未出席超過此週數時只計到這裡）
+LOOKBACK_WEEKS = 26
+
+# 每位學員最近一次出席的日期（依索引由新到舊找到第一筆出席即停止），
+# 只讀取這一天與上月初兩者較早者之後的記錄：連續未出席的區段與兩個月的出席率都在其中。
+# 每堂課來自上課記錄，加上啟用中課程在當天沒有上課記錄的排定日（課程建立後、基準日之前）：
+# 當天請假記為請假，否則記為缺席；沒有排課的日子請假不算一堂
+_EVALUATE_SQL = '''
+    WITH targets AS (
+        SELECT st.id AS student_id,
+               (SELECT ar.class_day FROM attendance_records ar
+                WHERE ar.student_id = st.id AND ar.attendance_status = '出席' AND ar.class_day <= ?
+                ORDER BY ar.class_day DESC
+                LIMIT 1) AS attended_day
+        FROM students st
+        WHERE 1 = 1{student_filter}
+    ),
+    bounds AS (
+        SELECT student_id,
+               CASE WHEN attended_day IS NULL THEN {no_attendance}
+                    WHEN attended_day < ? THEN attended_day
+                    ELSE ? END AS since
+        FROM targets
+    ),
+    weeks (k) AS (
+        VALUES {weeks}
+    ),
+    scheduled AS (
+        -- 展開的起點：since、課程建立日、回溯上限三者最晚者
+        SELECT b.student_id, s.weekday, s.start_minute,
+               CASE WHEN b.since > {created_day} AND b.since > ? THEN b.since
+                    WHEN {created_day} > ? THEN {created_day}
+                    ELSE ? END AS from_day
+        FROM bounds b
+        JOIN schedules s ON s.student_id = b.student_id AND s.is_active = 1
+    ),
+    slots AS (
+        -- 1970-01-01 為週四，(天數 + 3) % 7 即星期（0=週一）
+        SELECT sc.student_id, sc.start_minute,
+               sc.from_day + (sc.weekday - (sc.from_day + 3) % 7 + 7) % 7 + 7 * w.k AS day
+        FROM scheduled sc
+        CROSS JOIN weeks w
+    ),
+    sessions AS (
+        SELECT ar.student_id, ar.class_day AS day, ar.start_minute, ar.attendance_status AS status
+        FROM bounds b
+        JOIN attendance_records ar ON ar.student_id = b.student_id
+        WHERE ar.class_day >= b.since AND ar.class_day <= ?
+        UNION ALL
+        -- 基準日當天的課程可能還沒記錄，不計入
+        SELECT sl.student_id, sl.day, sl.start_minute,
+               CASE WHEN EXISTS (
+                        SELECT 1 FROM leave_records lr
+                        WHERE lr.student_id = sl.student_id AND lr.leave_day = sl.day
+                    ) THEN '請假' ELSE '缺席' END
+        FROM slots sl
+        WHERE sl.day < ?
+          AND NOT EXISTS (
+              SELECT 1 FROM attendance_records ar
+              WHERE ar.student_id = sl.student_id AND ar.class_day = sl.day
+          )
+    ),
+    -- 由最近一堂往回累計出席次數，累計仍為 0 的即為目前連續缺席/請假的區段
+    ranked AS (
+        SELECT student_id, day, status,
+               SUM(CASE WHEN status = '出席' THEN 1 ELSE 0 END) OVER (
+                   PARTITION BY student_id
+                   ORDER BY day DESC, start_minute DESC
+                   ROWS UNBOUNDED PRECEDING
+               ) AS attended_since
+        FROM sessions
+    ),
+    streaks AS (
+        SELECT student_id, COUNT(*) AS streak,
+               SUM(CASE WHEN status = '缺席' THEN 1 ELSE 0 END) AS absent,
+               SUM(CASE WHEN status = '請假' THEN 1 ELSE 0 END) AS leaves,
+               MIN(day) AS first_day, MAX(day) AS last_day
+        FROM ranked
+        WHERE attended_since = 0
+        GROUP BY student_id
+    ),
+    monthly AS (
+        SELECT student_id, CASE WHEN day >= ? THEN 1 ELSE 0 END AS period,
+               COUNT(*) AS sessions,
+               SUM(CASE WHEN status = '出席' THEN 1 ELSE 0 END) AS attended
+        FROM sessions
+        WHERE day >= ?
+        GROUP BY student_id, 2
+    ),
+    -- 本月的出席數，LAG 取同一學員前一期（上月）的堂數與出席數
+    rates AS (
+        SELECT student_id, period, sessions, attended,
+               LAG(sessions) OVER w AS prev_sessions,
+               LAG(attended) OVER w AS prev_attended
+        FROM monthly
+        WINDOW w AS (PARTITION BY student_id ORDER BY period)
+    )
+    SELECT t.student_id, COALESCE(sk.streak, 0), COALESCE(sk.absent, 0), COALESCE(sk.leaves, 0),
+           sk.first_day, sk.last_day,
+           COALESCE(r.sessions, 0), COALESCE(r.attended, 0),
+           COALESCE(r.prev_sessions, 0), COALESCE(r.prev_attended, 0)
+    FROM targets t
+    LEFT JOIN streaks sk ON sk.student_id = t.student_id
+    LEFT JOIN rates r ON r.student_id = t.student_id AND r.period = 1
+    WHERE sk.student_id IS NOT NULL OR r.student_id IS NOT NULL
+'''
+
+STATE_COLUMNS = ('student_id', 'streak', 'streak_absent', 'streak_leave', 'streak_first_day',
+                 'streak_last_day', 'sessions', 'attended', 'prev_sessions', 'prev_attended')
+
+def _month_start(day):
+    return day.replace(day=1)
+
+class AttendanceAlerts:
+    def __init__(self, db_path='course_management.db', chunk_size=500):
+        """
+        Args:
+            db_path: 資料庫路徑
+            chunk_size: 增量計算時每次查詢的學員數
+        """
+        self.db_path = db_path
+        self.chunk_size = chunk_size
+        self.dialect = get_backend(db_path).dialect
+
+    def _get_connection(self):
+        return get_backend(self.db_path).connect()
+
+    def evaluate(self, min_streak=3, rate_drop=0.3, min_sessions=3, as_of=None, full=False):
+        """
+        計算出席警示
+
+        Args:
+            min_streak: 連續缺席/請假達幾堂時警示
+            rate_drop: 本月出席率比上月低多少（0~1）時警示
+            min_sessions: 本月與上月都至少有幾堂課才比較出席率
+            as_of: 計算基準日（預設今天），之後的記錄不計入；本月指基準日所在月份
+            full: 忽略上次結果，重新計算所有學員
+
+        Returns:
+            {'streaks': [...], 'rate_drops': [...], 'evaluation': {'mode', 'students', 'elapsed_ms'}}
+        """
+        started = time.perf_counter()
+        if isinstance(as_of, str):
+            as_of = datetime.strptime(as_of.replace('/', '-'), '%Y-%m-%d').date()
+        as_of = as_of or date.today()
+        month = as_of.strftime('%Y-%m')
+        month_start = _month_start(as_of)
+        prev_start = _month_start(month_start - timedelta(days=1))
+
+        conn = self._get_connection()
+        cursor = conn.cursor()
+
+        try:
+            # 先取水位再計算：計算期間的寫入序號必定大於水位，下次會再算到
+            cursor.execute('SELECT COALESCE(MAX(seq), 0) FROM change_log')
+            seq = cursor.fetchone()[0]
+            touched = None if full else self._touched_students(cursor, month, as_of)
+
+            days = (day_number(as_of), day_number(month_start), day_number(prev_start))
+            if touched is None:
+                mode = 'full'
+                chunks = [None]
+            else:
+                mode = 'incremental'
+                chunks = [touched[index:index + self.chunk_size]
+                          for index in range(0, len(touched), self.chunk_size)]
+
+            # 先算完再寫入，計算期間不佔著寫入鎖
+            rows = []
+            for chunk in chunks:
+                rows.extend(self._compute(cursor, days, chunk))
+
+            if touched is None:
+                cursor.execute('DELETE FROM attendance_alert_state')
+                evaluated = len(rows)
+            else:
+                for chunk in chunks:
+                    cursor.execute(f'''
+                        DELETE FROM attendance_alert_state
+                        WHERE student_id IN ({', '.join('?' for _ in chunk)})
+                    ''', chunk)
+                evaluated = len(touched)
+
+            if rows:
+                cursor.executemany(f'''
+                    INSERT INTO attendance_alert_state ({', '.join(STATE_COLUMNS)})
+                    VALUES ({', '.join('?' for _ in STATE_COLUMNS)})
+                ''', rows)
+            cursor.execute('''
+                INSERT INTO skill_meta (key, value) VALUES (?, ?)
+                ON CONFLICT(key) DO UPDATE SET value = excluded.value
+            ''', (STATE_KEY, json.dumps({'seq': seq, 'day': day_number(as_of), 'month': month})))
+            conn.commit()
+
+            result = self._alerts(cursor, min_streak, rate_drop, min_sessions)
+        finally:
+            conn.close()
+
+        result['evaluation'] = {
+            'mode': mode,
+            'as_of': as_of.isoformat(),
+            'students': evaluated,
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+        }
+        return result
+
+    def _touched_students(self, cursor, month, as_of):
+        """
+        上次計算後需要重新計算的學員；無法增量時回傳 None（沒有上次結果、換月、
+        基準日往前、或變更記錄已被壓縮）；排定課程的日期剛過去的學員也要重新計算
+        """
+        cursor.execute('SELECT value FROM skill_meta WHERE key = ?', (STATE_KEY,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        state = json.loads(row[0])
+        today = day_number(as_of)
+        if state['month'] != month or state['day'] > today:
+            return None
+
+        cursor.execute('SELECT value FROM skill_meta WHERE key = ?', (ChangeFeed.COMPACTED_KEY,))
+        compacted = cursor.fetchone()
+        if compacted and int(compacted[0]) > state['seq']:
+            return None
+
+        # 上次計算時基準日當天的課程還沒計入，這次基準日之前的都要計入
+        weekdays = sorted({(day + 3) % 7 for day in range(state['day'], today)})
+        weekday_filter = ', '.join('?' for _ in weekdays) or 'NULL'
+        cursor.execute(f'''
+            SELECT DISTINCT student_id FROM change_log
+            WHERE seq > ? AND table_name IN ({', '.join('?' for _ in SOURCE_TABLES)})
+              AND student_id IS NOT NULL
+            UNION
+            SELECT student_id FROM attendance_records WHERE class_day > ? AND class_day <= ?
+            UNION
+            SELECT student_id FROM leave_records WHERE leave_day > ? AND leave_day <= ?
+            UNION
+            SELECT student_id FROM schedules WHERE is_active = 1 AND weekday IN ({weekday_filter})
+        ''', (state['seq'], *SOURCE_TABLES, state['day'], today, state['day'], today, *weekdays))
+        return sorted(row[0] for row in cursor.fetchall())
+
+    def _compute(self, cursor, days, student_ids=None):
+        """計算學員（預設全部）的連續未出席與兩個月的出席數"""
+        as_of, month_start, prev_start = days
+        student_filter = ''
+        filter_params = []
+        if student_ids is not None:
+            student_filter = f" AND st.id IN ({', '.join('?' for _ in student_ids)})"
+            filter_params = list(student_ids)
+
+        # created_at 為時間戳記，PostgreSQL 須先轉為日期
+        created = 's.created_at' if self.dialect == 'sqlite' else 'CAST(s.created_at AS DATE)'
+        sql = _EVALUATE_SQL.format(
+            student_filter=student_filter,
+            no_attendance=_NO_ATTENDANCE,
+            weeks=', '.join(f'({k})' for k in range(LOOKBACK_WEEKS + 1)),
+            created_day=day_sql(created, self.dialect),
+        )
+        floor = as_of - 7 * LOOKBACK_WEEKS
+        cursor.execute(sql, (
+            as_of, *filter_params,
+            prev_start, prev_start,
+            floor, floor, floor,
+            as_of, as_of,
+            month_start, prev_start,
+        ))
+        return cursor.fetchall()
+
+    def _alerts(self, cursor, min_streak, rate_drop, min_sessions):
+        """由計算結果套用門檻（離室學員不警示）"""
+        cursor.execute('''
+            SELECT a.student_id, st.name, a.streak, a.streak_absent, a.streak_leave,
+                   a.streak_first_day, a.streak_last_day
+            FROM attendance_alert_state a
+            JOIN students st ON a.student_id = st.id
+            WHERE a.streak >= ? AND st.status != '離室'
+            ORDER BY a.streak DESC, st.name
+        ''', (min_streak,))
+        streaks = [{
+            'student_id': row[0],
+            'student_name': row[1],
+            'streak': row[2],
+            'absent': row[3],
+            'leave': row[4],
+            'since': from_day_number(row[5]).isoformat(),
+            'last': from_day_number(row[6]).isoformat(),
+        } for row in cursor.fetchall()]
+
+        cursor.execute('''
+            SELECT a.student_id, st.name, a.sessions, a.attended, a.prev_sessions, a.prev_attended
+            FROM attendance_alert_state a
+            JOIN students st ON a.student_id = st.id
+            WHERE a.sessions >= ? AND a.prev_sessions >= ? AND st.status != '離室'
+        ''', (min_sessions, min_sessions))
+        rate_drops = []
+        for student_id, name, sessions, attended, prev_sessions, prev_attended in cursor.fetchall():
+            rate = attended / sessions
+            prev_rate = prev_attended / prev_sessions
+            if prev_rate - rate >= rate_drop:
+                rate_drops.append({
+                    'student_id': student_id,
+                    'student_name': name,
+                    'rate': round(rate, 3),
+                    'previous_rate': round(prev_rate, 3),
+                    'drop': round(prev_rate - rate, 3),
+                    'sessions': sessions,
+                    'previous_sessions': prev_sessions,
+                })
+        rate_drops.sort(key=lambda item: (-item['drop'], item['student_name']))
+
+        return {'streaks': streaks, 'rate_drops': rate_drops}
+
+
+def main():
+    """命令列介面"""
+    import sys
+
+    if len(sys.argv) < 2:
+        print("用法:")
+        print("  出席警示: python attendance_alerts.py evaluate [連續堂數] [出席率降幅]")
+        print("  全部重算: python attendance_alerts.py full [連續堂數] [出席率降幅]")
+        print("\n範例:")
+        print("  python attendance_alerts.py evaluate 3 0.3")
+        return
+
+    action = sys.argv[1]
+
+    if action in ('evaluate', 'full'):
+        min_streak = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+        rate_drop = float(sys.argv[3]) if len(sys.argv) > 3 else 0.3
+
+        alerts = AttendanceAlerts()
+        result = alerts.evaluate(min_streak, rate_drop, full=(action == 'full'))
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -2,16 +2,68 @@
 """
 上課記錄與請假管理功能
 """
-import sqlite3
 from datetime import datetime, timedelta
 import json
 
+from storage import get_backend, stream_connection
+from archive_manager import ArchiveManager
+from text_codec import TextCodec, ACTIVE_DICT_KEY, train_dictionary
+from projection import Projection
+from time_columns import day_number
+from note_queue import resolve_pending_notes
+
+# 查詢上課記錄可用的欄位：輸出鍵 → SQL 欄位
+ATTENDANCE_FIELDS = {
+    'id': 'ar.id',
+    'date': 'ar.class_date',
+    'start_time': 'ar.start_time',
+    'end_time': 'ar.end_time',
+    'status': 'ar.attendance_status',
+    'visual': 'ar.visual_content',
+    'auditory': 'ar.auditory_content',
+    'motor': 'ar.motor_content',
+    'notes': 'ar.notes',
+    'student_name': 'st.name',
+}
+
+# 可能經過壓縮、讀取時需解碼的長文字欄位
+ATTENDANCE_TEXT_FIELDS = ('visual', 'auditory', 'motor', 'notes')
+
+LEAVE_FIELDS = {
+    'id': 'lr.id',
+    'leave_date': 'lr.leave_date',
+    'reason': 'lr.reason',
+    'student_name': 'st.name',
+}
+
 class AttendanceManager:
-    def __init__(self, db_path='course_management.db'):
+    def __init__(self, db_path='course_management.db', write_buffer=None):
+        """
+        Args:
+            db_path: 資料庫路徑
+            write_buffer: 可選的 WriteBuffer，新增記錄時改由群組提交
+        """
         self.db_path = db_path
+        self.write_buffer = write_buffer
+        # 上課內容長文字欄位的透明壓縮（啟用後寫入壓縮、讀取自動解壓）
+        self.codec = TextCodec(db_path)
     
     def _get_connection(self):
-        return sqlite3.connect(self.db_path)
+        return get_backend(self.db_path).connect()
+    
+    def _insert(self, sql, params):
+        """執行單筆 INSERT 並回傳新資料的 ID"""
+        if self.write_buffer is not None:
+            return self.write_buffer.execute(sql, params)
+        
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute(sql, params)
+        record_id = cursor.lastrowid
+        conn.commit()
+        conn.close()
+        
+        return record_id
     
     def _parse_date(self, date_str):
         """轉換日期格式"""
@@ -90,22 +142,175 @@ class AttendanceManager:
         if isinstance(end_time, str) and ':' not in end_time:
             end_time = f"{end_time[:2]}:{end_time[2:]}"
         
-        conn = self._get_connection()
+        try:
+            return self._insert('''
+                INSERT INTO attendance_records 
+                (student_id, class_date, start_time, end_time, attendance_status,
+                 visual_content, auditory_content, motor_content, notes)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (student_id, class_date, start_time, end_time, status,
+                  self.codec.encode(visual), self.codec.encode(auditory),
+                  self.codec.encode(motor), self.codec.encode(notes)))
+        except get_backend(self.db_path).IntegrityError as exc:
+            if 'unique' not in str(exc).lower():
+                raise
+            raise ValueError(
+                f"{class_date} {start_time} 已有上課記錄，如需覆寫請使用 upsert_attendance_many"
+            ) from exc
+    
+    def upsert_attendance_many(self, records):
+        """
+        批次新增或更新上課記錄（以 學員+日期+開始時間 為自然鍵，可重複執行）
+        
+        Args:
+            records: 記錄列表，每筆欄位同 add_attendance
+                     (student, class_date, start_time, end_time, status,
+                      visual, auditory, motor, notes)
+        
+        Returns:
+            {'inserted': 新增筆數, 'updated': 更新筆數, 'unchanged': 內容相同未變動筆數}
+        """
+        from student_manager import StudentManager
+        sm = StudentManager(self.db_path)
+        student_ids = {}
+        
+        rows = []
+        for record in records:
+            student = record['student']
+            if isinstance(student, str):
+                if student not in student_ids:
+                    students = sm.get_student_by_name(student)
+                    if not students:
+                        raise ValueError(f"找不到學員: {student}")
+                    student_ids[student] = students[0]['id']
+                student = student_ids[student]
+            
+            class_date = record['class_date']
+            if isinstance(class_date, str):
+                class_date = self._parse_date(class_date)
+            
+            start_time = record['start_time']
+            end_time = record['end_time']
+            if isinstance(start_time, str) and ':' not in start_time:
+                start_time = f"{start_time[:2]}:{start_time[2:]}"
+            if isinstance(end_time, str) and ':' not in end_time:
+                end_time = f"{end_time[:2]}:{end_time[2:]}"
+            
+            rows.append((student, class_date, start_time, end_time,
+                         record.get('status', '出席'),
+                         self.codec.encode(record.get('visual')),
+                         self.codec.encode(record.get('auditory')),
+                         self.codec.encode(record.get('motor')),
+                         self.codec.encode(record.get('notes'))))
+        
+        if get_backend(self.db_path).dialect == 'postgresql':
+            return self._upsert_attendance_postgres(rows)
+        return self._upsert_attendance_sqlite(rows)
+    
+    def _upsert_attendance_sqlite(self, rows):
+        conn = get_backend(self.db_path).connect(isolation_level=None)
         cursor = conn.cursor()
         
-        cursor.execute('''
-            INSERT INTO attendance_records 
-            (student_id, class_date, start_time, end_time, attendance_status,
-             visual_content, auditory_content, motor_content, notes)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (student_id, class_date, start_time, end_time, status,
-              visual, auditory, motor, notes))
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('SELECT COALESCE(MAX(id), 0) FROM attendance_records')
+            max_id_before = cursor.fetchone()[0]
+            # 內容完全相同的列不觸發 UPDATE；rowcount 不含觸發器寫入的變更記錄
+            cursor.executemany('''
+                INSERT INTO attendance_records
+                (student_id, class_date, start_time, end_time, attendance_status,
+                 visual_content, auditory_content, motor_content, notes)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(student_id, class_date, start_time) DO UPDATE SET
+                    end_time = excluded.end_time,
+                    attendance_status = excluded.attendance_status,
+                    visual_content = excluded.visual_content,
+                    auditory_content = excluded.auditory_content,
+                    motor_content = excluded.motor_content,
+                    notes = excluded.notes
+                WHERE attendance_records.end_time IS NOT excluded.end_time
+                   OR attendance_records.attendance_status IS NOT excluded.attendance_status
+                   OR attendance_records.visual_content IS NOT excluded.visual_content
+                   OR attendance_records.auditory_content IS NOT excluded.auditory_content
+                   OR attendance_records.motor_content IS NOT excluded.motor_content
+                   OR attendance_records.notes IS NOT excluded.notes
+            ''', rows)
+            
+            changed = cursor.rowcount
+            # AUTOINCREMENT 保證新列的 ID 大於交易開始前的最大值
+            cursor.execute('SELECT COUNT(*) FROM attendance_records WHERE id > ?', (max_id_before,))
+            inserted = cursor.fetchone()[0]
+            cursor.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                cursor.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        
+        return {
+            'inserted': inserted,
+            'updated': changed - inserted,
+            'unchanged': len(rows) - changed,
+        }
+    
+    def _upsert_attendance_postgres(self, rows):
+        """COPY 到暫存表後以單一 INSERT ... SELECT ... ON CONFLICT 合併"""
+        # 同一批中重複的自然鍵以最後一筆為準（PostgreSQL 不允許同一語句更新同一列兩次）
+        deduped = {(row[0], row[1], row[2]): row for row in rows}
         
-        record_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        backend = get_backend(self.db_path)
+        conn = backend.connect()
+        cursor = conn.cursor()
         
-        return record_id
+        try:
+            cursor.execute('''
+                CREATE TEMP TABLE attendance_upsert (
+                    student_id INTEGER, class_date DATE, start_time TEXT, end_time TEXT,
+                    attendance_status TEXT, visual_content TEXT, auditory_content TEXT,
+                    motor_content TEXT, notes TEXT
+                ) ON COMMIT DROP
+            ''')
+            backend.copy_rows(conn, 'attendance_upsert', [
+                'student_id', 'class_date', 'start_time', 'end_time', 'attendance_status',
+                'visual_content', 'auditory_content', 'motor_content', 'notes',
+            ], deduped.values())
+            
+            cursor.execute('''
+                INSERT INTO attendance_records
+                (student_id, class_date, start_time, end_time, attendance_status,
+                 visual_content, auditory_content, motor_content, notes)
+                SELECT student_id, class_date, start_time, end_time, attendance_status,
+                       visual_content, auditory_content, motor_content, notes
+                FROM attendance_upsert
+                ON CONFLICT (student_id, class_date, start_time) DO UPDATE SET
+                    end_time = excluded.end_time,
+                    attendance_status = excluded.attendance_status,
+                    visual_content = excluded.visual_content,
+                    auditory_content = excluded.auditory_content,
+                    motor_content = excluded.motor_content,
+                    notes = excluded.notes
+                WHERE (attendance_records.end_time, attendance_records.attendance_status,
+                       attendance_records.visual_content, attendance_records.auditory_content,
+                       attendance_records.motor_content, attendance_records.notes)
+                      IS DISTINCT FROM
+                      (excluded.end_time, excluded.attendance_status,
+                       excluded.visual_content, excluded.auditory_content,
+                       excluded.motor_content, excluded.notes)
+                RETURNING (xmax = 0)
+            ''')
+            flags = [row[0] for row in cursor.fetchall()]
+            conn.commit()
+        finally:
+            conn.close()
+        
+        inserted = sum(1 for flag in flags if flag)
+        updated = len(flags) - inserted
+        return {
+            'inserted': inserted,
+            'updated': updated,
+            'unchanged': len(rows) - inserted - updated,
+        }
     
     def add_leave(self, student_id, leave_date, reason=None):
         """
@@ -129,21 +334,12 @@ class AttendanceManager:
         if isinstance(leave_date, str):
             leave_date = self._parse_date(leave_date)
         
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+        return self._insert('''
             INSERT INTO leave_records (student_id, leave_date, reason)
             VALUES (?, ?, ?)
         ''', (student_id, leave_date, reason))
-        
-        leave_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        
-        return leave_id
     
-    def get_student_attendance(self, student_id, start_date=None, end_date=None):
+    def get_student_attendance(self, student_id, start_date=None, end_date=None, fields=None):
         """
         查詢學員的上課記錄
         
@@ -151,7 +347,22 @@ class AttendanceManager:
             student_id: 學員ID或姓名
             start_date: 開始日期（可選）
             end_date: 結束日期（可選）
+            fields: 只回傳這些欄位（可選），如 ['date', 'status'] 供行事曆使用；
+                    不含上課內容時只讀索引，不讀取長文字欄位
         """
+        return list(self.iter_student_attendance(student_id, start_date, end_date, fields))
+    
+    def iter_student_attendance(self, student_id, start_date=None, end_date=None, fields=None):
+        """
+        與 get_student_attendance 相同，但由游標逐批讀取、逐筆產生（長文字欄位逐筆解壓），
+        多年的記錄不會同時留在記憶體
+        
+        查詢在呼叫時即執行（錯誤立即拋出），連線在產生器讀完或關閉時才關閉
+        """
+        projection = Projection(ATTENDANCE_FIELDS, fields, {
+            field: self.codec.decode for field in ATTENDANCE_TEXT_FIELDS
+        })
+        
         # 如果是姓名，轉換為ID
         if isinstance(student_id, str):
             from student_manager import StudentManager
@@ -161,52 +372,185 @@ class AttendanceManager:
                 return []
             student_id = students[0]['id']
         
-        conn = self._get_connection()
+        if start_date:
+            start_date = self._parse_date(start_date) if isinstance(start_date, str) else start_date
+        if end_date:
+            end_date = self._parse_date(end_date) if isinstance(end_date, str) else end_date
+        
+        conn = stream_connection(self.db_path)
+        try:
+            cursor = self._query_attendance(conn, projection, student_id, start_date, end_date)
+        except Exception:
+            conn.close()
+            raise
+        return projection.stream(conn, cursor)
+    
+    def _query_attendance(self, conn, projection, student_id, start_date, end_date):
+        """執行上課記錄查詢，回傳尚未讀取的游標"""
         cursor = conn.cursor()
         
-        query = '''
-            SELECT ar.id, ar.class_date, ar.start_time, ar.end_time,
-                   ar.attendance_status, ar.visual_content, ar.auditory_content,
-                   ar.motor_content, ar.notes, st.name
-            FROM attendance_records ar
-            JOIN students st ON ar.student_id = st.id
+        # 查詢範圍早於封存截止日時，一併讀取封存資料庫
+        source = ArchiveManager(self.db_path).read_source(
+            conn, 'attendance_records', student_id, start_date and start_date.isoformat(),
+            projection.source_columns('ar.', ('student_id', 'class_day', 'start_minute')))
+        
+        # 學員姓名只有被要求時才 JOIN
+        join = 'JOIN students st ON ar.student_id = st.id' if projection.uses('st.') else ''
+        query = f'''
+            SELECT {projection.select_list}
+            FROM {source} ar
+            {join}
             WHERE ar.student_id = ?
         '''
         params = [student_id]
         
         if start_date:
-            query += ' AND ar.class_date >= ?'
-            params.append(start_date)
+            query += ' AND ar.class_day >= ?'
+            params.append(day_number(start_date))
         
         if end_date:
-            query += ' AND ar.class_date <= ?'
-            params.append(end_date)
+            query += ' AND ar.class_day <= ?'
+            params.append(day_number(end_date))
         
-        query += ' ORDER BY ar.class_date DESC, ar.start_time'
+        query += ' ORDER BY ar.class_day DESC, ar.start_minute'
         
         cursor.execute(query, params)
-        results = cursor.fetchall()
+        return cursor
+    
+    def compress_text_columns(self, train=True, sample_size=1000, chunk_size=500,
+                              benchmark_students=50, vacuum=False):
+        """
+        啟用上課內容壓縮，並將既有的未壓縮文字逐批壓縮
+        
+        Args:
+            train: 是否從現有資料訓練新字典（已有字典時可設 False 沿用）
+            sample_size: 訓練字典的樣本筆數
+            chunk_size: 每個交易壓縮的筆數
+            benchmark_students: 前後比較查詢速度時抽樣的學員數
+            vacuum: 壓縮後是否執行 VACUUM；未執行時釋出的頁面留在 freelist，檔案大小不變
+        
+        Returns:
+            壓縮筆數、欄位與資料庫大小、查詢耗時的前後比較
+        """
+        import time
+        
+        if not self.codec.enabled:
+            raise ValueError("文字壓縮僅支援 SQLite 資料庫")
+        
+        columns = ['visual_content', 'auditory_content', 'motor_content', 'notes']
+        
+        def measure():
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute('SELECT ' + ' + '.join(
+                f'COALESCE(SUM(LENGTH(CAST({col} AS BLOB))), 0)' for col in columns
+            ) + ' FROM attendance_records')
+            column_bytes = cursor.fetchone()[0]
+            cursor.execute('PRAGMA page_count')
+            page_count = cursor.fetchone()[0]
+            cursor.execute('PRAGMA freelist_count')
+            freelist = cursor.fetchone()[0]
+            cursor.execute('PRAGMA page_size')
+            page_size = cursor.fetchone()[0]
+            cursor.execute('''
+                SELECT DISTINCT student_id FROM attendance_records ORDER BY student_id LIMIT ?
+            ''', (benchmark_students,))
+            student_ids = [row[0] for row in cursor.fetchall()]
+            conn.close()
+            
+            started = time.perf_counter()
+            for student_id in student_ids:
+                self.get_student_attendance(student_id)
+            elapsed = time.perf_counter() - started
+            
+            return {
+                'column_bytes': column_bytes,
+                'used_db_bytes': (page_count - freelist) * page_size,
+                'file_bytes': page_count * page_size,
+                'query_ms': round(elapsed * 1000, 1),
+            }
+        
+        before = measure()
+        
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        
+        dict_id = self.codec.active_dict_id()
+        text_filter = ' OR '.join(f"typeof({col}) = 'text'" for col in columns)
+        samples = []
+        if train or dict_id is None:
+            cursor.execute(f'''
+                SELECT {', '.join(columns)} FROM attendance_records
+                WHERE {text_filter}
+                ORDER BY RANDOM()
+                LIMIT ?
+            ''', (sample_size,))
+            samples = [value for row in cursor.fetchall() for value in row if isinstance(value, str)]
+            if not samples and dict_id is None:
+                conn.close()
+                raise ValueError("尚無上課內容可供訓練壓縮字典")
+        
+        # 沒有未壓縮的資料時沿用目前的字典
+        if samples:
+            cursor.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM compression_dicts')
+            dict_id = cursor.fetchone()[0]
+            cursor.execute('INSERT INTO compression_dicts (id, dictionary) VALUES (?, ?)',
+                           (dict_id, train_dictionary(samples)))
+            cursor.execute('''
+                INSERT INTO skill_meta (key, value) VALUES (?, ?)
+                ON CONFLICT(key) DO UPDATE SET value = excluded.value
+            ''', (ACTIVE_DICT_KEY, str(dict_id)))
+            conn.commit()
+            self.codec.invalidate()
+        
+        compressed = 0
+        last_id = 0
+        while True:
+            cursor.execute(f'''
+                SELECT id, {', '.join(columns)} FROM attendance_records
+                WHERE id > ? AND ({text_filter})
+                ORDER BY id
+                LIMIT ?
+            ''', (last_id, chunk_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            
+            updates = []
+            for row in rows:
+                values = [self.codec.encode(value) if isinstance(value, str) else value
+                          for value in row[1:]]
+                if values != list(row[1:]):
+                    updates.append(values + [row[0]])
+            
+            cursor.executemany(f'''
+                UPDATE attendance_records
+                SET {', '.join(f'{col} = ?' for col in columns)}
+                WHERE id = ?
+            ''', updates)
+            conn.commit()
+            
+            compressed += len(updates)
+            last_id = rows[-1][0]
+        
         conn.close()
         
-        records = []
-        for row in results:
-            records.append({
-                'id': row[0],
-                'date': row[1],
-                'start_time': row[2],
-                'end_time': row[3],
-                'status': row[4],
-                'visual': row[5],
-                'auditory': row[6],
-                'motor': row[7],
-                'notes': row[8],
-                'student_name': row[9]
-            })
-        
-        return records
+        if vacuum:
+            conn = get_backend(self.db_path).connect(isolation_level=None)
+            conn.execute('VACUUM')
+            conn.close()
+        
+        return {
+            'dict_id': dict_id,
+            'compressed_rows': compressed,
+            'before': before,
+            'after': measure(),
+        }
     
-    def get_student_leaves(self, student_id):
-        """查詢學員的請假記錄"""
+    def get_student_leaves(self, student_id, fields=None):
+        """查詢學員的請假記錄（fields 可只取部分欄位）"""
+        projection = Projection(LEAVE_FIELDS, fields)
+        
         # 如果是姓名，轉換為ID
         if isinstance(student_id, str):
             from student_manager import StudentManager
@@ -219,27 +563,23 @@ class AttendanceManager:
         conn = self._get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT lr.id, lr.leave_date, lr.reason, st.name
-            FROM leave_records lr
-            JOIN students st ON lr.student_id = st.id
+        source = ArchiveManager(self.db_path).read_source(
+            conn, 'leave_records', student_id,
+            columns=projection.source_columns('lr.', ('student_id', 'leave_day')))
+        
+        join = 'JOIN students st ON lr.student_id = st.id' if projection.uses('st.') else ''
+        cursor.execute(f'''
+            SELECT {projection.select_list}
+            FROM {source} lr
+            {join}
             WHERE lr.student_id = ?
-            ORDER BY lr.leave_date DESC
+            ORDER BY lr.leave_day DESC
         ''', (student_id,))
         
         results = cursor.fetchall()
         conn.close()
         
-        leaves = []
-        for row in results:
-            leaves.append({
-                'id': row[0],
-                'leave_date': row[1],
-                'reason': row[2],
-                'student_name': row[3]
-            })
-        
-        return leaves
+        return [projection.to_dict(row) for row in results]
     
     def add_class_note(self, student_id, note_date, note_type, content):
         """
@@ -264,19 +604,54 @@ class AttendanceManager:
         if isinstance(note_date, str):
             note_date = self._parse_date(note_date)
         
+        return self._insert('''
+            INSERT INTO class_notes (student_id, note_date, note_type, content)
+            VALUES (?, ?, ?, ?)
+        ''', (student_id, note_date, note_type, content))
+
+    
+    def complete_class_note(self, note_id):
+        """將課程備註標記為完成（之後不再出現在未完成佇列與每日課表）"""
         conn = self._get_connection()
         cursor = conn.cursor()
         
         cursor.execute('''
-            INSERT INTO class_notes (student_id, note_date, note_type, content)
-            VALUES (?, ?, ?, ?)
-        ''', (student_id, note_date, note_type, content))
+            UPDATE class_notes
+            SET is_completed = 1
+            WHERE id = ? AND is_completed = 0
+        ''', (note_id,))
         
-        note_id = cursor.lastrowid
         conn.commit()
+        success = cursor.rowcount > 0
+        conn.close()
+        
+        return success
+    
+    def get_pending_notes(self, student_id=None, as_of=None):
+        """
+        未完成的課程備註，各自對應到學員的下一堂課（跳過請假日）
+        
+        Args:
+            student_id: 學員ID或姓名（可選，預設所有學員）
+            as_of: 基準日（預設今天），備註從隔天開始找，備註日期已過去的從這天開始找下一堂課
+        """
+        if isinstance(student_id, str):
+            from student_manager import StudentManager
+            sm = StudentManager(self.db_path)
+            students = sm.get_student_by_name(student_id)
+            if not students:
+                return []
+            student_id = students[0]['id']
+        
+        as_of = self._parse_date(as_of) if isinstance(as_of, str) else (as_of or datetime.now().date())
+        
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        notes = resolve_pending_notes(cursor, day_number(as_of),
+                                      get_backend(self.db_path).dialect, student_id)
         conn.close()
         
-        return note_id
+        return notes
 
 
 def main():
@@ -288,6 +663,8 @@ def main():
         print("  新增請假: python attendance_manager.py leave <學員名> <日期>")
         print("  查出席記錄: python attendance_manager.py attendance <學員名>")
         print("  新增備註: python attendance_manager.py note <學員名> <日期> <類型> <內容>")
+        print("  未完成備註: python attendance_manager.py pending [學員名]")
+        print("  完成備註: python attendance_manager.py complete <備註ID>")
         return
     
     manager = AttendanceManager()
@@ -313,6 +690,18 @@ def main():
         
         note_id = manager.add_class_note(student, note_date, note_type, content)
         print(f"✅ 課程備註新增成功！ID: {note_id}")
+        
+    elif action == 'pending':
+        student = sys.argv[2] if len(sys.argv) > 2 else None
+        notes = manager.get_pending_notes(student)
+        print(json.dumps(notes, ensure_ascii=False, indent=2))
+        
+    elif action == 'complete':
+        note_id = int(sys.argv[2])
+        if manager.complete_class_note(note_id):
+            print(f"✅ 課程備註 {note_id} 已完成")
+        else:
+            print(f"❌ 找不到未完成的課程備註: {note_id}")
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+空堂查詢：將啟用中的課程轉為每週各天的佔用點陣圖，再以位元運算找出可排課時段
+"""
+import json
+
+from storage import get_backend
+from schedule_manager import ScheduleManager
+from time_columns import to_minutes as _to_minutes, format_minutes as _format_minutes
+
+def _runs(mask, length):
+    """回傳點陣圖：第 i 位為 1 代表第 i..i+length-1 位皆為 1（倍增位移，O(log length)）"""
+    span = 1
+    while span < length:
+        step = min(span, length - span)
+        mask &= mask >> step
+        span += step
+    return mask
+
+class AvailabilityEngine:
+    def __init__(self, db_path='course_management.db', granularity=10, capacity=1,
+                 day_start=None, day_end=None, exclude_breaks=True):
+        """
+        Args:
+            db_path: 資料庫路徑
+            granularity: 點陣圖每一格的分鐘數
+            capacity: 每個時段可同時上課的學員數
+            day_start / day_end: 營業時間，預設取標準時段的最早與最晚時間
+            exclude_breaks: 是否排除午休時段
+        """
+        self.db_path = db_path
+        self.granularity = granularity
+        self.capacity = capacity
+        self.schedule_manager = ScheduleManager(db_path)
+
+        slots = self.schedule_manager.time_slots
+        self.day_start = _to_minutes(day_start or min(start for start, _ in slots.values()))
+        self.day_end = _to_minutes(day_end or max(end for _, end in slots.values()))
+        self.bins = (self.day_end - self.day_start) // granularity
+
+        # 營業時間內、扣除午休的可排課遮罩
+        self.open_mask = (1 << self.bins) - 1
+        if exclude_breaks and '午休' in slots:
+            self.open_mask &= ~self._range_mask(*map(_to_minutes, slots['午休']))
+
+        # 標準時段的開始格，排序時優先推薦
+        self.standard_starts = {
+            self._bin(start) for name, (start, _) in slots.items() if name != '午休'
+        }
+
+        self._full = None
+
+    def _get_connection(self):
+        return get_backend(self.db_path).connect()
+
+    def _bin(self, time_str):
+        return (_to_minutes(time_str) - self.day_start) // self.granularity
+
+    def _range_mask(self, start_minute, end_minute):
+        """[start, end) 分鐘覆蓋的格子（部分覆蓋也算佔用），超出營業時間的部分截掉"""
+        start = max((start_minute - self.day_start) // self.granularity, 0)
+        end = min(-(-(end_minute - self.day_start) // self.granularity), self.bins)
+        if end <= start:
+            return 0
+        return ((1 << (end - start)) - 1) << start
+
+    def build_occupancy(self):
+        """
+        讀取啟用中的課程，建立每週各天的「已滿」點陣圖
+
+        Returns:
+            長度 7 的整數列表，第 i 位為 1 代表該格人數已達 capacity
+        """
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT weekday, start_minute, end_minute
+            FROM schedules
+            WHERE is_active = 1
+        ''')
+        results = cursor.fetchall()
+        conn.close()
+
+        # 以位元切片計數：layers[k] 為各格人數的第 k 個二進位位元，逐筆課程做位元加法
+        layer_count = max(self.capacity.bit_length(), 1) + 1
+        layers = [[0] * layer_count for _ in range(7)]
+        overflow = [0] * 7
+
+        for weekday, start_minute, end_minute in results:
+            carry = self._range_mask(start_minute, end_minute)
+            day_layers = layers[weekday]
+            for k in range(layer_count):
+                day_layers[k], carry = day_layers[k] ^ carry, day_layers[k] & carry
+                if not carry:
+                    break
+            overflow[weekday] |= carry
+
+        self._full = [self._at_least(layers[wd], self.capacity) | overflow[wd] for wd in range(7)]
+        return self._full
+
+    def _at_least(self, layers, threshold):
+        """位元切片比較：回傳人數 >= threshold 的格子"""
+        greater = 0
+        equal = (1 << self.bins) - 1
+        for k in reversed(range(len(layers))):
+            if (threshold >> k) & 1:
+                equal &= layers[k]
+            else:
+                greater |= equal & layers[k]
+                equal &= ~layers[k]
+        return greater | equal
+
+    def free_starts(self, weekday, duration):
+        """某一天可容納 duration 分鐘的所有開始時間"""
+        if self._full is None:
+            self.build_occupancy()
+
+        length = -(-duration // self.granularity)
+        free = self.open_mask & ~self._full[weekday]
+        fits = _runs(free, length)
+
+        starts = []
+        while fits:
+            low = fits & -fits
+            index = low.bit_length() - 1
+            start = self.day_start + index * self.granularity
+            starts.append({
+                'start_time': _format_minutes(start),
+                'end_time': _format_minutes(start + duration),
+                'standard': index in self.standard_starts,
+            })
+            fits ^= low
+        return starts
+
+    def find_open_slots(self, duration=100, weekdays=None, count=2):
+        """
+        找出可排入新學員的時段
+
+        Args:
+            duration: 每堂課分鐘數（預設 100 分鐘，與 add_schedule 相同）
+            weekdays: 偏好的星期列表（可用 一/二/... 或 0-6），優先在這些天中挑選
+            count: 每週需要幾堂課（分散在不同天）
+
+        Returns:
+            {'suggested': 推薦的 count 個時段, 'available': 各天所有可用開始時間}
+        """
+        weekday_names = ['週一', '週二', '週三', '週四', '週五', '週六', '週日']
+
+        preferred = []
+        for weekday in weekdays or []:
+            if isinstance(weekday, str):
+                weekday = self.schedule_manager._parse_weekday(weekday)
+            preferred.append(int(weekday))
+        search_order = preferred + [wd for wd in range(7) if wd not in preferred]
+
+        available = {}
+        suggested = []
+        for weekday in search_order:
+            starts = self.free_starts(weekday, duration)
+            if not starts:
+                continue
+            available[weekday_names[weekday]] = starts
+
+            if len(suggested) < count:
+                # 優先推薦標準時段，其次最早的時間
+                best = min(starts, key=lambda slot: (not slot['standard'], slot['start_time']))
+                suggested.append({
+                    'weekday': weekday,
+                    'weekday_name': weekday_names[weekday],
+                    'start_time': best['start_time'],
+                    'end_time': best['end_time'],
+                    'preferred': weekday in preferred,
+                })
+
+        return {
+            'duration': duration,
+            'capacity': self.capacity,
+            'suggested': suggested,
+            'available': available,
+        }
+
+
+def main():
+    """命令列介面"""
+    import sys
+
+    if len(sys.argv) < 2:
+        print("用法:")
+        print("  找空堂: python availability.py find [分鐘數] [每週堂數] [偏好星期...]")
+        print("\n範例:")
+        print("  python availability.py find 100 2 二 四")
+        return
+
+    action = sys.argv[1]
+
+    if action == 'find':
+        duration = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+        count = int(sys.argv[3]) if len(sys.argv) > 3 else 2
+        weekdays = sys.argv[4:]
+
+        engine = AvailabilityEngine()
+        result = engine.find_open_slots(duration, weekdays, count)
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+
+if __name__ == '__main__':
+    main()
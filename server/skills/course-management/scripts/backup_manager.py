@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+線上備份：以 sqlite3 backup API 分段複製，不影響營業時間的寫入
+"""
+import sqlite3
+import time
+from datetime import datetime
+from pathlib import Path
+import json
+
+from storage import get_backend
+
+class BackupManager:
+    def __init__(self, db_path='course_management.db', backup_dir=None):
+        """
+        Args:
+            db_path: 資料庫路徑
+            backup_dir: 備份目錄，預設為資料庫旁的 backups/
+        """
+        self.db_path = db_path
+        self.backup_dir = Path(backup_dir) if backup_dir else Path(db_path).resolve().parent / 'backups'
+
+    def _rotate(self, stem, keep):
+        """只保留最新的 keep 份備份（檔名含時間戳，依名稱排序即依時間排序）"""
+        removed = []
+        for pattern in (f'{stem}-*[0-9].db', f'{stem}-*.compact.db'):
+            backups = sorted(self.backup_dir.glob(pattern))
+            for path in backups[:-keep] if keep > 0 else []:
+                path.unlink()
+                removed.append(str(path))
+        return removed
+
+    def backup(self, pages=256, sleep_ms=50, keep=7, vacuum=False):
+        """
+        分段備份資料庫
+
+        每次複製 pages 頁後暫停 sleep_ms 毫秒，讓其他連線有機會寫入；
+        備份期間來源有寫入時，backup API 會自動重新複製變動的頁面
+
+        Args:
+            pages: 每一步複製的頁數
+            sleep_ms: 每步之間暫停的毫秒數
+            keep: 保留的備份份數
+            vacuum: 是否另外以 VACUUM INTO 產生壓縮過的備份
+
+        Returns:
+            備份路徑、頁數、耗時、每秒頁數等統計
+        """
+        if get_backend(self.db_path).dialect != 'sqlite':
+            raise ValueError("線上備份僅支援 SQLite 資料庫")
+
+        self.backup_dir.mkdir(parents=True, exist_ok=True)
+        stem = Path(self.db_path).stem
+        # 時間戳含微秒，同一秒內的多次備份不會互相覆蓋（輪替也才不會少算）
+        timestamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        target = self.backup_dir / f'{stem}-{timestamp}.db'
+        partial = target.with_suffix('.db.partial')
+        if target.exists() or partial.exists():
+            raise ValueError(f"備份檔已存在: {target}")
+
+        stats = {'steps': 0, 'pages': 0}
+
+        def progress(status, remaining, total):
+            stats['steps'] += 1
+            stats['pages'] = total
+            if remaining:
+                time.sleep(sleep_ms / 1000)
+
+        source = sqlite3.connect(self.db_path)
+        # 先寫到暫存檔，完成後才改名，避免留下不完整的備份
+        dest = sqlite3.connect(partial)
+        started = time.perf_counter()
+        try:
+            source.backup(dest, pages=pages, progress=progress)
+        finally:
+            dest.close()
+            source.close()
+        duration = time.perf_counter() - started
+        partial.replace(target)
+
+        result = {
+            'target': str(target),
+            'bytes': target.stat().st_size,
+            'pages': stats['pages'],
+            'steps': stats['steps'],
+            'duration_ms': round(duration * 1000, 1),
+            'pages_per_second': round(stats['pages'] / duration, 1) if duration > 0 else None,
+        }
+
+        if vacuum:
+            compact_target = self.backup_dir / f'{stem}-{timestamp}.compact.db'
+            conn = sqlite3.connect(self.db_path)
+            started = time.perf_counter()
+            try:
+                conn.execute('VACUUM INTO ?', (str(compact_target),))
+            finally:
+                conn.close()
+            result['compact_target'] = str(compact_target)
+            result['compact_bytes'] = compact_target.stat().st_size
+            result['compact_duration_ms'] = round((time.perf_counter() - started) * 1000, 1)
+
+        result['removed'] = self._rotate(stem, keep)
+        return result
+
+
+def main():
+    """命令列介面"""
+    import sys
+
+    if len(sys.argv) < 2:
+        print("用法:")
+        print("  備份資料庫: python backup_manager.py backup [保留份數] [--vacuum]")
+        return
+
+    manager = BackupManager()
+    action = sys.argv[1]
+
+    if action == 'backup':
+        args = [arg for arg in sys.argv[2:] if not arg.startswith('--')]
+        keep = int(args[0]) if args else 7
+        result = manager.backup(keep=keep, vacuum='--vacuum' in sys.argv)
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+變更記錄（CDC）：讓儀表板依序號增量同步，不必重新拉取整張表
+"""
+from datetime import datetime, timedelta
+import json
+
+from storage import get_backend, stream_connection
+from text_codec import TextCodec
+
+# 資料已不在主資料庫的變更類型：delete 為刪除，archive 為封存搬移（仍可由封存資料庫讀取）
+REMOVED_OPS = ('delete', 'archive')
+
+class ChangeFeed:
+    # 已壓縮（刪除）的最大序號，小於此值的游標必須全量重新同步
+    COMPACTED_KEY = 'change_log_compacted_seq'
+    # 逐筆輸出變更時，每批附上資料內容的筆數
+    ROW_BATCH = 200
+
+    def __init__(self, db_path='course_management.db'):
+        self.db_path = db_path
+
+    def _get_connection(self):
+        return get_backend(self.db_path).connect()
+
+    def _compacted_seq(self, cursor):
+        cursor.execute('SELECT value FROM skill_meta WHERE key = ?', (self.COMPACTED_KEY,))
+        row = cursor.fetchone()
+        return int(row[0]) if row else 0
+
+    def write_version(self, tables, cursor=None):
+        """
+        表格的寫入版本：相關表格最新一筆變更的序號，資料沒有寫入就不會改變，
+        可作為統計快取的鍵；相關變更都已被壓縮時以壓縮序號代替
+
+        Args:
+            tables: 表格名稱列表
+            cursor: 沿用呼叫端的連線（與讀取資料在同一交易內），預設另開連線
+        """
+        conn = None
+        if cursor is None:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+
+        version = self._compacted_seq(cursor)
+        for table in tables:
+            # idx_change_log_table 讓每個表格只需讀一筆索引
+            cursor.execute('SELECT MAX(seq) FROM change_log WHERE table_name = ?', (table,))
+            latest = cursor.fetchone()[0]
+            if latest is not None:
+                version = max(version, latest)
+
+        if conn is not None:
+            conn.close()
+        return version
+
+    def changes_since(self, seq=0, limit=500, include_rows=True):
+        """
+        取得序號 seq 之後的變更
+
+        同一筆資料在範圍內的多次變更會合併為一筆：
+        新增後刪除（或封存）視為無變更、新增後更新仍為新增
+
+        Args:
+            seq: 上次同步取得的 next_seq
+            limit: 本次最多讀取的變更記錄數
+            include_rows: 是否附上新增/更新資料的目前內容
+
+        Returns:
+            {'changes': [...], 'next_seq': 下次同步的游標, 'has_more': 是否還有更多,
+             'reset_required': 游標已被壓縮，需全量重新同步}
+        """
+        result = self.stream_changes_since(seq, limit, include_rows)
+        result['changes'] = list(result['changes'])
+        return result
+
+    def stream_changes_since(self, seq=0, limit=500, include_rows=True):
+        """
+        與 changes_since 相同，但 changes 為產生器：資料內容每 ROW_BATCH 筆查詢一次後逐筆產生，
+        整頁的資料內容不會同時留在記憶體（合併只需要變更記錄本身，仍在呼叫時完成）
+        """
+        conn = stream_connection(self.db_path)
+        try:
+            cursor = conn.cursor()
+            compacted_seq = self._compacted_seq(cursor)
+            if seq < compacted_seq:
+                cursor.execute('SELECT COALESCE(MAX(seq), 0) FROM change_log')
+                latest_seq = cursor.fetchone()[0]
+                conn.close()
+                return {
+                    'changes': [],
+                    'next_seq': max(latest_seq, compacted_seq),
+                    'has_more': False,
+                    'reset_required': True,
+                }
+
+            cursor.execute('''
+                SELECT seq, table_name, row_id, student_id, op
+                FROM change_log
+                WHERE seq > ?
+                ORDER BY seq
+                LIMIT ?
+            ''', (seq, limit + 1))
+            results = cursor.fetchall()
+        except Exception:
+            conn.close()
+            raise
+
+        has_more = len(results) > limit
+        results = results[:limit]
+        next_seq = results[-1][0] if results else seq
+
+        merged = {}
+        for change_seq, table, row_id, student_id, op in results:
+            key = (table, row_id)
+            previous = merged.get(key)
+            if previous is not None and previous['op'] == 'insert':
+                if op in REMOVED_OPS:
+                    del merged[key]
+                    continue
+                op = 'insert'
+            merged.pop(key, None)
+            merged[key] = {
+                'seq': change_seq,
+                'table': table,
+                'id': row_id,
+                'student_id': student_id,
+                'op': op,
+            }
+
+        return {
+            'changes': self._stream_changes(conn, list(merged.values()), include_rows),
+            'next_seq': next_seq,
+            'has_more': has_more,
+            'reset_required': False,
+        }
+
+    def _stream_changes(self, conn, changes, include_rows):
+        """依序產生變更，需要時每 ROW_BATCH 筆附上一次資料內容；結束時關閉連線"""
+        try:
+            cursor = conn.cursor()
+            for start in range(0, len(changes), self.ROW_BATCH):
+                batch = changes[start:start + self.ROW_BATCH]
+                if include_rows:
+                    self._attach_rows(cursor, batch)
+                yield from batch
+        finally:
+            conn.close()
+
+    def _attach_rows(self, cursor, changes):
+        """每個表格一次查詢，附上這批變更中新增/更新資料的目前內容"""
+        ids_by_table = {}
+        for change in changes:
+            if change['op'] not in REMOVED_OPS:
+                ids_by_table.setdefault(change['table'], []).append(change['id'])
+
+        codec = TextCodec(self.db_path)
+        rows_by_key = {}
+        for table, ids in ids_by_table.items():
+            placeholders = ', '.join('?' for _ in ids)
+            cursor.execute(f'SELECT * FROM {table} WHERE id IN ({placeholders})', ids)
+            columns = [desc[0] for desc in cursor.description]
+            for row in cursor.fetchall():
+                record = {column: codec.decode(value) for column, value in zip(columns, row)}
+                rows_by_key[(table, record['id'])] = record
+
+        for change in changes:
+            if change['op'] not in REMOVED_OPS:
+                # 之後又被刪除的資料，等後續的 delete 記錄處理
+                change['row'] = rows_by_key.get((change['table'], change['id']))
+
+    def compact(self, retention_days=30):
+        """
+        刪除超過保留天數的變更記錄
+
+        Returns:
+            {'deleted': 刪除筆數, 'compacted_seq': 新的壓縮序號}
+        """
+        cutoff = datetime.utcnow() - timedelta(days=retention_days)
+
+        conn = self._get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT MAX(seq) FROM change_log WHERE changed_at < ?
+        ''', (cutoff.strftime('%Y-%m-%d %H:%M:%S'),))
+        compact_to = cursor.fetchone()[0]
+
+        if compact_to is None:
+            compacted_seq = self._compacted_seq(cursor)
+            conn.close()
+            return {'deleted': 0, 'compacted_seq': compacted_seq}
+
+        cursor.execute('DELETE FROM change_log WHERE seq <= ?', (compact_to,))
+        deleted = cursor.rowcount
+        cursor.execute('''
+            INSERT INTO skill_meta (key, value) VALUES (?, ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value
+        ''', (self.COMPACTED_KEY, str(compact_to)))
+
+        conn.commit()
+        conn.close()
+
+        return {'deleted': deleted, 'compacted_seq': compact_to}
+
+
+def main():
+    """命令列介面"""
+    import sys
+
+    if len(sys.argv) < 2:
+        print("用法:")
+        print("  查詢變更: python change_feed.py since <序號> [筆數]")
+        print("  壓縮記錄: python change_feed.py compact [保留天數]")
+        return
+
+    feed = ChangeFeed()
+    action = sys.argv[1]
+
+    if action == 'since':
+        seq = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+        limit = int(sys.argv[3]) if len(sys.argv) > 3 else 500
+        print(json.dumps(feed.changes_since(seq, limit), ensure_ascii=False, indent=2))
+
+    elif action == 'compact':
+        days = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+        print(json.dumps(feed.compact(days), ensure_ascii=False, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+檢測族群統計：依學員類型、檢測類型、期間分組，計算發展年齡與課程比例的百分位數及平均
+
+多中心分片時百分位數無法由各中心的結果合併，各分片只讀取原始數值（load_rows），
+合併後再一次計算（combine）
+"""
+import json
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from storage import get_backend
+from change_feed import ChangeFeed
+from stat_cache import StatCache
+
+# 統計欄位：發展年齡換算為月數，年或月缺值時視為缺值
+METRICS = {
+    'visual_age_months': 'ar.visual_age_year * 12 + ar.visual_age_month',
+    'auditory_age_months': 'ar.auditory_age_year * 12 + ar.auditory_age_month',
+    'motor_age_months': 'ar.motor_age_year * 12 + ar.motor_age_month',
+    'visual_ratio': 'ar.visual_ratio',
+    'auditory_ratio': 'ar.auditory_ratio',
+    'motor_ratio': 'ar.motor_ratio',
+    'academic_ratio': 'ar.academic_ratio',
+}
+
+GROUP_KEYS = ('type', 'assessment_type', 'period')
+PERIODS = ('month', 'quarter', 'year')
+
+# 結果依賴的表格：學員類型也是分組鍵
+SOURCE_TABLES = ['assessment_records', 'students']
+
+def _grouped_percentiles(codes, values, group_count, percentiles):
+    """
+    各組的百分位數（線性內插，與 np.percentile 預設相同），缺值不計
+
+    以 lexsort 一次排序全部資料，各組在排序後是連續區段，直接依位置取值，
+    不需逐組呼叫 np.percentile
+
+    Returns:
+        (各組非缺值筆數, group_count × len(percentiles) 的矩陣)
+    """
+    valid = ~np.isnan(values)
+    codes, values = codes[valid], values[valid]
+    counts = np.bincount(codes, minlength=group_count)
+    result = np.full((group_count, len(percentiles)), np.nan)
+    if len(values) == 0:
+        return counts, result
+
+    sorted_values = values[np.lexsort((values, codes))]
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    position = (np.maximum(counts, 1) - 1)[:, None] * (np.asarray(percentiles) / 100)[None, :]
+    low = np.floor(position).astype('int64')
+    high = np.ceil(position).astype('int64')
+    fraction = position - low
+
+    last = len(sorted_values) - 1
+    low_values = sorted_values[np.minimum(starts[:, None] + low, last)]
+    high_values = sorted_values[np.minimum(starts[:, None] + high, last)]
+    present = counts > 0
+    result[present] = (low_values + (high_values - low_values) * fraction)[present]
+    return counts, result
+
+def _period_labels(dates, period):
+    """日期陣列轉為期間代碼與顯示標籤的對照"""
+    months = dates.astype('datetime64[M]').astype('int64')
+    if period == 'month':
+        codes = months
+        label = lambda code: f"{1970 + code // 12}-{code % 12 + 1:02d}"
+    elif period == 'quarter':
+        codes = months // 3
+        label = lambda code: f"{1970 + code // 4}-Q{code % 4 + 1}"
+    else:
+        codes = months // 12
+        label = lambda code: str(1970 + code)
+    return codes, label
+
+def _summarize(rows, group_by, period, percentiles):
+    """依分組鍵計算各組的筆數、平均與百分位數"""
+    columns = list(zip(*rows))
+    values = np.array(columns[3:], dtype='float64').T
+
+    # 各分組鍵轉為整數代碼，再組合成單一組別代碼
+    dimensions = []
+    for key in group_by:
+        if key == 'period':
+            days = np.array(columns[2], dtype='int64').astype('datetime64[D]')
+            codes, label = _period_labels(days, period)
+            uniques, codes = np.unique(codes, return_inverse=True)
+            labels = [label(int(code)) for code in uniques]
+        else:
+            raw = np.array([value or '' for value in columns[GROUP_KEYS.index(key)]], dtype=object)
+            uniques, codes = np.unique(raw, return_inverse=True)
+            labels = [value or None for value in uniques]
+        dimensions.append((key, codes.reshape(-1), labels))
+
+    combined = np.zeros(len(rows), dtype='int64')
+    for _, codes, labels in dimensions:
+        combined = combined * len(labels) + codes
+    group_ids, codes = np.unique(combined, return_inverse=True)
+    codes = codes.reshape(-1)
+    group_count = len(group_ids)
+
+    counts = np.bincount(codes, minlength=group_count)
+    metric_stats = {}
+    for index, name in enumerate(METRICS):
+        column = values[:, index]
+        present = ~np.isnan(column)
+        sums = np.bincount(codes, np.where(present, column, 0), minlength=group_count)
+        n, quantiles = _grouped_percentiles(codes, column, group_count, percentiles)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means = sums / n
+        metric_stats[name] = (n, means, quantiles)
+
+    def number(value):
+        return None if np.isnan(value) else round(float(value), 2)
+
+    groups = []
+    for group, group_id in enumerate(group_ids):
+        entry = {}
+        # 由組合代碼還原各分組鍵
+        remainder = int(group_id)
+        for key, _, labels in reversed(dimensions):
+            entry[key] = labels[remainder % len(labels)]
+            remainder //= len(labels)
+        entry = {key: entry[key] for key in group_by}
+        entry['count'] = int(counts[group])
+
+        entry['metrics'] = {}
+        for name, (n, means, quantiles) in metric_stats.items():
+            stats = {'n': int(n[group]), 'mean': number(means[group])}
+            for p, value in zip(percentiles, quantiles[group]):
+                stats[f"p{p:g}"] = number(value)
+            entry['metrics'][name] = stats
+        groups.append(entry)
+
+    return groups
+
+def _check_options(group_by, period, percentiles):
+    """檢查並整理參數，回傳 (group_by, percentiles)"""
+    group_by = list(group_by or GROUP_KEYS)
+    unknown = [key for key in group_by if key not in GROUP_KEYS]
+    if unknown:
+        raise ValueError(f"不支援的分組鍵: {', '.join(unknown)}，可用: {', '.join(GROUP_KEYS)}")
+    if period not in PERIODS:
+        raise ValueError(f"不支援的期間單位: {period}，可用: {', '.join(PERIODS)}")
+    return group_by, [float(p) for p in percentiles]
+
+def _fetch_rows(cursor):
+    cursor.execute(f'''
+        SELECT st.type, ar.assessment_type, ar.assessment_day,
+               {', '.join(METRICS.values())}
+        FROM assessment_records ar
+        JOIN students st ON ar.student_id = st.id
+    ''')
+    return cursor.fetchall()
+
+class CohortStats:
+    CACHE_PREFIX = 'cohort_stats:'
+
+    def __init__(self, db_path='course_management.db'):
+        if np is None:
+            raise RuntimeError("族群統計需要安裝 numpy: pip install numpy")
+        self.db_path = db_path
+
+    def _get_connection(self):
+        return get_backend(self.db_path).connect()
+
+    def load_rows(self):
+        """
+        讀取統計用的原始數值，供跨中心統計合併
+
+        Returns:
+            (寫入版本, 資料列列表)
+        """
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        version = ChangeFeed(self.db_path).write_version(SOURCE_TABLES, cursor)
+        rows = _fetch_rows(cursor)
+        conn.close()
+        return version, rows
+
+    @staticmethod
+    def combine(per_center, group_by=None, period='year', percentiles=(10, 25, 50, 75, 90)):
+        """
+        合併多個中心的原始數值後計算分組統計（各中心的百分位數無法直接合併）
+
+        Args:
+            per_center: {中心代碼: load_rows() 的結果}
+
+        Returns:
+            與 compute 相同，version 為 {中心代碼: 寫入版本}，另附 centers；不使用快取
+        """
+        if np is None:
+            raise RuntimeError("族群統計需要安裝 numpy: pip install numpy")
+        group_by, percentiles = _check_options(group_by, period, percentiles)
+        rows = [row for _, center_rows in per_center.values() for row in center_rows]
+        return {
+            'version': {center: version for center, (version, _) in per_center.items()},
+            'centers': list(per_center),
+            'group_by': group_by,
+            'period': period if 'period' in group_by else None,
+            'percentiles': percentiles,
+            'total': len(rows),
+            'groups': _summarize(rows, group_by, period, percentiles) if rows else [],
+            'cached': False,
+        }
+
+    def compute(self, group_by=None, period='year', percentiles=(10, 25, 50, 75, 90), use_cache=True):
+        """
+        計算分組統計
+
+        Args:
+            group_by: 分組鍵，可用 type / assessment_type / period，預設三者皆用
+            period: 期間單位 month / quarter / year
+            percentiles: 要計算的百分位數
+            use_cache: 檢測與學員資料沒有寫入時沿用上次的結果
+
+        Returns:
+            {'groups': [{分組鍵..., 'count': 筆數, 'metrics': {欄位: {'n', 'mean', 'p50', ...}}}], ...}
+        """
+        group_by, percentiles = _check_options(group_by, period, percentiles)
+
+        cache = StatCache(self.db_path)
+        cache_key = self.CACHE_PREFIX + json.dumps(
+            {'group_by': group_by, 'period': period, 'percentiles': percentiles}, sort_keys=True)
+
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        version = ChangeFeed(self.db_path).write_version(SOURCE_TABLES, cursor)
+
+        if use_cache:
+            cached = cache.get(cache_key, version)
+            if cached is not None:
+                conn.close()
+                return dict(cached, cached=True)
+
+        rows = _fetch_rows(cursor)
+        conn.close()
+
+        result = {
+            'version': version,
+            'group_by': group_by,
+            'period': period if 'period' in group_by else None,
+            'percentiles': percentiles,
+            'total': len(rows),
+            'groups': _summarize(rows, group_by, period, percentiles) if rows else [],
+        }
+        cache.put(cache_key, version, result)
+        return dict(result, cached=False)
+
+
+def main():
+    """命令列介面"""
+    import sys
+
+    if len(sys.argv) < 2:
+        print("用法:")
+        print("  族群統計: python cohort_stats.py compute [期間 month/quarter/year] [分組鍵...]")
+        print("\n範例:")
+        print("  python cohort_stats.py compute quarter type period")
+        return
+
+    action = sys.argv[1]
+
+    if action == 'compute':
+        period = sys.argv[2] if len(sys.argv) > 2 else 'year'
+        group_by = sys.argv[3:] or None
+
+        stats = CohortStats()
+        result = stats.compute(group_by, period)
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -2,15 +2,20 @@
 """
 初始化課程管理系統資料庫
 """
-import sqlite3
 from datetime import datetime
+from pathlib import Path
 import os
+import sys
 
-def init_database(db_path='course_management.db'):
-    """初始化資料庫，建立所有必要的表格"""
+from archive_manager import ARCHIVE_TABLES, ArchiveManager
+from storage import get_backend, is_postgres_url
+from time_columns import TIME_COLUMNS, column_sql
+
+def _create_tables(cursor):
+    """建立所有必要的表格（已存在則略過）"""
     
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    # 新資料庫在建立第一個表格前設定才會生效（既有資料庫不受影響，見遷移 12）
+    cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
     
     # 1. 個案（學員）基本資料表
     cursor.execute('''
@@ -108,18 +113,505 @@ def init_database(db_path='course_management.db'):
         )
     ''')
     
+    # 7. 繳費記錄表（每筆應收/已收的款項）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS payments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            student_id INTEGER NOT NULL,
+            amount INTEGER NOT NULL CHECK(amount > 0),
+            status TEXT CHECK(status IN ('未繳', '已繳')) DEFAULT '未繳',
+            invoice_status TEXT DEFAULT '未開立',
+            paid_at DATE,
+            method TEXT DEFAULT '現金',
+            invoice_no TEXT,
+            sessions_count INTEGER,
+            month_ref TEXT,
+            note TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (student_id) REFERENCES students(id)
+        )
+    ''')
+    
     # 建立索引以提升查詢效能
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_students_name ON students(name)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_schedules_student ON schedules(student_id)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_attendance_student_date ON attendance_records(student_id, class_date)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_assessment_student ON assessment_records(student_id, assessment_date)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_leave_student_date ON leave_records(student_id, leave_date)')
+
+
+def _migration_attendance_natural_key(cursor):
+    """上課記錄以 (學員, 日期, 開始時間) 為自然鍵，先移除重複資料（保留最新一筆）"""
+    cursor.execute('''
+        DELETE FROM attendance_records
+        WHERE id NOT IN (
+            SELECT MAX(id) FROM attendance_records
+            GROUP BY student_id, class_date, start_time
+        )
+    ''')
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_attendance_natural_key
+        ON attendance_records(student_id, class_date, start_time)
+    ''')
+    # 唯一索引已涵蓋 (student_id, class_date) 前綴，舊索引只會增加寫入成本
+    cursor.execute('DROP INDEX IF EXISTS idx_attendance_student_date')
+
+
+# 變更記錄涵蓋的表格，及各表格取得學員ID的欄位
+CHANGE_TRACKED_TABLES = {
+    'students': 'id',
+    'schedules': 'student_id',
+    'attendance_records': 'student_id',
+    'assessment_records': 'student_id',
+    'leave_records': 'student_id',
+    'class_notes': 'student_id',
+    'payments': 'student_id',
+}
+
+
+def _migration_change_log(cursor):
+    """建立變更記錄表與觸發器，供 changes_since 增量同步"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS skill_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            student_id INTEGER,
+            op TEXT CHECK(op IN ('insert', 'update', 'delete')) NOT NULL,
+            changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    for table, student_column in CHANGE_TRACKED_TABLES.items():
+        for op, event, ref in (('insert', 'INSERT', 'NEW'),
+                               ('update', 'UPDATE', 'NEW'),
+                               ('delete', 'DELETE', 'OLD')):
+            _create_change_log_trigger(cursor, table, student_column, op, event, ref)
+
+
+def _create_change_log_trigger(cursor, table, student_column, op, event, ref, when='', op_sql=None):
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_log_{op}
+        AFTER {event} ON {table}
+        {when}
+        BEGIN
+            INSERT INTO change_log (table_name, row_id, student_id, op)
+            VALUES ('{table}', {ref}.id, {ref}.{student_column}, {op_sql or f"'{op}'"});
+        END
+    ''')
+
+
+def _migration_daily_agenda_indexes(cursor):
+    """每日課表查詢：依星期取課程、依學員取未完成備註"""
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_schedules_weekday
+        ON schedules(weekday, start_time) WHERE is_active = 1
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_class_notes_pending
+        ON class_notes(student_id, note_date) WHERE is_completed = 0
+    ''')
+
+
+def _migration_compression_dicts(cursor):
+    """上課內容長文字壓縮用的共用字典"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS compression_dicts (
+            id INTEGER PRIMARY KEY CHECK(id BETWEEN 1 AND 255),
+            dictionary BLOB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def _migration_utilization_index(cursor):
+    """使用率熱圖：依日期範圍取出席記錄的時段，只讀索引不回表"""
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_attendance_date_slot
+        ON attendance_records(class_date, attendance_status, start_time, end_time)
+    ''')
+
+
+def _migration_stat_cache(cursor):
+    """統計結果快取，以相關表格的寫入版本（change_log 序號）判斷是否過期"""
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_change_log_table
+        ON change_log(table_name, seq)
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stat_cache (
+            cache_key TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            payload TEXT NOT NULL,
+            computed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def _migration_wal(cursor):
+    """改用 WAL 日誌：讀取不會擋住寫入提交，多個程序同時使用時較少鎖定"""
+    cursor.execute('PRAGMA journal_mode = WAL')
+
+
+def _migration_attendance_calendar_index(cursor):
+    """
+    上課記錄的窄投影（日期、時段、狀態）：索引已依查詢的排序方向排列，
+    只讀索引即可回答，不必讀取含長文字欄位的資料頁
+    """
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_attendance_student_calendar
+        ON attendance_records(student_id, class_date DESC, start_time, end_time, attendance_status)
+    ''')
+
+
+def _migration_time_columns(cursor):
+    """
+    時間的整數欄位（見 time_columns.TIME_COLUMNS）：新增欄位、由觸發器在寫入時維護並回填，
+    再以整數欄位重建範圍查詢與排序使用的索引
+    """
+    for table, columns in TIME_COLUMNS.items():
+        # 已有的欄位不再新增：中斷後重新執行此遷移時不會因重複欄位失敗
+        cursor.execute(f'PRAGMA table_info({table})')
+        existing = {row[1] for row in cursor.fetchall()}
+        for column in columns:
+            if column not in existing:
+                cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} INTEGER')
+        
+        sources = sorted({source for source, _ in columns.values()})
+        assignments = ', '.join(f'{column} = {column_sql(table, column)}' for column in columns)
+        # 更新時值沒有變動就不寫入，避免產生多餘的變更記錄
+        stale = ' OR '.join(f'{column} IS NOT {column_sql(table, column)}' for column in columns)
+        for name, event, condition in (('insert', 'INSERT', ''),
+                                       ('update', f"UPDATE OF {', '.join(sources)}", f' AND ({stale})')):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_time_{name}
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE {table} SET {assignments} WHERE id = NEW.id{condition};
+                END
+            ''')
+        
+        # 只更新整數欄位的 UPDATE（觸發器或回填）不是資料變更，不寫入變更記錄
+        derived_changed = ' OR '.join(f'NEW.{column} IS NOT OLD.{column}' for column in columns)
+        sources_unchanged = ' AND '.join(f'NEW.{source} IS OLD.{source}' for source in sources)
+        cursor.execute(f'DROP TRIGGER IF EXISTS trg_{table}_log_update')
+        _create_change_log_trigger(
+            cursor, table, CHANGE_TRACKED_TABLES[table], 'update', 'UPDATE', 'NEW',
+            when=f'WHEN NOT (({derived_changed}) AND {sources_unchanged})')
+        
+        cursor.execute(f'UPDATE {table} SET {assignments}')
+    
+    # 以整數欄位取代文字欄位的索引
+    cursor.execute('DROP INDEX IF EXISTS idx_attendance_date_slot')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_attendance_day_slot
+        ON attendance_records(class_day, attendance_status, start_minute, end_minute)
+    ''')
+    # 排序與範圍使用整數欄位，輸出的文字欄位一併放在索引中，窄投影仍不回表
+    cursor.execute('DROP INDEX IF EXISTS idx_attendance_student_calendar')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_attendance_student_day
+        ON attendance_records(student_id, class_day DESC, start_minute,
+                              class_date, start_time, end_time, attendance_status)
+    ''')
+    cursor.execute('DROP INDEX IF EXISTS idx_schedules_weekday')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_schedules_weekday_minute
+        ON schedules(weekday, start_minute) WHERE is_active = 1
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_schedules_student_minute
+        ON schedules(student_id, weekday, start_minute, end_minute) WHERE is_active = 1
+    ''')
+    cursor.execute('DROP INDEX IF EXISTS idx_leave_student_date')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_leave_student_day ON leave_records(student_id, leave_day)')
+    cursor.execute('DROP INDEX IF EXISTS idx_assessment_student')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_assessment_student_day
+        ON assessment_records(student_id, assessment_day)
+    ''')
+
+
+# 繳費彙總：學員的應收/已收累計與每月合計，由觸發器隨繳費記錄增減
+PAYMENT_TOTALS = {
+    'payment_balances': 'student_id',
+    'payment_month_totals': 'month_ref',
+}
+
+
+def _payment_totals_delta(table, key, ref, sign):
+    """觸發器內以一筆繳費記錄（NEW/OLD）增減彙總的 UPSERT"""
+    op = '+' if sign > 0 else '-'
+    paid = f"CASE WHEN {ref}.status = '已繳' THEN 1 ELSE 0 END"
+    return f'''
+            INSERT INTO {table} ({key}, billed_amount, paid_amount, payment_count, paid_count)
+            SELECT {ref}.{key}, {op}{ref}.amount, {op}{ref}.amount * {paid}, {op}1, {op}{paid}
+            WHERE {ref}.{key} IS NOT NULL
+            ON CONFLICT({key}) DO UPDATE SET
+                billed_amount = billed_amount + excluded.billed_amount,
+                paid_amount = paid_amount + excluded.paid_amount,
+                payment_count = payment_count + excluded.payment_count,
+                paid_count = paid_count + excluded.paid_count;'''
+
+
+def rebuild_payment_totals(cursor):
+    """由繳費記錄重新計算彙總（遷移回填與完整性修復使用）"""
+    for table, key in PAYMENT_TOTALS.items():
+        cursor.execute(f'DELETE FROM {table}')
+        cursor.execute(f'''
+            INSERT INTO {table} ({key}, billed_amount, paid_amount, payment_count, paid_count)
+            SELECT {key}, SUM(amount),
+                   SUM(CASE WHEN status = '已繳' THEN amount ELSE 0 END),
+                   COUNT(*),
+                   SUM(CASE WHEN status = '已繳' THEN 1 ELSE 0 END)
+            FROM payments
+            WHERE {key} IS NOT NULL
+            GROUP BY {key}
+        ''')
+
+
+def _migration_payment_totals(cursor):
+    """
+    繳費彙總表：查詢欠款與每月收入時讀取彙總的一列，不必每次加總整本帳；
+    觸發器在新增/修改/刪除繳費記錄時增減對應的彙總，筆數歸零的彙總列一併刪除
+    """
+    for table, key in PAYMENT_TOTALS.items():
+        key_type = 'INTEGER' if key == 'student_id' else 'TEXT'
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                {key} {key_type} PRIMARY KEY,
+                billed_amount INTEGER NOT NULL DEFAULT 0,
+                paid_amount INTEGER NOT NULL DEFAULT 0,
+                payment_count INTEGER NOT NULL DEFAULT 0,
+                paid_count INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+    
+    cleanup = ''.join(
+        f'''
+            DELETE FROM {table} WHERE {key} = OLD.{key} AND payment_count = 0;'''
+        for table, key in PAYMENT_TOTALS.items())
+    for name, event, steps in (
+            ('insert', 'INSERT', [('NEW', 1)]),
+            ('update', 'UPDATE OF student_id, amount, status, month_ref', [('OLD', -1), ('NEW', 1)]),
+            ('delete', 'DELETE', [('OLD', -1)])):
+        body = ''.join(_payment_totals_delta(table, key, ref, sign)
+                       for ref, sign in steps
+                       for table, key in PAYMENT_TOTALS.items())
+        if name != 'insert':
+            body += cleanup
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_payments_totals_{name}
+            AFTER {event} ON payments
+            BEGIN{body}
+            END
+        ''')
+    
+    # 既有資料庫的 payments 在遷移 2 之後才建立，補上變更記錄觸發器
+    for op, event, ref in (('insert', 'INSERT', 'NEW'),
+                           ('update', 'UPDATE', 'NEW'),
+                           ('delete', 'DELETE', 'OLD')):
+        _create_change_log_trigger(cursor, 'payments', 'student_id', op, event, ref)
+    
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_payments_student_month
+        ON payments(student_id, month_ref)
+    ''')
+    rebuild_payment_totals(cursor)
+
+
+def _migration_attendance_alerts(cursor):
+    """出席警示的計算結果，增量計算時只更新有變更的學員"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS attendance_alert_state (
+            student_id INTEGER PRIMARY KEY,
+            streak INTEGER NOT NULL,
+            streak_absent INTEGER NOT NULL,
+            streak_leave INTEGER NOT NULL,
+            streak_first_day INTEGER,
+            streak_last_day INTEGER,
+            sessions INTEGER NOT NULL,
+            attended INTEGER NOT NULL,
+            prev_sessions INTEGER NOT NULL,
+            prev_attended INTEGER NOT NULL
+        )
+    ''')
+
+
+def _migration_incremental_vacuum(cursor):
+    """
+    改用 auto_vacuum=INCREMENTAL：刪除後的空頁留在 freelist，由 maintenance 動作分段歸還檔案系統
+
+    新資料庫（建立表格前已設定，見 _create_tables）與 auto_vacuum=FULL 的資料庫立即生效；
+    auto_vacuum=NONE 的既有資料庫須整個重建才會生效，重建會獨佔資料庫並暫用兩倍空間，
+    不在遷移（每次動作前自動執行）中進行，改由 maintenance 動作指定 rebuild 時執行一次
+    """
+    cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+
+
+def _migration_archive_change_op(cursor):
+    """
+    封存搬移在變更記錄中記為 archive（資料移到封存資料庫，不是真的刪除）：
+    change_log 的 op 限制加入 archive，封存表格的刪除觸發器在封存交易中（skill_meta 有封存旗標）改記 archive
+    """
+    # SQLite 無法以 ALTER TABLE 修改 CHECK 限制，依 SQLite 文件的步驟重建 change_log：
+    # 建立新表、複製資料、刪除舊表後改名，再重建索引
+    cursor.execute('''
+        SELECT sql FROM sqlite_master
+        WHERE tbl_name = 'change_log' AND type IN ('index', 'trigger') AND sql IS NOT NULL
+    ''')
+    dependents = [row[0] for row in cursor.fetchall()]
+    cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'")
+    row = cursor.fetchone()
+    sequence = row[0] if row else 0
+
+    cursor.execute('''
+        CREATE TABLE change_log_new (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            student_id INTEGER,
+            op TEXT CHECK(op IN ('insert', 'update', 'delete', 'archive')) NOT NULL,
+            changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO change_log_new (seq, table_name, row_id, student_id, op, changed_at)
+        SELECT seq, table_name, row_id, student_id, op, changed_at FROM change_log
+    ''')
+    cursor.execute('DROP TABLE change_log')
+    # 其他表格的觸發器會寫入 change_log，新版的 ALTER TABLE 改名時會重新解析這些觸發器，
+    # 而舊表已刪除會報錯；改名期間改用舊版行為（觸發器以名稱參照，改名後即指向新表）
+    cursor.execute('PRAGMA legacy_alter_table = ON')
+    try:
+        cursor.execute('ALTER TABLE change_log_new RENAME TO change_log')
+    finally:
+        cursor.execute('PRAGMA legacy_alter_table = OFF')
+    for sql in dependents:
+        cursor.execute(sql)
+
+    # 保留 AUTOINCREMENT 的計數器：已壓縮刪除的序號不會再被使用
+    cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'")
+    row = cursor.fetchone()
+    cursor.execute("DELETE FROM sqlite_sequence WHERE name = 'change_log'")
+    cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('change_log', ?)",
+                   (max(sequence, row[0] if row else 0),))
+
+    archiving = (f"CASE WHEN EXISTS (SELECT 1 FROM skill_meta WHERE key = '{ArchiveManager.ARCHIVING_KEY}') "
+                 "THEN 'archive' ELSE 'delete' END")
+    for table in ARCHIVE_TABLES:
+        cursor.execute(f'DROP TRIGGER IF EXISTS trg_{table}_log_delete')
+        _create_change_log_trigger(cursor, table, CHANGE_TRACKED_TABLES[table], 'delete', 'DELETE', 'OLD',
+                                   op_sql=archiving)
+
+
+# 結構遷移：依版本號順序套用，已套用的版本記錄在 PRAGMA user_version
+MIGRATIONS = [
+    (1, _migration_attendance_natural_key),
+    (2, _migration_change_log),
+    (3, _migration_daily_agenda_indexes),
+    (4, _migration_compression_dicts),
+    (5, _migration_utilization_index),
+    (6, _migration_stat_cache),
+    (7, _migration_wal),
+    (8, _migration_attendance_calendar_index),
+    (9, _migration_time_columns),
+    (10, _migration_payment_totals),
+    (11, _migration_attendance_alerts),
+    (12, _migration_incremental_vacuum),
+    (13, _migration_archive_change_op),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+# 只變更資料庫設定、不能在交易中執行的遷移（重複執行無害）
+_AUTOCOMMIT_MIGRATIONS = {_migration_wal, _migration_incremental_vacuum}
+
+
+def _user_version(cursor):
+    cursor.execute('PRAGMA user_version')
+    return cursor.fetchone()[0]
+
+
+def migrate(conn):
+    """
+    套用尚未執行的遷移，回傳目前的結構版本
+
+    每個遷移先以 BEGIN IMMEDIATE 取得寫入鎖，在鎖內重新讀取 user_version，
+    遷移與 user_version 的更新在同一個交易中提交：同時初始化的程序依序取得鎖，
+    後到的看到版本已更新即略過；遷移中途失敗或程序中斷時整個回滾，下次重新套用
+    """
+    cursor = conn.cursor()
+    version = _user_version(cursor)
     
+    for target, step in MIGRATIONS:
+        if target <= version:
+            continue
+        if step in _AUTOCOMMIT_MIGRATIONS:
+            # 交易外先執行設定，交易中只更新版本
+            step(cursor)
+            step = None
+        
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            version = _user_version(cursor)
+            if version < target:
+                if step is not None:
+                    step(cursor)
+                cursor.execute(f'PRAGMA user_version = {target}')
+                version = target
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    
+    return version
+
+
+def _init_postgres(dsn):
+    """在 PostgreSQL 建立技能所需的表格（結構定義於 schema_postgres.sql）"""
+    schema_sql = (Path(__file__).resolve().parent / 'schema_postgres.sql').read_text(encoding='utf-8')
+    conn = get_backend(dsn).connect()
+    conn.raw.execute(schema_sql)
     conn.commit()
     conn.close()
+
+
+def ensure_schema(db_path):
+    """確保資料庫結構為最新版本（不輸出訊息，供 run_skill.py 每次呼叫使用）"""
+    if is_postgres_url(db_path):
+        # PostgreSQL 結構由 init_database 一次建立，不在每次呼叫時檢查
+        return
+    
+    # 經由後端連線：鎖定時重試、BEGIN IMMEDIATE 與單一寫入佇列（--writer-lock）都適用於遷移
+    conn = get_backend(db_path).connect()
+    try:
+        cursor = conn.cursor()
+        if _user_version(cursor) < SCHEMA_VERSION:
+            _create_tables(cursor)
+            migrate(conn)
+    finally:
+        conn.close()
+
+
+def init_database(db_path='course_management.db'):
+    """初始化資料庫，建立所有必要的表格（db_path 可為 postgresql:// 連線字串）"""
+    
+    if is_postgres_url(db_path):
+        _init_postgres(db_path)
+        print("✅ PostgreSQL 資料庫初始化完成")
+        return db_path
+    
+    conn = get_backend(db_path).connect()
+    _create_tables(conn.cursor())
+    migrate(conn)
+    conn.close()
     
     print(f"✅ 資料庫初始化完成: {db_path}")
     return db_path
 
 if __name__ == '__main__':
-    init_database()
+    init_database(*sys.argv[1:2])
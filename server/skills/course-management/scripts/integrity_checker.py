@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+資料完整性檢查：每項檢查是一次集合式 SQL 掃描，結果以 fetchmany 分批串流計數，
+只保留前幾筆違規 ID 作為樣本；可選擇修復能安全修復的項目
+"""
+import json
+import time
+
+from storage import get_backend
+from archive_manager import ArchiveManager
+from init_database import CHANGE_TRACKED_TABLES, PAYMENT_TOTALS, rebuild_payment_totals
+from time_columns import TIME_COLUMNS, column_sql
+
+CHECKS = (
+    'orphans',
+    'overlapping_schedules',
+    'duplicate_attendance',
+    'leave_without_class',
+    'partial_ratios',
+    'time_columns',
+    'payment_totals',
+)
+
+# 以 student_id 參照學員的表格
+STUDENT_TABLES = [table for table in CHANGE_TRACKED_TABLES if table != 'students']
+
+RATIO_COLUMNS = ('visual_ratio', 'auditory_ratio', 'motor_ratio', 'academic_ratio')
+
+# 同一學員同一星期依開始時間排序，之前各課程的最晚結束時間晚於本課程開始時間即為重疊；
+# 分區內第一列沒有前一列，結果為 NULL 不會被選出
+_SCHEDULE_OVERLAP_SQL = '''
+    SELECT id FROM (
+        SELECT id, start_minute,
+               MAX(end_minute) OVER (
+                   PARTITION BY student_id, weekday
+                   ORDER BY start_minute, id
+                   ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+               ) AS covered_until
+        FROM schedules
+        WHERE is_active = 1
+    ) ranked
+    WHERE covered_until > start_minute
+'''
+
+# 上課記錄 a 與 {others} 中同一學員同一天的另一筆記錄 b 時間重疊
+_ATTENDANCE_OVERLAP_SQL = '''EXISTS (
+        SELECT 1 FROM {others} b
+        WHERE b.student_id = a.student_id
+          AND b.{day} = a.{day}
+          AND b.id <> a.id
+          AND {overlap}
+    )'''
+
+# b 比 a 早開始（同時開始則 ID 較小）且尚未結束：每組重疊只選出較晚的一筆
+_EARLIER_OVERLAP = '''b.{start} <= a.{start} AND b.{end} > a.{start}
+          AND (b.{start} < a.{start} OR b.id < a.id)'''
+
+_ANY_OVERLAP = 'b.{start} < a.{end} AND b.{end} > a.{start}'
+
+# 主表比較整數欄位並使用索引；封存資料庫在遷移前封存的列沒有整數欄位，改比較文字欄位
+_INTEGER_COLUMNS = {'day': 'class_day', 'start': 'start_minute', 'end': 'end_minute'}
+_TEXT_COLUMNS = {'day': 'class_date', 'start': 'start_time', 'end': 'end_time'}
+
+def _attendance_overlap(others, overlap, columns):
+    return _ATTENDANCE_OVERLAP_SQL.format(
+        others=others, day=columns['day'], overlap=overlap.format(**columns))
+
+class IntegrityChecker:
+    def __init__(self, db_path='course_management.db', sample_size=10, chunk_size=5000):
+        """
+        Args:
+            db_path: 資料庫路徑
+            sample_size: 每項檢查回傳的違規 ID 樣本數
+            chunk_size: 串流讀取違規 ID 時每批的筆數
+        """
+        self.db_path = db_path
+        self.sample_size = sample_size
+        self.chunk_size = chunk_size
+        self.dialect = get_backend(db_path).dialect
+
+    def _get_connection(self):
+        return get_backend(self.db_path).connect()
+
+    def check(self, checks=None, repair=False):
+        """
+        執行完整性檢查
+
+        Args:
+            checks: 要執行的檢查項目，預設全部（見 CHECKS）
+            repair: 是否修復可安全修復的項目：
+                    orphans 刪除孤兒資料、overlapping_schedules 停用重疊的課程、
+                    partial_ratios 補上唯一缺少的比例、time_columns 與 payment_totals 重新計算；
+                    其餘項目只回報
+
+        Returns:
+            {'issues': 違規總數, 'results': [{'check', 'table', 'count', 'sample', 'repaired', 'elapsed_ms'}], ...}
+        """
+        checks = list(checks or CHECKS)
+        unknown = [name for name in checks if name not in CHECKS]
+        if unknown:
+            raise ValueError(f"不支援的檢查項目: {', '.join(unknown)}，可用: {', '.join(CHECKS)}")
+
+        started = time.perf_counter()
+        conn = self._get_connection()
+        cursor = conn.cursor()
+
+        results = []
+        try:
+            for name in checks:
+                results.extend(getattr(self, f'_check_{name}')(conn, cursor, repair))
+        finally:
+            conn.close()
+
+        return {
+            'issues': sum(result['count'] for result in results),
+            'repaired': sum(result['repaired'] or 0 for result in results) if repair else None,
+            'results': results,
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+        }
+
+    def _scan(self, cursor, check, table, sql, params=()):
+        """串流讀取違規 ID：只計數並保留樣本，不把全部 ID 放進記憶體"""
+        started = time.perf_counter()
+        cursor.execute(sql + ' ORDER BY id', params)
+        count = 0
+        sample = []
+        while True:
+            rows = cursor.fetchmany(self.chunk_size)
+            if not rows:
+                break
+            if len(sample) < self.sample_size:
+                sample.extend(row[0] for row in rows[:self.sample_size - len(sample)])
+            count += len(rows)
+
+        return {
+            'check': check,
+            'table': table,
+            'count': count,
+            'sample': sample,
+            'repaired': None,
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+        }
+
+    def _check_orphans(self, conn, cursor, repair):
+        """student_id 找不到對應學員的資料"""
+        results = []
+        for table in STUDENT_TABLES:
+            sql = f'''
+                SELECT id FROM {table} t
+                WHERE NOT EXISTS (SELECT 1 FROM students st WHERE st.id = t.student_id)
+            '''
+            result = self._scan(cursor, 'orphans', table, sql)
+            if repair and result['count']:
+                cursor.execute(f'DELETE FROM {table} WHERE id IN ({sql})')
+                result['repaired'] = cursor.rowcount
+                conn.commit()
+            results.append(result)
+        return results
+
+    def _check_overlapping_schedules(self, conn, cursor, repair):
+        """同一學員同一星期時間重疊的啟用中課程"""
+        result = self._scan(cursor, 'overlapping_schedules', 'schedules', _SCHEDULE_OVERLAP_SQL)
+        if repair and result['count']:
+            result['repaired'] = self._deactivate_overlaps(conn, cursor)
+        return [result]
+
+    def _deactivate_overlaps(self, conn, cursor):
+        """
+        只重新讀取有重疊的學員與星期，依開始時間保留不重疊的課程、停用其餘的；
+        不直接停用所有被選出的課程，以免 A、B 重疊而 B、C 重疊時把不衝突的 C 也停用
+        """
+        cursor.execute(f'''
+            SELECT s.id, s.student_id, s.weekday, s.start_minute, s.end_minute
+            FROM schedules s
+            JOIN (
+                SELECT DISTINCT student_id, weekday FROM schedules
+                WHERE id IN ({_SCHEDULE_OVERLAP_SQL})
+            ) conflict ON s.student_id = conflict.student_id AND s.weekday = conflict.weekday
+            WHERE s.is_active = 1
+            ORDER BY s.student_id, s.weekday, s.start_minute, s.id
+        ''')
+
+        deactivate = []
+        partition = kept_until = None
+        for schedule_id, student_id, weekday, start_minute, end_minute in cursor.fetchall():
+            if (student_id, weekday) != partition:
+                partition, kept_until = (student_id, weekday), None
+            if kept_until is not None and start_minute < kept_until:
+                deactivate.append(schedule_id)
+            else:
+                kept_until = end_minute
+
+        for offset in range(0, len(deactivate), self.chunk_size):
+            ids = deactivate[offset:offset + self.chunk_size]
+            cursor.execute(f'''
+                UPDATE schedules SET is_active = 0
+                WHERE id IN ({', '.join('?' for _ in ids)})
+            ''', ids)
+        conn.commit()
+        return len(deactivate)
+
+    def _check_duplicate_attendance(self, conn, cursor, repair):
+        """
+        同一學員同一天時段重疊的上課記錄；涉及上課內容，只回報不修復
+
+        每筆記錄以涵蓋索引查找同一天較早開始且尚未結束的記錄，比視窗函式排序全表快；
+        有封存資料時另外檢查封存記錄彼此之間及與主表的重疊
+        """
+        main_overlap = _attendance_overlap('attendance_records', _EARLIER_OVERLAP, _INTEGER_COLUMNS)
+        results = [self._scan(cursor, 'duplicate_attendance', 'attendance_records',
+                              f'SELECT id FROM attendance_records a WHERE {main_overlap}')]
+
+        source = ArchiveManager(self.db_path).read_source(conn, 'attendance_records', None)
+        if source != 'attendance_records':
+            archive_overlap = _attendance_overlap('archive.attendance_records', _EARLIER_OVERLAP, _TEXT_COLUMNS)
+            crossing = _attendance_overlap('main.attendance_records', _ANY_OVERLAP, _TEXT_COLUMNS)
+            results.append(self._scan(cursor, 'duplicate_attendance', 'archive.attendance_records',
+                                      f'SELECT id FROM archive.attendance_records a '
+                                      f'WHERE {archive_overlap} OR {crossing}'))
+        return results
+
+    def _check_leave_without_class(self, conn, cursor, repair):
+        """請假日期當天（星期）沒有啟用中課程的請假記錄；無法判斷正確日期，只回報"""
+        source = ArchiveManager(self.db_path).read_source(conn, 'leave_records', None)
+        # 1970-01-01（第 0 天）為週四，星期 = (天數 + 3) % 7
+        sql = f'''
+            SELECT id FROM {source} lr
+            WHERE NOT EXISTS (
+                SELECT 1 FROM schedules s
+                WHERE s.student_id = lr.student_id
+                  AND s.is_active = 1
+                  AND s.weekday = (lr.leave_day + 3) % 7
+            )
+        '''
+        return [self._scan(cursor, 'leave_without_class', 'leave_records', sql)]
+
+    def _check_partial_ratios(self, conn, cursor, repair):
+        """
+        四項課程比例只填了一部分的檢測記錄：資料表的 CHECK 以總和等於 100 判斷，
+        有任一項為 NULL 時總和為 NULL，CHECK 不會擋下
+        """
+        any_null = ' OR '.join(f'{column} IS NULL' for column in RATIO_COLUMNS)
+        all_null = ' AND '.join(f'{column} IS NULL' for column in RATIO_COLUMNS)
+        sql = f'SELECT id FROM assessment_records WHERE ({any_null}) AND NOT ({all_null})'
+        result = self._scan(cursor, 'partial_ratios', 'assessment_records', sql)
+
+        if repair and result['count']:
+            # 只缺一項且其餘總和不超過 100 時，缺少的一項可由 100 減去其餘推得
+            repaired = 0
+            for column in RATIO_COLUMNS:
+                others = [other for other in RATIO_COLUMNS if other != column]
+                cursor.execute(f'''
+                    UPDATE assessment_records
+                    SET {column} = 100 - ({' + '.join(others)})
+                    WHERE {column} IS NULL
+                      AND {' AND '.join(f'{other} IS NOT NULL' for other in others)}
+                      AND {' + '.join(others)} <= 100
+                ''')
+                repaired += cursor.rowcount
+            conn.commit()
+            result['repaired'] = repaired
+        return [result]
+
+
+    def _check_time_columns(self, conn, cursor, repair):
+        """時間的整數欄位與文字欄位不一致（例如維護用的觸發器被移除後寫入的資料）"""
+        # PostgreSQL 的整數欄位是生成欄位，不會不一致也不能直接更新，不需檢查
+        if self.dialect != 'sqlite':
+            return []
+        results = []
+        for table, columns in TIME_COLUMNS.items():
+            stale = ' OR '.join(
+                f'{column} IS NOT {column_sql(table, column)}' for column in columns)
+            result = self._scan(cursor, 'time_columns', table, f'SELECT id FROM {table} WHERE {stale}')
+            if repair and result['count']:
+                assignments = ', '.join(f'{column} = {column_sql(table, column)}' for column in columns)
+                cursor.execute(f'UPDATE {table} SET {assignments} WHERE {stale}')
+                result['repaired'] = cursor.rowcount
+                conn.commit()
+            results.append(result)
+        return results
+
+    def _check_payment_totals(self, conn, cursor, repair):
+        """繳費彙總與繳費記錄的加總不一致（列出不一致的學員ID / 帳款月份）"""
+        results = []
+        for table, key in PAYMENT_TOTALS.items():
+            ledger = f'''
+                SELECT {key}, SUM(amount) AS billed_amount,
+                       SUM(CASE WHEN status = '已繳' THEN amount ELSE 0 END) AS paid_amount,
+                       COUNT(*) AS payment_count,
+                       SUM(CASE WHEN status = '已繳' THEN 1 ELSE 0 END) AS paid_count
+                FROM payments
+                WHERE {key} IS NOT NULL
+                GROUP BY {key}
+            '''
+            totals = f'SELECT {key}, billed_amount, paid_amount, payment_count, paid_count FROM {table}'
+            # 雙向差集：彙總缺少、多出或數值不同的鍵
+            sql = f'''
+                SELECT {key} AS id FROM ({ledger} EXCEPT {totals}) missing
+                UNION
+                SELECT {key} AS id FROM ({totals} EXCEPT {ledger}) extra
+            '''
+            results.append(self._scan(cursor, 'payment_totals', table, sql))
+
+        if repair and any(result['count'] for result in results):
+            rebuild_payment_totals(cursor)
+            conn.commit()
+            for result in results:
+                result['repaired'] = result['count']
+        return results
+
+def main():
+    """命令列介面"""
+    import sys
+
+    if len(sys.argv) < 2:
+        print("用法:")
+        print("  檢查: python integrity_checker.py check [檢查項目...]")
+        print("  檢查並修復: python integrity_checker.py repair [檢查項目...]")
+        print(f"\n檢查項目: {', '.join(CHECKS)}")
+        return
+
+    action = sys.argv[1]
+
+    if action in ('check', 'repair'):
+        checker = IntegrityChecker()
+        result = checker.check(sys.argv[2:] or None, repair=(action == 'repair'))
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+儀表板指標：學員人數（依狀態、類型）、本週課程、今日請假、待複測、未完成備註
+
+所有指標由一個 UNION ALL 聚合查詢取得（同一個語句即同一個讀取快照，數字彼此一致），
+結果依寫入版本快取，資料沒有寫入時輪詢只需讀取版本與快取
+"""
+import calendar
+from datetime import datetime, date, timedelta
+import json
+
+from storage import get_backend
+from change_feed import ChangeFeed
+from stat_cache import StatCache
+from time_columns import day_number
+
+# 指標依賴的表格
+SOURCE_TABLES = ['students', 'schedules', 'leave_records', 'assessment_records', 'class_notes']
+
+# 每列為 (指標, 分類, 數值)；課程與待複測只計未離室的學員
+_SNAPSHOT_SQL = '''
+    SELECT 'status', status, COUNT(*) FROM students GROUP BY status
+    UNION ALL
+    SELECT 'type', type, COUNT(*) FROM students GROUP BY type
+    UNION ALL
+    SELECT 'week_sessions', NULL, COUNT(*)
+    FROM schedules s
+    JOIN students st ON st.id = s.student_id
+    WHERE s.is_active = 1 AND st.status != '離室'
+    UNION ALL
+    SELECT 'week_remaining', NULL, COUNT(*)
+    FROM schedules s
+    JOIN students st ON st.id = s.student_id
+    WHERE s.is_active = 1 AND st.status != '離室' AND s.weekday >= ?
+    UNION ALL
+    SELECT 'week_on_leave', NULL, COUNT(*)
+    FROM schedules s
+    JOIN students st ON st.id = s.student_id
+    WHERE s.is_active = 1 AND st.status != '離室'
+      AND EXISTS (
+          SELECT 1 FROM leave_records lr
+          WHERE lr.student_id = s.student_id AND lr.leave_day = ? + s.weekday
+      )
+    UNION ALL
+    SELECT 'leaves_today', NULL, COUNT(*)
+    FROM students st
+    WHERE EXISTS (
+        SELECT 1 FROM leave_records lr
+        WHERE lr.student_id = st.id AND lr.leave_day = ?
+    )
+    UNION ALL
+    SELECT 'retest_due', NULL, COUNT(*)
+    FROM students st
+    WHERE st.status != '離室'
+      AND (SELECT MAX(ar.assessment_day) FROM assessment_records ar
+           WHERE ar.student_id = st.id) <= ?
+    UNION ALL
+    SELECT 'pending_notes', NULL, COUNT(*) FROM class_notes WHERE is_completed = 0
+'''
+
+def _months_before(value, months):
+    """往前推幾個月的同一天（該月沒有這天時取月底）"""
+    index = value.year * 12 + value.month - 1 - months
+    year, month = divmod(index, 12)
+    return date(year, month + 1, min(value.day, calendar.monthrange(year, month + 1)[1]))
+
+class KpiSnapshot:
+    CACHE_PREFIX = 'kpi_snapshot:'
+
+    def __init__(self, db_path='course_management.db'):
+        self.db_path = db_path
+
+    def _get_connection(self):
+        return get_backend(self.db_path).connect()
+
+    def snapshot(self, as_of=None, retest_months=6, use_cache=True):
+        """
+        儀表板指標
+
+        Args:
+            as_of: 基準日（預設今天），決定本週、今日與待複測的範圍
+            retest_months: 最近一次檢測超過幾個月視為待複測
+            use_cache: 資料沒有寫入時沿用上次的結果
+
+        Returns:
+            {'students': {'total', 'by_status', 'by_type'},
+             'sessions_this_week': {'week_start', 'scheduled', 'remaining', 'on_leave'},
+             'leaves_today', 'retest_due': {'count', 'months', 'last_assessed_before'},
+             'pending_notes', 'version', 'cached'}
+        """
+        if isinstance(as_of, str):
+            as_of = datetime.strptime(as_of.replace('/', '-')[:10], '%Y-%m-%d').date()
+        as_of = as_of or datetime.now().date()
+        retest_months = int(retest_months)
+        week_start = as_of - timedelta(days=as_of.weekday())
+        retest_before = _months_before(as_of, retest_months)
+
+        cache = StatCache(self.db_path)
+        # 本週、今日的範圍隨日期改變，基準日也是快取鍵的一部分
+        cache_key = self.CACHE_PREFIX + json.dumps(
+            {'as_of': as_of.isoformat(), 'retest_months': retest_months}, sort_keys=True)
+
+        conn = self._get_connection()
+        # 版本與指標在同一個讀取交易中讀取，快取的結果不會存在比資料舊的版本下
+        began = conn.begin_read()
+        try:
+            cursor = conn.cursor()
+            version = ChangeFeed(self.db_path).write_version(SOURCE_TABLES, cursor)
+
+            if use_cache:
+                cached = cache.get(cache_key, version)
+                if cached is not None:
+                    return dict(cached, cached=True)
+
+            cursor.execute(_SNAPSHOT_SQL, (
+                as_of.weekday(),
+                day_number(week_start),
+                day_number(as_of),
+                day_number(retest_before),
+            ))
+            rows = cursor.fetchall()
+        finally:
+            if began:
+                conn.commit()
+            conn.close()
+
+        by_status = {}
+        by_type = {}
+        totals = {}
+        for metric, label, count in rows:
+            if metric == 'status':
+                by_status[label] = count
+            elif metric == 'type':
+                by_type[label] = count
+            else:
+                totals[metric] = count
+
+        result = {
+            'as_of': as_of.isoformat(),
+            'version': version,
+            'students': {
+                'total': sum(by_status.values()),
+                'by_status': by_status,
+                'by_type': by_type,
+            },
+            'sessions_this_week': {
+                'week_start': week_start.isoformat(),
+                'scheduled': totals['week_sessions'],
+                'remaining': totals['week_remaining'],
+                'on_leave': totals['week_on_leave'],
+            },
+            'leaves_today': totals['leaves_today'],
+            'retest_due': {
+                'count': totals['retest_due'],
+                'months': retest_months,
+                'last_assessed_before': retest_before.isoformat(),
+            },
+            'pending_notes': totals['pending_notes'],
+        }
+        cache.put(cache_key, version, result, prefix=self.CACHE_PREFIX)
+        return dict(result, cached=False)
+
+
+def main():
+    """命令列介面"""
+    import sys
+
+    if len(sys.argv) < 2:
+        print("用法:")
+        print("  儀表板指標: python kpi_snapshot.py show [基準日] [複測間隔月數]")
+        return
+
+    action = sys.argv[1]
+
+    if action == 'show':
+        as_of = sys.argv[2] if len(sys.argv) > 2 else None
+        retest_months = int(sys.argv[3]) if len(sys.argv) > 3 else 6
+
+        result = KpiSnapshot().snapshot(as_of, retest_months)
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+"""
+端對端壓力測試：以伺服器相同的方式呼叫技能（啟動 run_skill.py 子程序、stdin 傳入 JSON、解析 stdout），
+依設定的動作比例與並行數重放請求，統計吞吐量、延遲百分位數、錯誤與鎖定逾時比例，
+並拆分程序啟動與動作本身的耗時
+"""
+import argparse
+import json
+import math
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from pathlib import Path
+
+from storage import get_backend
+from init_database import ensure_schema
+
+RUN_SKILL = Path(__file__).resolve().parent.parent / 'run_skill.py'
+
+SLOTS = [('09:00', '10:40'), ('10:40', '12:20'), ('13:00', '15:00'),
+         ('15:00', '17:00'), ('17:00', '19:00'), ('19:00', '21:00')]
+TYPES = ['a超前', 'b一般', 'c特殊']
+CONTENT = ['平衡木行走', '拋接球練習', '視覺追視訓練', '聽覺指令辨識', '手眼協調', '節奏拍打', '精細動作']
+
+# 預設的動作比例（約七成讀取、三成寫入）
+DEFAULT_MIX = {
+    'get_student': 15,
+    'get_attendance': 20,
+    'get_daily_agenda': 15,
+    'get_weekly_schedule': 10,
+    'list_students': 5,
+    'find_open_slots': 5,
+    'upsert_attendance_many': 15,
+    'add_leave': 8,
+    'add_class_note': 7,
+}
+
+def _student_name(index):
+    return f'測試學員{index:04d}'
+
+def _random_day(rng, weeks):
+    return date.today() - timedelta(days=rng.randrange(weeks * 7))
+
+# 各動作的參數產生器：rng, 學員數, 資料週數 -> args
+ARG_GENERATORS = {
+    'get_student': lambda rng, n, w: {'name': _student_name(rng.randrange(n))},
+    'get_attendance': lambda rng, n, w: {'student': _student_name(rng.randrange(n))},
+    'get_daily_agenda': lambda rng, n, w: {'date': _random_day(rng, w).isoformat()},
+    'get_weekly_schedule': lambda rng, n, w: {'weekday': rng.randrange(6)},
+    'list_students': lambda rng, n, w: {},
+    'find_open_slots': lambda rng, n, w: {'duration': 100, 'count': 2},
+    'upsert_attendance_many': lambda rng, n, w: {'records': [{
+        'student': _student_name(rng.randrange(n)),
+        'class_date': _random_day(rng, w).isoformat(),
+        'start_time': slot[0],
+        'end_time': slot[1],
+        'visual': '，'.join(rng.choices(CONTENT, k=4)),
+    } for slot in rng.sample(SLOTS, 2)]},
+    'add_leave': lambda rng, n, w: {
+        'student': _student_name(rng.randrange(n)),
+        'leave_date': (date.today() + timedelta(days=rng.randrange(1, 60))).isoformat(),
+        'reason': '壓力測試',
+    },
+    'add_class_note': lambda rng, n, w: {
+        'student': _student_name(rng.randrange(n)),
+        'note_date': (date.today() + timedelta(days=rng.randrange(1, 30))).isoformat(),
+        'note_type': '一般備註',
+        'content': rng.choice(CONTENT),
+    },
+}
+
+def seed_database(db_path, students=200, weeks=52, seed=0):
+    """
+    建立測試資料：每位學員每週兩堂課、weeks 週的上課記錄、少量請假與每季檢測
+
+    Returns:
+        各表格新增的筆數
+    """
+    ensure_schema(db_path)
+    rng = random.Random(seed)
+    today = date.today()
+
+    conn = get_backend(db_path).connect()
+    cursor = conn.cursor()
+    cursor.execute('SELECT COUNT(*) FROM students WHERE name LIKE ?', (_student_name(0)[:4] + '%',))
+    if cursor.fetchone()[0]:
+        conn.close()
+        raise ValueError("資料庫已有測試學員，請使用新的資料庫")
+
+    cursor.executemany('''
+        INSERT INTO students (name, birthdate, type, status) VALUES (?, ?, ?, '進行中')
+    ''', [(_student_name(i), f'{rng.randint(2014, 2020)}-{rng.randint(1, 12):02d}-01',
+           rng.choice(TYPES)) for i in range(students)])
+    cursor.execute('SELECT id FROM students WHERE name LIKE ? ORDER BY name', (_student_name(0)[:4] + '%',))
+    student_ids = [row[0] for row in cursor.fetchall()]
+
+    schedules, attendance, leaves, assessments = [], [], [], []
+    for student_id in student_ids:
+        for weekday, (start, end) in zip(rng.sample(range(6), 2), rng.sample(SLOTS, 2)):
+            schedules.append((student_id, weekday, start, end))
+            # 最近 weeks 週中該星期的每一天
+            first = today - timedelta(days=(today.weekday() - weekday) % 7)
+            for week in range(weeks):
+                day = (first - timedelta(weeks=week)).isoformat()
+                if rng.random() < 0.08:
+                    leaves.append((student_id, day, '病假'))
+                    status = '請假'
+                else:
+                    status = '出席'
+                attendance.append((student_id, day, start, end, status,
+                                   '，'.join(rng.choices(CONTENT, k=4))))
+        for quarter in range(max(weeks // 13, 1)):
+            ratios = sorted(rng.sample(range(1, 100), 3))
+            assessments.append((
+                student_id, (today - timedelta(weeks=13 * quarter)).isoformat(),
+                '初測' if quarter == weeks // 13 - 1 else '複測',
+                rng.randint(2, 7), rng.randint(0, 11), rng.randint(2, 7), rng.randint(0, 11),
+                rng.randint(2, 7), rng.randint(0, 11),
+                ratios[0], ratios[1] - ratios[0], ratios[2] - ratios[1], 100 - ratios[2],
+            ))
+
+    cursor.executemany('''
+        INSERT INTO schedules (student_id, weekday, start_time, end_time) VALUES (?, ?, ?, ?)
+    ''', schedules)
+    cursor.executemany('''
+        INSERT OR IGNORE INTO attendance_records
+        (student_id, class_date, start_time, end_time, attendance_status, visual_content)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', attendance)
+    cursor.executemany('''
+        INSERT INTO leave_records (student_id, leave_date, reason) VALUES (?, ?, ?)
+    ''', leaves)
+    cursor.executemany('''
+        INSERT INTO assessment_records
+        (student_id, assessment_date, assessment_type,
+         visual_age_year, visual_age_month, auditory_age_year, auditory_age_month,
+         motor_age_year, motor_age_month,
+         visual_ratio, auditory_ratio, motor_ratio, academic_ratio)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', assessments)
+    conn.commit()
+    conn.close()
+
+    return {
+        'students': len(student_ids),
+        'schedules': len(schedules),
+        'attendance_records': len(attendance),
+        'leave_records': len(leaves),
+        'assessment_records': len(assessments),
+    }
+
+def _percentile(sorted_values, p):
+    """最近排名法百分位數"""
+    if not sorted_values:
+        return None
+    index = max(math.ceil(p / 100 * len(sorted_values)) - 1, 0)
+    return round(sorted_values[index], 1)
+
+def _latency_summary(values):
+    values = sorted(values)
+    return {
+        'p50': _percentile(values, 50),
+        'p95': _percentile(values, 95),
+        'p99': _percentile(values, 99),
+        'max': round(values[-1], 1) if values else None,
+        'mean': round(sum(values) / len(values), 1) if values else None,
+    }
+
+def _mean(values):
+    return round(sum(values) / len(values), 1) if values else None
+
+class LoadTest:
+    def __init__(self, db_path, mix=None, students=200, weeks=52, writer_lock=False, seed=0):
+        """
+        Args:
+            db_path: 測試資料庫
+            mix: 動作比例，{動作: 權重} 或 {動作: {'weight': 權重, 'args': 固定參數}}
+            students / weeks: 產生參數時使用的學員數與資料週數（應與 seed_database 相同）
+            writer_lock: 子程序是否使用 --writer-lock
+        """
+        self.db_path = str(db_path)
+        self.students = students
+        self.weeks = weeks
+        self.writer_lock = writer_lock
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+
+        self.actions = []
+        self.weights = []
+        for action, spec in (mix or DEFAULT_MIX).items():
+            if isinstance(spec, dict):
+                weight, fixed_args = spec.get('weight', 1), spec.get('args')
+            else:
+                weight, fixed_args = spec, None
+            if fixed_args is None and action not in ARG_GENERATORS:
+                raise ValueError(f"動作 {action} 沒有參數產生器，請在比例設定中提供 args")
+            self.actions.append((action, fixed_args))
+            self.weights.append(weight)
+
+    def _next_request(self):
+        with self._rng_lock:
+            action, fixed_args = self._rng.choices(self.actions, self.weights)[0]
+            args = fixed_args if fixed_args is not None else \
+                ARG_GENERATORS[action](self._rng, self.students, self.weeks)
+        return action, args
+
+    def _command(self):
+        command = [sys.executable, str(RUN_SKILL), '--db', self.db_path, '--stats']
+        if self.writer_lock:
+            command.append('--writer-lock')
+        return command
+
+    def measure_spawn(self, samples=5):
+        """只啟動 Python 直譯器（不載入技能）的耗時，作為程序啟動成本的下限"""
+        durations = []
+        for _ in range(samples):
+            started = time.perf_counter()
+            subprocess.run([sys.executable, '-c', 'pass'], check=True)
+            durations.append((time.perf_counter() - started) * 1000)
+        return _mean(durations)
+
+    def call(self, action, args):
+        """啟動一個 run_skill.py 子程序執行一個動作"""
+        payload = json.dumps({'action': action, 'args': args}, ensure_ascii=False)
+        started = time.perf_counter()
+        proc = subprocess.run(self._command(), input=payload.encode('utf-8'), capture_output=True)
+        wall_ms = (time.perf_counter() - started) * 1000
+
+        stats = {}
+        stderr_lines = proc.stderr.decode('utf-8', 'replace').strip().splitlines()
+        if stderr_lines:
+            try:
+                stats = json.loads(stderr_lines[-1])
+            except json.JSONDecodeError:
+                pass
+
+        try:
+            response = json.loads(proc.stdout)
+        except json.JSONDecodeError:
+            response = {'ok': False, 'error': (stderr_lines or ['無法解析輸出'])[-1]}
+
+        error = None if response.get('ok') else str(response.get('error'))
+        lock = stats.get('lock', {})
+        return {
+            'action': action,
+            'wall_ms': wall_ms,
+            'action_ms': stats.get('action_ms'),
+            'serialize_ms': stats.get('serialize_ms'),
+            'error': error,
+            'lock_timeout': bool(lock.get('lock_timeouts')) or (error is not None and 'locked' in error),
+            'lock_wait_ms': lock.get('wait_ms_total', 0.0),
+            'retries': lock.get('retries', 0),
+        }
+
+    def run(self, concurrency=8, requests=200, duration=None):
+        """
+        以 concurrency 個並行呼叫端執行，直到完成 requests 個請求或經過 duration 秒
+
+        Returns:
+            統計報告
+        """
+        results = []
+        results_lock = threading.Lock()
+        issued = [0]
+        deadline = time.perf_counter() + duration if duration else None
+
+        def worker():
+            while True:
+                with results_lock:
+                    if deadline is None and issued[0] >= requests:
+                        return
+                    issued[0] += 1
+                if deadline is not None and time.perf_counter() >= deadline:
+                    return
+                result = self.call(*self._next_request())
+                with results_lock:
+                    results.append(result)
+
+        spawn_ms = self.measure_spawn()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            for _ in range(concurrency):
+                pool.submit(worker)
+        elapsed = time.perf_counter() - started
+
+        return self._report(results, elapsed, concurrency, spawn_ms)
+
+    def _report(self, results, elapsed, concurrency, spawn_ms):
+        total = len(results)
+        errors = [r for r in results if r['error'] is not None]
+        timed = [r for r in results if r['action_ms'] is not None]
+
+        def breakdown(rows):
+            overheads = [r['wall_ms'] - r['action_ms'] - (r['serialize_ms'] or 0) for r in rows]
+            return {
+                'wall_mean': _mean([r['wall_ms'] for r in rows]),
+                'action_mean': _mean([r['action_ms'] for r in rows]),
+                'serialize_mean': _mean([r['serialize_ms'] or 0 for r in rows]),
+                # 程序啟動、模組載入、結構檢查與管線傳輸
+                'overhead_mean': _mean(overheads),
+            }
+
+        by_action = defaultdict(list)
+        for r in results:
+            by_action[r['action']].append(r)
+
+        return {
+            'db_path': self.db_path,
+            'concurrency': concurrency,
+            'writer_lock': self.writer_lock,
+            'requests': total,
+            'duration_s': round(elapsed, 2),
+            'throughput_rps': round(total / elapsed, 1) if elapsed > 0 else None,
+            'latency_ms': _latency_summary([r['wall_ms'] for r in results]),
+            'error_rate': round(len(errors) / total, 4) if total else None,
+            'lock_timeout_rate': round(sum(r['lock_timeout'] for r in results) / total, 4) if total else None,
+            'lock_wait_ms': {
+                'total': round(sum(r['lock_wait_ms'] for r in results), 1),
+                'max': round(max((r['lock_wait_ms'] for r in results), default=0), 1),
+                'retries': sum(r['retries'] for r in results),
+            },
+            'interpreter_spawn_ms': spawn_ms,
+            'breakdown_ms': breakdown(timed),
+            'by_action': {
+                action: dict(
+                    count=len(rows),
+                    errors=sum(r['error'] is not None for r in rows),
+                    latency_ms=_latency_summary([r['wall_ms'] for r in rows]),
+                    **breakdown([r for r in rows if r['action_ms'] is not None]),
+                )
+                for action, rows in sorted(by_action.items())
+            },
+            'error_samples': sorted({r['error'] for r in errors})[:5],
+        }
+
+
+def main():
+    """命令列介面"""
+    parser = argparse.ArgumentParser(description='run_skill.py 端對端壓力測試')
+    parser.add_argument('--db', dest='db_path', required=True, help='測試資料庫路徑')
+    parser.add_argument('--seed', action='store_true', help='先建立測試資料')
+    parser.add_argument('--students', type=int, default=200, help='學員數')
+    parser.add_argument('--weeks', type=int, default=52, help='上課記錄的週數')
+    parser.add_argument('--concurrency', type=int, default=8, help='並行呼叫數')
+    parser.add_argument('--requests', type=int, default=200, help='總請求數')
+    parser.add_argument('--duration', type=float, help='改為執行固定秒數')
+    parser.add_argument('--mix', help='動作比例 JSON 檔（{"動作": 權重}）')
+    parser.add_argument('--writer-lock', action='store_true', help='子程序使用單一寫入佇列')
+    args = parser.parse_args()
+
+    if args.seed:
+        seeded = seed_database(args.db_path, args.students, args.weeks)
+        print(json.dumps({'seeded': seeded}, ensure_ascii=False), file=sys.stderr)
+
+    mix = None
+    if args.mix:
+        with open(args.mix, encoding='utf-8') as f:
+            mix = json.load(f)
+
+    test = LoadTest(args.db_path, mix, args.students, args.weeks, args.writer_lock)
+    report = test.run(args.concurrency, args.requests, args.duration)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+資料庫維護：分段歸還空頁、更新查詢規劃器的統計資料，可在營業時間執行
+
+- auto_vacuum 不是 INCREMENTAL 的既有資料庫，只在指定 rebuild 時以 VACUUM 重建一次（獨佔資料庫），
+  否則不歸還空頁，只回報目前的模式
+- incremental_vacuum 每步只歸還少量頁面，各自是短暫的寫入交易，步與步之間暫停讓其他連線寫入；
+  每次執行歸還的總頁數有上限，其餘留待下次
+- 從未分析過的表格以 analysis_limit 限制取樣的 ANALYZE 建立統計，其餘交給 PRAGMA optimize
+  （只重新分析統計已過時的表格）
+- 最後以 PASSIVE 檢查點將 WAL 寫回資料庫檔案，不等待讀取中的連線
+"""
+import json
+from pathlib import Path
+import sqlite3
+import time
+
+from storage import get_backend
+
+# PRAGMA auto_vacuum 的值；INCREMENTAL 見 init_database 遷移 12
+AUTO_VACUUM_MODES = {0: 'none', 1: 'full', 2: 'incremental'}
+
+class MaintenanceManager:
+    def __init__(self, db_path='course_management.db'):
+        self.db_path = db_path
+
+    def _get_connection(self):
+        return get_backend(self.db_path).connect()
+
+    def _file_bytes(self):
+        """資料庫檔案與 WAL 檔案的大小"""
+        sizes = {}
+        for key, suffix in (('db_bytes', ''), ('wal_bytes', '-wal')):
+            path = Path(f'{self.db_path}{suffix}')
+            sizes[key] = path.stat().st_size if path.exists() else 0
+        return sizes
+
+    def _storage_stats(self, cursor):
+        cursor.execute('PRAGMA page_size')
+        page_size = cursor.fetchone()[0]
+        cursor.execute('PRAGMA page_count')
+        page_count = cursor.fetchone()[0]
+        cursor.execute('PRAGMA freelist_count')
+        freelist = cursor.fetchone()[0]
+        return dict(self._file_bytes(), page_size=page_size, page_count=page_count,
+                    freelist_pages=freelist, freelist_bytes=freelist * page_size)
+
+    def _has_stat1(self, cursor):
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+        return cursor.fetchone() is not None
+
+    def _unanalyzed_tables(self, cursor):
+        """有資料與索引、但 sqlite_stat1 沒有統計的表格（空表格分析後也不會有統計，略過）"""
+        stat_filter = ''
+        if self._has_stat1(cursor):
+            stat_filter = 'AND m.name NOT IN (SELECT tbl FROM sqlite_stat1)'
+        cursor.execute(f'''
+            SELECT DISTINCT m.name
+            FROM sqlite_master m
+            JOIN sqlite_master i ON i.type = 'index' AND i.tbl_name = m.name
+            WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite_%' {stat_filter}
+            ORDER BY m.name
+        ''')
+        tables = []
+        for (table,) in cursor.fetchall():
+            cursor.execute(f'SELECT 1 FROM "{table}" LIMIT 1')
+            if cursor.fetchone() is not None:
+                tables.append(table)
+        return tables
+
+    def _index_stats(self, cursor):
+        """
+        各索引的統計：sqlite_stat1 的資料列數與每個鍵值平均列數，
+        以及索引佔用的頁數（SQLite 編譯時含 dbstat 才有）
+        """
+        stats = {}
+        if self._has_stat1(cursor):
+            cursor.execute('SELECT tbl, idx, stat FROM sqlite_stat1 WHERE idx IS NOT NULL')
+            for table, index, stat in cursor.fetchall():
+                numbers = stat.split()
+                stats[index] = {
+                    'table': table,
+                    'rows': int(numbers[0]),
+                    'rows_per_key': int(numbers[1]) if len(numbers) > 1 else None,
+                }
+
+        try:
+            cursor.execute('''
+                SELECT d.name, i.tbl_name, d.pageno
+                FROM dbstat d
+                JOIN sqlite_master i ON i.type = 'index' AND i.name = d.name
+                WHERE d.aggregate = 1
+            ''')
+        except sqlite3.OperationalError:
+            return stats
+        for index, table, pages in cursor.fetchall():
+            stats.setdefault(index, {'table': table, 'rows': None, 'rows_per_key': None})
+            stats[index]['pages'] = pages
+
+        return dict(sorted(stats.items()))
+
+    def run(self, max_pages=2000, step_pages=100, sleep_ms=20, analysis_limit=1000, rebuild=False):
+        """
+        執行一次維護
+
+        Args:
+            max_pages: 本次最多歸還的空頁數（其餘留待下次）
+            step_pages: 每一步歸還的頁數（每步是一個短暫的寫入交易）
+            sleep_ms: 每步之間暫停的毫秒數
+            analysis_limit: ANALYZE 每個索引最多取樣的列數（0 為不限制）
+            rebuild: auto_vacuum 不是 INCREMENTAL 時改為 INCREMENTAL 並以 VACUUM 重建
+                     （獨佔資料庫、暫用兩倍空間，其他連線在期間會等待或逾時，請在離峰時執行）
+
+        Returns:
+            {'before': ..., 'after': ..., 'vacuum': ..., 'analyzed': [...],
+             'checkpoint': ..., 'indexes': {...}}
+        """
+        if get_backend(self.db_path).dialect != 'sqlite':
+            raise ValueError("資料庫維護僅支援 SQLite 資料庫（PostgreSQL 由 autovacuum 處理）")
+
+        started = time.perf_counter()
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        before = self._storage_stats(cursor)
+
+        cursor.execute('PRAGMA auto_vacuum')
+        mode = AUTO_VACUUM_MODES.get(cursor.fetchone()[0], 'unknown')
+
+        vacuum = {'auto_vacuum': mode, 'rebuilt': False, 'steps': 0, 'pages': 0}
+        if mode != 'incremental' and rebuild:
+            # 設定與 VACUUM 須在同一條連線、交易外執行，設定才會寫入重建後的資料庫
+            rebuild_started = time.perf_counter()
+            conn.run_to_completion('PRAGMA auto_vacuum = INCREMENTAL; VACUUM')
+            cursor.execute('PRAGMA auto_vacuum')
+            mode = vacuum['auto_vacuum'] = AUTO_VACUUM_MODES.get(cursor.fetchone()[0], 'unknown')
+            vacuum['rebuilt'] = True
+            vacuum['rebuild_ms'] = round((time.perf_counter() - rebuild_started) * 1000, 1)
+
+        if mode == 'incremental':
+            vacuum_started = time.perf_counter()
+            cursor.execute('PRAGMA freelist_count')
+            remaining = min(cursor.fetchone()[0], max_pages)
+            while remaining > 0:
+                pages = min(step_pages, remaining)
+                conn.run_to_completion(f'PRAGMA incremental_vacuum({int(pages)})')
+                vacuum['steps'] += 1
+                vacuum['pages'] += pages
+                remaining -= pages
+                if remaining > 0:
+                    time.sleep(sleep_ms / 1000)
+            vacuum['duration_ms'] = round((time.perf_counter() - vacuum_started) * 1000, 1)
+
+        analyze_started = time.perf_counter()
+        cursor.execute(f'PRAGMA analysis_limit = {int(analysis_limit)}')
+        analyzed = self._unanalyzed_tables(cursor)
+        for table in analyzed:
+            cursor.execute(f'ANALYZE "{table}"')
+        cursor.execute('PRAGMA optimize')
+        analyze_ms = round((time.perf_counter() - analyze_started) * 1000, 1)
+
+        # 檢查點完成（之後沒有新的寫入）時，歸還的頁面才會從資料庫檔案截去
+        cursor.execute('PRAGMA wal_checkpoint(PASSIVE)')
+        busy, wal_frames, checkpointed = cursor.fetchone()
+        after = self._storage_stats(cursor)
+        indexes = self._index_stats(cursor)
+        conn.close()
+
+        return {
+            'before': before,
+            'after': after,
+            'vacuum': vacuum,
+            'analyzed': analyzed,
+            'analyze_ms': analyze_ms,
+            'checkpoint': {'busy': bool(busy), 'wal_frames': wal_frames, 'checkpointed_frames': checkpointed},
+            'indexes': indexes,
+            'duration_ms': round((time.perf_counter() - started) * 1000, 1),
+        }
+
+
+def main():
+    """命令列介面"""
+    import sys
+
+    if len(sys.argv) < 2:
+        print("用法:")
+        print("  執行維護: python maintenance.py run [最多歸還頁數]")
+        print("  重建為 INCREMENTAL 後維護: python maintenance.py rebuild")
+        return
+
+    manager = MaintenanceManager()
+    action = sys.argv[1]
+
+    if action == 'run':
+        max_pages = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+        result = manager.run(max_pages)
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+
+    elif action == 'rebuild':
+        result = manager.run(rebuild=True)
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+
+if __name__ == '__main__':
+    main()
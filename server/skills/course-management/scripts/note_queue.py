@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+未完成課程備註的佇列：每則備註對應到學員下一堂課
+
+下一堂課是備註日期隔天（已過去則為基準日當天）或之後，學員啟用中課程的最早一次上課，
+跳過請假的日期（備註寫在當天的課後，不會排回同一堂課）；未完成的備註會一直順延到下一堂課，直到標記完成
+"""
+from time_columns import day_sql, from_day_number
+
+# 往後找幾週內的課程（連續請假超過此週數的備註暫不對應課程）
+LOOKAHEAD_WEEKS = 8
+
+# 所有學員一次計算：每則備註 × 學員每門課先算出最近一次上課日，
+# 只有那天請假時才往後逐週找（多數課程不必展開各週），再依日期與開始時間取第一個；
+# 未完成備註由部分索引 idx_class_notes_pending 讀取
+_RESOLVE_SQL = '''
+    WITH pending AS (
+        SELECT cn.id, cn.student_id,
+               CASE WHEN {note_day} + 1 > ? THEN {note_day} + 1 ELSE ? END AS from_day
+        FROM class_notes cn
+        WHERE cn.is_completed = 0{student_filter}
+    ),
+    weeks (k) AS (
+        VALUES {weeks}
+    ),
+    slots AS (
+        -- 1970-01-01 為週四，(天數 + 3) % 7 即星期（0=週一）
+        SELECT p.id AS note_id, p.student_id, s.id AS schedule_id, s.start_minute,
+               p.from_day + (s.weekday - (p.from_day + 3) % 7 + 7) % 7 AS first_day
+        FROM pending p
+        JOIN schedules s ON s.student_id = p.student_id AND s.is_active = 1
+    ),
+    candidates AS (
+        SELECT sl.note_id, sl.schedule_id, sl.start_minute,
+               CASE WHEN NOT EXISTS (
+                        SELECT 1 FROM leave_records lr
+                        WHERE lr.student_id = sl.student_id AND lr.leave_day = sl.first_day
+                    ) THEN sl.first_day
+                    ELSE (SELECT MIN(sl.first_day + 7 * w.k) FROM weeks w
+                          WHERE NOT EXISTS (
+                              SELECT 1 FROM leave_records lr
+                              WHERE lr.student_id = sl.student_id
+                                AND lr.leave_day = sl.first_day + 7 * w.k
+                          ))
+               END AS day
+        FROM slots sl{slot_filter}
+    ),
+    ranked AS (
+        SELECT c.note_id, c.schedule_id, c.day,
+               ROW_NUMBER() OVER (PARTITION BY c.note_id ORDER BY c.day, c.start_minute) AS rn
+        FROM candidates c
+        WHERE c.day IS NOT NULL
+    )
+    SELECT cn.id, cn.student_id, st.name, cn.note_date, cn.note_type, cn.content,
+           r.day, r.schedule_id, s.start_time, s.end_time
+    FROM pending p
+    JOIN class_notes cn ON cn.id = p.id
+    JOIN students st ON st.id = cn.student_id
+    LEFT JOIN ranked r ON r.note_id = p.id AND r.rn = 1
+    LEFT JOIN schedules s ON s.id = r.schedule_id
+    {day_filter}
+    ORDER BY r.day IS NULL, r.day, s.start_minute, cn.note_date, cn.id
+'''
+
+def resolve_pending_notes(cursor, as_of_day, dialect='sqlite', student_id=None, day=None):
+    """
+    未完成備註及其對應的下一堂課
+
+    Args:
+        cursor: 資料庫游標（可與呼叫端的查詢共用連線）
+        as_of_day: 基準日（天數）；備註從隔天開始找，已過去的備註從基準日開始找
+        student_id: 只查這位學員（預設全部）
+        day: 只回傳對應到這一天（天數）的備註，供每日課表使用
+
+    Returns:
+        [{'id', 'student_id', 'student_name', 'note_date', 'note_type', 'content',
+          'next_session': {'date', 'schedule_id', 'start_time', 'end_time'} 或 None}]
+    """
+    note_day = day_sql('cn.note_date', dialect)
+    params = [as_of_day, as_of_day]
+    student_filter = ''
+    if student_id is not None:
+        student_filter = ' AND cn.student_id = ?'
+        params.append(student_id)
+    slot_filter = ''
+    day_filter = ''
+    if day is not None:
+        # 只有當天有課的學員的備註可能排到這天，且晚於這天的上課日不影響結果
+        student_filter += (' AND cn.student_id IN (SELECT student_id FROM schedules'
+                           ' WHERE weekday = ? AND is_active = 1)')
+        params.append((day + 3) % 7)
+        slot_filter = ' WHERE sl.first_day <= ?'
+        params.append(day)
+        day_filter = 'WHERE r.day = ?'
+        params.append(day)
+
+    cursor.execute(_RESOLVE_SQL.format(
+        note_day=note_day,
+        student_filter=student_filter,
+        weeks=', '.join(f'({k})' for k in range(1, LOOKAHEAD_WEEKS)),
+        slot_filter=slot_filter,
+        day_filter=day_filter,
+    ), params)
+
+    notes = []
+    for row in cursor.fetchall():
+        notes.append({
+            'id': row[0],
+            'student_id': row[1],
+            'student_name': row[2],
+            'note_date': row[3],
+            'note_type': row[4],
+            'content': row[5],
+            'next_session': None if row[6] is None else {
+                'date': from_day_number(row[6]).isoformat(),
+                'schedule_id': row[7],
+                'start_time': row[8],
+                'end_time': row[9],
+            },
+        })
+    return notes
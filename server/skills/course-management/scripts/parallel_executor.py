@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+平行執行多個動作：互不相依的讀取動作在執行緒池同時執行，結果依原順序回傳
+
+- 每個工作執行緒使用自己的唯讀 SQLite 連線（見 storage.read_only_connections），
+  執行查詢時 sqlite3 模組會釋放 GIL，多個查詢可真正同時進行
+- 寫入動作是屏障：等之前的讀取都完成後才在呼叫端執行緒執行，
+  之後的讀取也在寫入提交後才開始，因此讀取一定看得到之前的寫入
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from storage import read_only_connections, close_read_connections
+
+class ParallelExecutor:
+    def __init__(self, run, is_read, max_workers=4):
+        """
+        Args:
+            run: 執行單一動作的函式 run(action, params)，回傳結果
+            is_read: 判斷動作是否唯讀的函式 is_read(action)
+            max_workers: 同時執行的讀取動作數
+        """
+        self.run = run
+        self.is_read = is_read
+        self.max_workers = max_workers
+
+    def execute(self, calls):
+        """
+        執行一組動作
+
+        Args:
+            calls: [{'action': 動作, 'args': {...}}, ...]
+
+        Returns:
+            與 calls 順序相同的 [{'ok': True, 'result': ...} 或 {'ok': False, 'error': ...}]；
+            單一動作失敗不影響其他動作
+        """
+        results = [None] * len(calls)
+        pending = []
+
+        try:
+            with ThreadPoolExecutor(self.max_workers, thread_name_prefix='skill-read') as pool:
+                for index, call in enumerate(calls):
+                    action = call.get('action')
+                    params = call.get('args', {})
+
+                    if action and self.is_read(action):
+                        pending.append((index, pool.submit(self._read, action, params)))
+                        continue
+
+                    self._collect(pending, results)
+                    results[index] = self._call(action, params)
+
+                self._collect(pending, results)
+        finally:
+            close_read_connections()
+
+        return results
+
+    def _collect(self, pending, results):
+        """等待已送出的讀取完成"""
+        for index, future in pending:
+            results[index] = future.result()
+        pending.clear()
+
+    def _read(self, action, params):
+        with read_only_connections():
+            return self._call(action, params)
+
+    def _call(self, action, params):
+        try:
+            if not action:
+                raise ValueError('Missing action')
+            return {'ok': True, 'result': self.run(action, params)}
+        except Exception as exc:
+            return {'ok': False, 'error': str(exc)}
+
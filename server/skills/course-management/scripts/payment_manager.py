@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+繳費記錄管理功能
+
+學員的應收/已收累計（payment_balances）與每月合計（payment_month_totals）
+由資料庫觸發器隨繳費記錄增減，欠款與每月收入查詢只讀彙總表，不必加總整本帳
+"""
+from datetime import datetime
+import json
+import re
+
+from storage import get_backend
+from projection import Projection
+
+# 查詢繳費記錄可用的欄位：輸出鍵 → SQL 欄位
+PAYMENT_FIELDS = {
+    'id': 'p.id',
+    'amount': 'p.amount',
+    'status': 'p.status',
+    'invoice_status': 'p.invoice_status',
+    'paid_at': 'p.paid_at',
+    'method': 'p.method',
+    'invoice_no': 'p.invoice_no',
+    'sessions_count': 'p.sessions_count',
+    'month_ref': 'p.month_ref',
+    'note': 'p.note',
+    'student_name': 'st.name',
+}
+
+PAYMENT_STATUSES = ('未繳', '已繳')
+
+# update_payment 可修改的欄位
+UPDATABLE_FIELDS = ('amount', 'status', 'invoice_status', 'paid_at', 'method',
+                    'invoice_no', 'sessions_count', 'month_ref', 'note')
+
+def _summary(billed, paid, payment_count, paid_count):
+    return {
+        'billed_amount': billed,
+        'paid_amount': paid,
+        'outstanding_amount': billed - paid,
+        'payment_count': payment_count,
+        'unpaid_count': payment_count - paid_count,
+    }
+
+class PaymentManager:
+    def __init__(self, db_path='course_management.db'):
+        self.db_path = db_path
+
+    def _get_connection(self):
+        return get_backend(self.db_path).connect()
+
+    def _resolve_student(self, student_id):
+        """學員姓名轉換為ID"""
+        if isinstance(student_id, str):
+            from student_manager import StudentManager
+            sm = StudentManager(self.db_path)
+            students = sm.get_student_by_name(student_id)
+            if not students:
+                raise ValueError(f"找不到學員: {student_id}")
+            student_id = students[0]['id']
+        return student_id
+
+    def _parse_date(self, date_str):
+        """轉換日期格式"""
+        if '/' in date_str:
+            date_str = date_str.replace('/', '-')
+        return datetime.strptime(date_str[:10], '%Y-%m-%d').date()
+
+    def _parse_month(self, month_str):
+        """帳款月份統一為 YYYY-MM（接受 2024/3、2024-03）"""
+        match = re.fullmatch(r'(\d{4})[-/](\d{1,2})', month_str.strip())
+        if not match or not 1 <= int(match.group(2)) <= 12:
+            raise ValueError(f"月份格式錯誤，應為 YYYY-MM: {month_str}")
+        return f"{match.group(1)}-{int(match.group(2)):02d}"
+
+    def _parse_amount(self, amount):
+        amount = int(amount)
+        if amount <= 0:
+            raise ValueError("金額必須為正數")
+        return amount
+
+    def _normalize(self, field, value):
+        """整理單一欄位的輸入值"""
+        if field == 'amount':
+            return self._parse_amount(value)
+        if value is None or value == '':
+            return None
+        if field == 'status' and value not in PAYMENT_STATUSES:
+            raise ValueError(f"繳費狀態應為 {'/'.join(PAYMENT_STATUSES)}: {value}")
+        if field == 'paid_at' and isinstance(value, str):
+            return self._parse_date(value)
+        if field == 'month_ref':
+            return self._parse_month(value)
+        if field == 'sessions_count':
+            return int(value)
+        return value
+
+    def add_payment(self, student_id, amount, status='未繳', invoice_status='未開立',
+                    paid_at=None, method='現金', invoice_no=None, sessions_count=None,
+                    month_ref=None, note=None):
+        """
+        新增繳費記錄
+
+        Args:
+            student_id: 學員ID或姓名
+            amount: 金額（正整數）
+            status: 繳費狀態 (未繳/已繳)
+            invoice_status: 發票狀態
+            paid_at: 繳費日期
+            method: 付款方式
+            invoice_no: 發票號碼
+            sessions_count: 本次款項涵蓋的堂數
+            month_ref: 帳款月份 (YYYY-MM)，每月合計依此分組
+            note: 備註
+
+        Returns:
+            新建繳費記錄的ID
+        """
+        student_id = self._resolve_student(student_id)
+        values = {
+            'amount': amount,
+            'status': status,
+            'invoice_status': invoice_status,
+            'paid_at': paid_at,
+            'method': method,
+            'invoice_no': invoice_no,
+            'sessions_count': sessions_count,
+            'month_ref': month_ref,
+            'note': note,
+        }
+        values = {field: self._normalize(field, value) for field, value in values.items()}
+
+        conn = self._get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute(f'''
+            INSERT INTO payments (student_id, {', '.join(values)})
+            VALUES (?, {', '.join('?' for _ in values)})
+        ''', (student_id, *values.values()))
+
+        payment_id = cursor.lastrowid
+        conn.commit()
+        conn.close()
+
+        return payment_id
+
+    def get_student_payments(self, student_id, fields=None):
+        """查詢學員的繳費記錄，依帳款月份由新到舊（fields 可只取部分欄位）"""
+        projection = Projection(PAYMENT_FIELDS, fields)
+        student_id = self._resolve_student(student_id)
+
+        conn = self._get_connection()
+        cursor = conn.cursor()
+
+        join = 'JOIN students st ON p.student_id = st.id' if projection.uses('st.') else ''
+        cursor.execute(f'''
+            SELECT {projection.select_list}
+            FROM payments p
+            {join}
+            WHERE p.student_id = ?
+            ORDER BY p.month_ref DESC, p.id DESC
+        ''', (student_id,))
+
+        results = cursor.fetchall()
+        conn.close()
+
+        return [projection.to_dict(row) for row in results]
+
+    def update_payment(self, payment_id, **kwargs):
+        """
+        更新繳費記錄
+
+        可更新欄位: amount, status, invoice_status, paid_at, method,
+                    invoice_no, sessions_count, month_ref, note
+        """
+        updates = []
+        values = []
+
+        for field, value in kwargs.items():
+            if field in UPDATABLE_FIELDS:
+                updates.append(f'{field} = ?')
+                values.append(self._normalize(field, value))
+
+        if not updates:
+            return False
+
+        values.append(payment_id)
+
+        conn = self._get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute(f'''
+            UPDATE payments
+            SET {', '.join(updates)}
+            WHERE id = ?
+        ''', values)
+
+        conn.commit()
+        success = cursor.rowcount > 0
+        conn.close()
+
+        return success
+
+    def delete_payment(self, payment_id):
+        """刪除繳費記錄"""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('DELETE FROM payments WHERE id = ?', (payment_id,))
+
+        conn.commit()
+        success = cursor.rowcount > 0
+        conn.close()
+
+        return success
+
+    def get_balance(self, student_id):
+        """學員的應收、已收與欠款（讀取彙總表的一列）"""
+        student_id = self._resolve_student(student_id)
+
+        conn = self._get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT billed_amount, paid_amount, payment_count, paid_count
+            FROM payment_balances
+            WHERE student_id = ?
+        ''', (student_id,))
+
+        row = cursor.fetchone()
+        conn.close()
+
+        return dict(student_id=student_id, **_summary(*(row or (0, 0, 0, 0))))
+
+    def list_outstanding(self, limit=None):
+        """有欠款的學員，依欠款金額由多到少"""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+
+        query = '''
+            SELECT pb.student_id, st.name,
+                   pb.billed_amount, pb.paid_amount, pb.payment_count, pb.paid_count
+            FROM payment_balances pb
+            JOIN students st ON pb.student_id = st.id
+            WHERE pb.billed_amount > pb.paid_amount
+            ORDER BY pb.billed_amount - pb.paid_amount DESC, st.name
+        '''
+        params = []
+        if limit:
+            query += ' LIMIT ?'
+            params.append(int(limit))
+
+        cursor.execute(query, params)
+        results = cursor.fetchall()
+        conn.close()
+
+        return [
+            dict(student_id=row[0], student_name=row[1], **_summary(*row[2:]))
+            for row in results
+        ]
+
+    def get_monthly_totals(self, start_month=None, end_month=None):
+        """
+        每月合計（依帳款月份，未填月份的款項只計入學員累計）
+
+        Args:
+            start_month: 起始月份 YYYY-MM（可選）
+            end_month: 結束月份 YYYY-MM（可選）
+        """
+        conditions = []
+        params = []
+        if start_month:
+            conditions.append('month_ref >= ?')
+            params.append(self._parse_month(start_month))
+        if end_month:
+            conditions.append('month_ref <= ?')
+            params.append(self._parse_month(end_month))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+        conn = self._get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute(f'''
+            SELECT month_ref, billed_amount, paid_amount, payment_count, paid_count
+            FROM payment_month_totals
+            {where}
+            ORDER BY month_ref
+        ''', params)
+
+        results = cursor.fetchall()
+        conn.close()
+
+        return [dict(month_ref=row[0], **_summary(*row[1:])) for row in results]
+
+
+def main():
+    """命令列介面"""
+    import sys
+
+    if len(sys.argv) < 2:
+        print("用法:")
+        print("  新增繳費: python payment_manager.py add <學員名> <金額> [帳款月份YYYY-MM] [狀態]")
+        print("  查繳費記錄: python payment_manager.py list <學員名>")
+        print("  標記已繳: python payment_manager.py paid <繳費ID> [繳費日期]")
+        print("  欠款名單: python payment_manager.py outstanding")
+        print("  每月合計: python payment_manager.py monthly [起始月份] [結束月份]")
+        return
+
+    manager = PaymentManager()
+    action = sys.argv[1]
+
+    if action == 'add':
+        student = sys.argv[2]
+        amount = sys.argv[3]
+        month_ref = sys.argv[4] if len(sys.argv) > 4 else None
+        status = sys.argv[5] if len(sys.argv) > 5 else '未繳'
+
+        payment_id = manager.add_payment(student, amount, status=status, month_ref=month_ref)
+        print(f"✅ 繳費記錄新增成功！ID: {payment_id}")
+
+    elif action == 'list':
+        student = sys.argv[2]
+        payments = manager.get_student_payments(student)
+        print(json.dumps(payments, ensure_ascii=False, indent=2, default=str))
+
+    elif action == 'paid':
+        payment_id = int(sys.argv[2])
+        paid_at = sys.argv[3] if len(sys.argv) > 3 else datetime.now().strftime('%Y-%m-%d')
+
+        if manager.update_payment(payment_id, status='已繳', paid_at=paid_at):
+            print(f"✅ 繳費記錄 {payment_id} 已標記為已繳")
+        else:
+            print(f"❌ 找不到繳費記錄: {payment_id}")
+
+    elif action == 'outstanding':
+        print(json.dumps(manager.list_outstanding(), ensure_ascii=False, indent=2))
+
+    elif action == 'monthly':
+        start_month = sys.argv[2] if len(sys.argv) > 2 else None
+        end_month = sys.argv[3] if len(sys.argv) > 3 else None
+        totals = manager.get_monthly_totals(start_month, end_month)
+        print(json.dumps(totals, ensure_ascii=False, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+查詢欄位投影：讀取動作依 fields 參數只 SELECT 需要的欄位，
+窄投影可由涵蓋索引直接回答，長文字欄位沒被要求時不會讀取
+"""
+
+def parse_fields(fields, available):
+    """
+    整理 fields 參數
+
+    Args:
+        fields: None（全部欄位）、欄位名稱列表，或以逗號分隔的字串
+        available: 可用的輸出欄位名稱（依預設輸出順序）
+
+    Returns:
+        要輸出的欄位名稱列表，依呼叫端指定的順序並去除重複
+    """
+    if fields is None:
+        return list(available)
+    if isinstance(fields, str):
+        fields = fields.split(',')
+
+    requested = []
+    for field in fields:
+        field = field.strip()
+        if field and field not in requested:
+            requested.append(field)
+
+    unknown = [field for field in requested if field not in available]
+    if unknown:
+        raise ValueError(f"不支援的欄位: {', '.join(unknown)}，可用: {', '.join(available)}")
+    if not requested:
+        raise ValueError("fields 至少需要一個欄位")
+    return requested
+
+class Projection:
+    def __init__(self, columns, fields=None, formatters=None):
+        """
+        Args:
+            columns: {輸出欄位: SQL 欄位或欄位列表}，依預設輸出順序
+            fields: 呼叫端要求的欄位（見 parse_fields）
+            formatters: {輸出欄位: 以該欄位的 SQL 值為參數、回傳輸出值的函式}
+        """
+        self.fields = parse_fields(fields, list(columns))
+        self.formatters = formatters or {}
+
+        self.columns = []
+        self._slices = []
+        for field in self.fields:
+            sources = columns[field]
+            if isinstance(sources, str):
+                sources = [sources]
+            start = len(self.columns)
+            self.columns.extend(sources)
+            self._slices.append((field, start, len(self.columns)))
+
+    @property
+    def select_list(self):
+        return ', '.join(self.columns)
+
+    def uses(self, alias):
+        """投影是否用到某個表格別名（如 'st.'），用來決定是否需要 JOIN"""
+        return any(column.startswith(alias) for column in self.columns)
+
+    def source_columns(self, alias, required=()):
+        """投影用到的某表格欄位名稱（不含別名），加上 WHERE / ORDER BY 需要的欄位"""
+        names = list(required)
+        for column in self.columns:
+            if column.startswith(alias) and column[len(alias):] not in names:
+                names.append(column[len(alias):])
+        return names
+
+    def to_dict(self, row):
+        record = {}
+        for field, start, end in self._slices:
+            formatter = self.formatters.get(field)
+            record[field] = formatter(*row[start:end]) if formatter else row[start]
+        return record
+
+    def stream(self, conn, cursor, batch_size=500):
+        """逐批讀取已執行查詢的游標並逐筆轉為 dict，讀完或產生器被關閉時關閉連線"""
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield self.to_dict(row)
+        finally:
+            conn.close()
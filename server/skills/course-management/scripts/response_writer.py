@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+回應序列化：有安裝 orjson 時使用 orjson，否則使用標準庫 json；
+列表結果（或結果 dict 中的產生器欄位）逐筆寫出，不在記憶體中組出完整字串；另支援 MessagePack 二進位格式
+"""
+import inspect
+import json
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+FORMATS = ('json', 'msgpack')
+
+def peak_rss_kb():
+    """目前程序的最高常駐記憶體（KB）；無法取得時回傳 None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 以 bytes 為單位，Linux 以 KB 為單位
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+def _json_encoder():
+    """回傳 (名稱, 將物件編碼為 UTF-8 bytes 的函式)"""
+    if orjson is not None:
+        # 日期交給 default=str，輸出與標準庫 json 相同（'2024-01-01 10:00:00'）
+        options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        return 'orjson', lambda obj: orjson.dumps(obj, default=str, option=options)
+    return 'json', lambda obj: json.dumps(obj, ensure_ascii=False, default=str).encode('utf-8')
+
+def _is_stream(value):
+    return isinstance(value, (list, tuple)) or inspect.isgenerator(value)
+
+def _has_stream_field(value):
+    """結果為 dict 且有欄位是產生器（如 changes_since 的 changes）"""
+    return isinstance(value, dict) and any(inspect.isgenerator(item) for item in value.values())
+
+class ResponseWriter:
+    def __init__(self, stream=None, fmt='json'):
+        """
+        Args:
+            stream: 二進位輸出串流，預設為 stdout
+            fmt: 輸出格式 json 或 msgpack
+        """
+        if fmt not in FORMATS:
+            raise ValueError(f"不支援的輸出格式: {fmt}，可用格式: {', '.join(FORMATS)}")
+        if fmt == 'msgpack' and msgpack is None:
+            raise ValueError("輸出 MessagePack 需要安裝 msgpack 套件")
+
+        self.stream = stream or sys.stdout.buffer
+        self.fmt = fmt
+        if fmt == 'msgpack':
+            self.encoder = 'msgpack'
+            self._packer = msgpack.Packer(default=str, use_bin_type=True)
+        else:
+            self.encoder, self._encode = _json_encoder()
+
+        self.stats = {'format': fmt, 'encoder': self.encoder, 'bytes': 0, 'items': None}
+
+    def _write(self, data):
+        self.stream.write(data)
+        self.stats['bytes'] += len(data)
+
+    def write(self, ok, result=None, error=None):
+        """
+        寫出 {'ok': ..., 'result': ...} 或 {'ok': False, 'error': ...}
+
+        result 為列表或產生器（或 dict 中有產生器欄位）時逐筆編碼寫出，產生器的資料不會全部留在記憶體。
+        產生器邊寫邊讀，讀取錯誤要到寫出途中才會發生：JSON 的 ok 欄位因此寫在最後，
+        中途失敗時 result 只有已寫出的部分，接著寫 "ok": false 與 error，輸出仍是完整的 JSON；
+        錯誤訊息另記在回傳統計的 stream_error
+        """
+        started = time.perf_counter()
+        if not ok:
+            self._write_whole({'ok': False, 'error': error})
+        elif _has_stream_field(result):
+            if self.fmt == 'msgpack':
+                # MessagePack 陣列開頭需要長度，產生器須先展開
+                try:
+                    result = {key: list(value) if inspect.isgenerator(value) else value
+                              for key, value in result.items()}
+                except Exception as exc:
+                    self._write_whole({'ok': False, 'error': self._stream_failed(exc)})
+                else:
+                    self._write_whole({'ok': True, 'result': result})
+            else:
+                self._write_json_object(result)
+        elif not _is_stream(result):
+            self._write_whole({'ok': True, 'result': result})
+        elif self.fmt == 'msgpack':
+            self._write_msgpack_array(result)
+        else:
+            self._write_json_array(result)
+        self.stream.flush()
+
+        self.stats['serialize_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        self.stats['peak_rss_kb'] = peak_rss_kb()
+        return self.stats
+
+    def _stream_failed(self, exc):
+        error = str(exc)
+        self.stats['stream_error'] = error
+        return error
+
+    def _write_whole(self, payload):
+        if self.fmt == 'msgpack':
+            self._write(self._packer.pack(payload))
+        else:
+            self._write(self._encode(payload) + b'\n')
+
+    def _write_json_status(self, error):
+        if error is None:
+            self._write(b', "ok": true}')
+        else:
+            self._write(b', "ok": false, "error": ' + self._encode(error) + b'}')
+
+    def _write_json_array(self, items):
+        self._write(b'{"result": ')
+        error = self._write_json_items(items)
+        self._write_json_status(error)
+        self._write(b'\n')
+
+    def _write_json_object(self, result):
+        self._write(b'{"result": {')
+        error = None
+        for index, (key, value) in enumerate(result.items()):
+            self._write((b', ' if index else b'') + self._encode(key) + b': ')
+            if inspect.isgenerator(value):
+                error = self._write_json_items(value)
+                if error is not None:
+                    break
+            else:
+                self._write(self._encode(value))
+        self._write(b'}')
+        self._write_json_status(error)
+        self._write(b'\n')
+
+    def _write_json_items(self, items):
+        """逐筆寫出陣列；讀取或編碼失敗時結束陣列並回傳錯誤訊息，寫出本身的錯誤照常拋出"""
+        self._write(b'[')
+        count = 0
+        error = None
+        iterator = iter(items)
+        while True:
+            try:
+                data = self._encode(next(iterator))
+            except StopIteration:
+                break
+            except Exception as exc:
+                error = self._stream_failed(exc)
+                break
+            self._write(b', ' + data if count else data)
+            count += 1
+        self._write(b']')
+        self.stats['items'] = count
+        return error
+
+    def _write_msgpack_array(self, items):
+        # MessagePack 陣列開頭需要長度，產生器須先展開（展開失敗時還沒有寫出任何資料）
+        if not isinstance(items, (list, tuple)):
+            try:
+                items = list(items)
+            except Exception as exc:
+                self._write_whole({'ok': False, 'error': self._stream_failed(exc)})
+                return
+        self._write(self._packer.pack_map_header(2))
+        self._write(self._packer.pack('ok') + self._packer.pack(True))
+        self._write(self._packer.pack('result') + self._packer.pack_array_header(len(items)))
+        for item in items:
+            self._write(self._packer.pack(item))
+        self.stats['items'] = len(items)
@@ -2,10 +2,16 @@
 """
 課程安排管理功能
 """
-import sqlite3
 from datetime import datetime, timedelta
 import json
 
+from storage import get_backend
+from time_columns import to_minutes, format_minutes, day_number
+from note_queue import resolve_pending_notes
+
+# 未指定結束時間時的課程長度（分鐘）
+DEFAULT_DURATION = 100
+
 class ScheduleManager:
     def __init__(self, db_path='course_management.db'):
         self.db_path = db_path
@@ -31,7 +37,7 @@ class ScheduleManager:
         }
     
     def _get_connection(self):
-        return sqlite3.connect(self.db_path)
+        return get_backend(self.db_path).connect()
     
     def _parse_weekday(self, weekday_str):
         """轉換星期字串為數字"""
@@ -67,13 +73,7 @@ class ScheduleManager:
         
         # 如果沒有提供結束時間，根據開始時間推算（預設1小時40分鐘）
         if end_time is None:
-            hour, minute = map(int, start_time.split(':'))
-            end_hour = hour + 1
-            end_minute = minute + 40
-            if end_minute >= 60:
-                end_hour += 1
-                end_minute -= 60
-            end_time = f"{end_hour:02d}:{end_minute:02d}"
+            end_time = format_minutes(to_minutes(start_time) + DEFAULT_DURATION)
         elif ':' not in end_time:
             end_time = f"{end_time[:2]}:{end_time[2:]}"
         
@@ -109,7 +109,7 @@ class ScheduleManager:
             FROM schedules s
             JOIN students st ON s.student_id = st.id
             WHERE s.student_id = ? AND s.is_active = 1
-            ORDER BY s.weekday, s.start_time
+            ORDER BY s.weekday, s.start_minute
         ''', (student_id,))
         
         results = cursor.fetchall()
@@ -150,7 +150,7 @@ class ScheduleManager:
                 FROM schedules s
                 JOIN students st ON s.student_id = st.id
                 WHERE s.weekday = ? AND s.is_active = 1
-                ORDER BY s.start_time
+                ORDER BY s.start_minute
             ''', (weekday,))
         else:
             cursor.execute('''
@@ -159,7 +159,7 @@ class ScheduleManager:
                 FROM schedules s
                 JOIN students st ON s.student_id = st.id
                 WHERE s.is_active = 1
-                ORDER BY s.weekday, s.start_time
+                ORDER BY s.weekday, s.start_minute
             ''')
         
         results = cursor.fetchall()
@@ -181,6 +181,111 @@ class ScheduleManager:
         
         return schedules
     
+    def get_daily_agenda(self, date):
+        """
+        查詢某一天的完整課表（單一查詢）
+        
+        每堂課包含：學員、當天是否請假、最新檢測的課程比例，
+        以及排到這堂課的未完成課程備註（備註只出現在學員的下一堂課，見 note_queue）
+        
+        Args:
+            date: 日期（支援 '今天'、'2/7'、'2024/2/7' 等格式）
+        """
+        if isinstance(date, str):
+            from attendance_manager import AttendanceManager
+            date = AttendanceManager(self.db_path)._parse_date(date)
+        
+        weekday = date.weekday()
+        date_str = date.isoformat()
+        day = day_number(date)
+        
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            WITH sessions AS (
+                SELECT s.id, s.student_id, s.start_time, s.end_time, s.start_minute
+                FROM schedules s
+                WHERE s.weekday = ? AND s.is_active = 1
+            ),
+            latest_assessment AS (
+                SELECT ar.student_id, ar.assessment_date, ar.assessment_type,
+                       ar.visual_ratio, ar.auditory_ratio, ar.motor_ratio, ar.academic_ratio,
+                       ROW_NUMBER() OVER (
+                           PARTITION BY ar.student_id
+                           ORDER BY ar.assessment_day DESC, ar.id DESC
+                       ) AS rn
+                FROM assessment_records ar
+                WHERE ar.student_id IN (SELECT student_id FROM sessions)
+            )
+            SELECT se.id, se.start_time, se.end_time,
+                   st.id, st.name, st.type,
+                   (SELECT lr.reason FROM leave_records lr
+                    WHERE lr.student_id = se.student_id AND lr.leave_day = ?
+                    LIMIT 1) AS leave_reason,
+                   (SELECT COUNT(*) FROM leave_records lr
+                    WHERE lr.student_id = se.student_id AND lr.leave_day = ?) AS leave_count,
+                   la.assessment_date, la.assessment_type,
+                   la.visual_ratio, la.auditory_ratio, la.motor_ratio, la.academic_ratio
+            FROM sessions se
+            JOIN students st ON se.student_id = st.id
+            LEFT JOIN latest_assessment la ON la.student_id = se.student_id AND la.rn = 1
+            ORDER BY se.start_minute, st.name, se.id
+        ''', (weekday, day, day))
+        
+        results = cursor.fetchall()
+        
+        # 過去的日期以當天為基準，顯示當時排到這堂課的備註
+        as_of = min(day, day_number(datetime.now().date()))
+        notes = resolve_pending_notes(cursor, as_of, get_backend(self.db_path).dialect, day=day)
+        conn.close()
+        
+        weekday_names = ['週一', '週二', '週三', '週四', '週五', '週六', '週日']
+        
+        sessions = []
+        by_schedule = {}
+        for row in results:
+            session = {
+                'schedule_id': row[0],
+                'start_time': row[1],
+                'end_time': row[2],
+                'student_id': row[3],
+                'student_name': row[4],
+                'student_type': row[5],
+                'on_leave': row[7] > 0,
+                'leave_reason': row[6],
+                'latest_assessment': None,
+                'pending_notes': [],
+            }
+            if row[8] is not None:
+                session['latest_assessment'] = {
+                    'date': row[8],
+                    'type': row[9],
+                    'ratios': {
+                        'visual': row[10],
+                        'auditory': row[11],
+                        'motor': row[12],
+                        'academic': row[13]
+                    }
+                }
+            by_schedule[row[0]] = session
+            sessions.append(session)
+        
+        for note in notes:
+            by_schedule[note['next_session']['schedule_id']]['pending_notes'].append({
+                'id': note['id'],
+                'date': note['note_date'],
+                'type': note['note_type'],
+                'content': note['content']
+            })
+        
+        return {
+            'date': date_str,
+            'weekday': weekday,
+            'weekday_name': weekday_names[weekday],
+            'sessions': sessions
+        }
+    
     def delete_schedule(self, schedule_id):
         """刪除（停用）固定課程"""
         conn = self._get_connection()
@@ -0,0 +1,267 @@
+-- 課程管理技能的 PostgreSQL 結構（對應 init_database.py 的 SQLite 結構與遷移）
+-- 表名皆為小寫，與 Prisma 管理的 "Student"、"Session" 等表格可並存於同一資料庫
+-- 布林欄位沿用 INTEGER 0/1，讓管理器的 SQL 可在兩種後端共用
+
+CREATE TABLE IF NOT EXISTS students (
+    id SERIAL PRIMARY KEY,
+    name TEXT NOT NULL,
+    birthdate DATE NOT NULL,
+    type TEXT CHECK(type IN ('a超前', 'b一般', 'c特殊')),
+    status TEXT CHECK(status IN ('檢測中', '進行中', '成案', '離室')) DEFAULT '檢測中',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS schedules (
+    id SERIAL PRIMARY KEY,
+    student_id INTEGER NOT NULL REFERENCES students(id),
+    weekday INTEGER CHECK(weekday >= 0 AND weekday <= 6),
+    start_time TEXT NOT NULL,
+    end_time TEXT NOT NULL,
+    is_active INTEGER DEFAULT 1,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS attendance_records (
+    id SERIAL PRIMARY KEY,
+    student_id INTEGER NOT NULL REFERENCES students(id),
+    class_date DATE NOT NULL,
+    start_time TEXT NOT NULL,
+    end_time TEXT NOT NULL,
+    attendance_status TEXT CHECK(attendance_status IN ('出席', '請假', '缺席')) DEFAULT '出席',
+    visual_content TEXT,
+    auditory_content TEXT,
+    motor_content TEXT,
+    notes TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS assessment_records (
+    id SERIAL PRIMARY KEY,
+    student_id INTEGER NOT NULL REFERENCES students(id),
+    assessment_date DATE NOT NULL,
+    assessment_type TEXT CHECK(assessment_type IN ('初測', '複測', '追蹤')) DEFAULT '初測',
+    visual_age_year INTEGER,
+    visual_age_month INTEGER,
+    auditory_age_year INTEGER,
+    auditory_age_month INTEGER,
+    motor_age_year INTEGER,
+    motor_age_month INTEGER,
+    visual_ratio INTEGER CHECK(visual_ratio >= 0 AND visual_ratio <= 100),
+    auditory_ratio INTEGER CHECK(auditory_ratio >= 0 AND auditory_ratio <= 100),
+    motor_ratio INTEGER CHECK(motor_ratio >= 0 AND motor_ratio <= 100),
+    academic_ratio INTEGER CHECK(academic_ratio >= 0 AND academic_ratio <= 100),
+    notes TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    CHECK ((visual_ratio + auditory_ratio + motor_ratio + academic_ratio) = 100 OR
+           (visual_ratio IS NULL AND auditory_ratio IS NULL AND motor_ratio IS NULL AND academic_ratio IS NULL))
+);
+
+CREATE TABLE IF NOT EXISTS leave_records (
+    id SERIAL PRIMARY KEY,
+    student_id INTEGER NOT NULL REFERENCES students(id),
+    leave_date DATE NOT NULL,
+    reason TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS class_notes (
+    id SERIAL PRIMARY KEY,
+    student_id INTEGER NOT NULL REFERENCES students(id),
+    note_date DATE NOT NULL,
+    note_type TEXT CHECK(note_type IN ('視覺加強', '聽覺加強', '運動加強', '一般備註')),
+    content TEXT NOT NULL,
+    is_completed INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS payments (
+    id SERIAL PRIMARY KEY,
+    student_id INTEGER NOT NULL REFERENCES students(id),
+    amount INTEGER NOT NULL CHECK(amount > 0),
+    status TEXT CHECK(status IN ('未繳', '已繳')) DEFAULT '未繳',
+    invoice_status TEXT DEFAULT '未開立',
+    paid_at DATE,
+    method TEXT DEFAULT '現金',
+    invoice_no TEXT,
+    sessions_count INTEGER,
+    month_ref TEXT,
+    note TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_students_name ON students(name);
+CREATE INDEX IF NOT EXISTS idx_schedules_student ON schedules(student_id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_attendance_natural_key
+    ON attendance_records(student_id, class_date, start_time);
+CREATE INDEX IF NOT EXISTS idx_class_notes_pending
+    ON class_notes(student_id, note_date) WHERE is_completed = 0;
+
+-- 時間的整數欄位（對應 time_columns.py，SQLite 由觸發器維護）
+ALTER TABLE schedules ADD COLUMN IF NOT EXISTS start_minute INTEGER
+    GENERATED ALWAYS AS (split_part(start_time, ':', 1)::integer * 60 + split_part(start_time, ':', 2)::integer) STORED;
+ALTER TABLE schedules ADD COLUMN IF NOT EXISTS end_minute INTEGER
+    GENERATED ALWAYS AS (split_part(end_time, ':', 1)::integer * 60 + split_part(end_time, ':', 2)::integer) STORED;
+ALTER TABLE attendance_records ADD COLUMN IF NOT EXISTS class_day INTEGER
+    GENERATED ALWAYS AS (class_date - DATE '1970-01-01') STORED;
+ALTER TABLE attendance_records ADD COLUMN IF NOT EXISTS start_minute INTEGER
+    GENERATED ALWAYS AS (split_part(start_time, ':', 1)::integer * 60 + split_part(start_time, ':', 2)::integer) STORED;
+ALTER TABLE attendance_records ADD COLUMN IF NOT EXISTS end_minute INTEGER
+    GENERATED ALWAYS AS (split_part(end_time, ':', 1)::integer * 60 + split_part(end_time, ':', 2)::integer) STORED;
+ALTER TABLE leave_records ADD COLUMN IF NOT EXISTS leave_day INTEGER
+    GENERATED ALWAYS AS (leave_date - DATE '1970-01-01') STORED;
+ALTER TABLE assessment_records ADD COLUMN IF NOT EXISTS assessment_day INTEGER
+    GENERATED ALWAYS AS (assessment_date - DATE '1970-01-01') STORED;
+
+DROP INDEX IF EXISTS idx_assessment_student;
+DROP INDEX IF EXISTS idx_leave_student_date;
+DROP INDEX IF EXISTS idx_schedules_weekday;
+DROP INDEX IF EXISTS idx_attendance_date_slot;
+DROP INDEX IF EXISTS idx_attendance_student_calendar;
+CREATE INDEX IF NOT EXISTS idx_attendance_day_slot
+    ON attendance_records(class_day, attendance_status, start_minute, end_minute);
+CREATE INDEX IF NOT EXISTS idx_attendance_student_day
+    ON attendance_records(student_id, class_day DESC, start_minute,
+                          class_date, start_time, end_time, attendance_status);
+CREATE INDEX IF NOT EXISTS idx_schedules_weekday_minute
+    ON schedules(weekday, start_minute) WHERE is_active = 1;
+CREATE INDEX IF NOT EXISTS idx_schedules_student_minute
+    ON schedules(student_id, weekday, start_minute, end_minute) WHERE is_active = 1;
+CREATE INDEX IF NOT EXISTS idx_leave_student_day ON leave_records(student_id, leave_day);
+CREATE INDEX IF NOT EXISTS idx_assessment_student_day ON assessment_records(student_id, assessment_day);
+
+-- 變更記錄
+CREATE TABLE IF NOT EXISTS skill_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+
+CREATE TABLE IF NOT EXISTS change_log (
+    seq BIGSERIAL PRIMARY KEY,
+    table_name TEXT NOT NULL,
+    row_id INTEGER NOT NULL,
+    student_id INTEGER,
+    op TEXT NOT NULL CHECK(op IN ('insert', 'update', 'delete', 'archive')),
+    changed_at TIMESTAMP DEFAULT (now() AT TIME ZONE 'utc')
+);
+
+CREATE INDEX IF NOT EXISTS idx_change_log_table ON change_log(table_name, seq);
+
+CREATE TABLE IF NOT EXISTS stat_cache (
+    cache_key TEXT PRIMARY KEY,
+    version BIGINT NOT NULL,
+    payload TEXT NOT NULL,
+    computed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 繳費彙總（對應 init_database.py 的遷移 10），由觸發器隨繳費記錄增減
+CREATE INDEX IF NOT EXISTS idx_payments_student_month ON payments(student_id, month_ref);
+
+CREATE TABLE IF NOT EXISTS payment_balances (
+    student_id INTEGER PRIMARY KEY,
+    billed_amount BIGINT NOT NULL DEFAULT 0,
+    paid_amount BIGINT NOT NULL DEFAULT 0,
+    payment_count INTEGER NOT NULL DEFAULT 0,
+    paid_count INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS payment_month_totals (
+    month_ref TEXT PRIMARY KEY,
+    billed_amount BIGINT NOT NULL DEFAULT 0,
+    paid_amount BIGINT NOT NULL DEFAULT 0,
+    payment_count INTEGER NOT NULL DEFAULT 0,
+    paid_count INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE OR REPLACE FUNCTION skill_apply_payment(p_student_id INTEGER, p_month_ref TEXT,
+                                               p_amount INTEGER, p_status TEXT, p_sign INTEGER)
+RETURNS void AS $$
+DECLARE
+    paid INTEGER := CASE WHEN p_status = '已繳' THEN 1 ELSE 0 END;
+BEGIN
+    INSERT INTO payment_balances AS t (student_id, billed_amount, paid_amount, payment_count, paid_count)
+    VALUES (p_student_id, p_sign * p_amount, p_sign * p_amount * paid, p_sign, p_sign * paid)
+    ON CONFLICT (student_id) DO UPDATE SET
+        billed_amount = t.billed_amount + excluded.billed_amount,
+        paid_amount = t.paid_amount + excluded.paid_amount,
+        payment_count = t.payment_count + excluded.payment_count,
+        paid_count = t.paid_count + excluded.paid_count;
+    DELETE FROM payment_balances WHERE student_id = p_student_id AND payment_count = 0;
+
+    IF p_month_ref IS NOT NULL THEN
+        INSERT INTO payment_month_totals AS t (month_ref, billed_amount, paid_amount, payment_count, paid_count)
+        VALUES (p_month_ref, p_sign * p_amount, p_sign * p_amount * paid, p_sign, p_sign * paid)
+        ON CONFLICT (month_ref) DO UPDATE SET
+            billed_amount = t.billed_amount + excluded.billed_amount,
+            paid_amount = t.paid_amount + excluded.paid_amount,
+            payment_count = t.payment_count + excluded.payment_count,
+            paid_count = t.paid_count + excluded.paid_count;
+        DELETE FROM payment_month_totals WHERE month_ref = p_month_ref AND payment_count = 0;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION skill_payment_totals() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM skill_apply_payment(OLD.student_id, OLD.month_ref, OLD.amount, OLD.status, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM skill_apply_payment(NEW.student_id, NEW.month_ref, NEW.amount, NEW.status, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_payments_totals ON payments;
+CREATE TRIGGER trg_payments_totals
+    AFTER INSERT OR UPDATE OF student_id, amount, status, month_ref OR DELETE ON payments
+    FOR EACH ROW EXECUTE FUNCTION skill_payment_totals();
+
+-- 出席警示的計算結果（對應遷移 11）
+CREATE TABLE IF NOT EXISTS attendance_alert_state (
+    student_id INTEGER PRIMARY KEY,
+    streak INTEGER NOT NULL,
+    streak_absent INTEGER NOT NULL,
+    streak_leave INTEGER NOT NULL,
+    streak_first_day INTEGER,
+    streak_last_day INTEGER,
+    sessions INTEGER NOT NULL,
+    attended INTEGER NOT NULL,
+    prev_sessions INTEGER NOT NULL,
+    prev_attended INTEGER NOT NULL
+);
+
+CREATE OR REPLACE FUNCTION skill_log_change() RETURNS trigger AS $$
+DECLARE
+    rec RECORD;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        rec := OLD;
+    ELSE
+        rec := NEW;
+    END IF;
+    INSERT INTO change_log (table_name, row_id, student_id, op)
+    VALUES (
+        TG_TABLE_NAME,
+        rec.id,
+        CASE WHEN TG_TABLE_NAME = 'students' THEN rec.id
+             ELSE (to_jsonb(rec) ->> 'student_id')::INTEGER END,
+        lower(TG_OP)
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    t TEXT;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['students', 'schedules', 'attendance_records',
+                             'assessment_records', 'leave_records', 'class_notes', 'payments']
+    LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS trg_%s_log ON %I', t, t);
+        EXECUTE format('CREATE TRIGGER trg_%s_log AFTER INSERT OR UPDATE OR DELETE ON %I
+                        FOR EACH ROW EXECUTE FUNCTION skill_log_change()', t, t);
+    END LOOP;
+END $$;
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+多中心分片路由（每個中心一個 SQLite 檔案）
+"""
+import heapq
+import json
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+class ShardRouter:
+    def __init__(self, shards, max_workers=None):
+        """
+        Args:
+            shards: 中心代碼對應資料庫路徑的字典，如 {'taipei': 'taipei.db'}
+            max_workers: 跨中心查詢的執行緒數，預設為分片數
+        """
+        if not shards:
+            raise ValueError("至少需要設定一個中心分片")
+        self.shards = dict(shards)
+        self.max_workers = max_workers or len(self.shards)
+
+    @classmethod
+    def from_config(cls, config_path, max_workers=None):
+        """
+        從 JSON 設定檔建立路由，格式: {"中心代碼": "資料庫路徑", ...}
+        相對路徑以設定檔所在目錄為基準
+        """
+        config_path = Path(config_path)
+        with open(config_path, encoding='utf-8') as f:
+            config = json.load(f)
+
+        shards = {}
+        for center, db_path in config.items():
+            path = Path(db_path)
+            if not path.is_absolute():
+                path = config_path.parent / path
+            shards[center] = str(path)
+
+        return cls(shards, max_workers)
+
+    def centers(self):
+        return list(self.shards)
+
+    def db_path_for(self, center):
+        """取得中心對應的資料庫路徑"""
+        if center is None:
+            if len(self.shards) == 1:
+                return next(iter(self.shards.values()))
+            raise ValueError(f"請指定中心 (center)，可用: {', '.join(self.shards)}")
+        if center not in self.shards:
+            raise ValueError(f"找不到中心: {center}")
+        return self.shards[center]
+
+    def manager(self, manager_cls, center):
+        """建立指向特定中心的管理器，寫入操作一律經此路由"""
+        return manager_cls(self.db_path_for(center))
+
+    def map_shards(self, func, centers=None):
+        """
+        在執行緒池上對每個分片執行 func(db_path)
+
+        Returns:
+            {中心代碼: 結果}，順序與分片設定相同
+        """
+        targets = centers or self.centers()
+        paths = [self.db_path_for(center) for center in targets]
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(paths))) as pool:
+            results = list(pool.map(func, paths))
+
+        return dict(zip(targets, results))
+
+    def fan_out(self, func, sort_key=None, centers=None):
+        """
+        跨中心查詢：各分片平行執行 func(db_path) 取得已排序的列表，
+        為每筆結果標上 center 後依 sort_key 合併排序
+
+        Args:
+            func: 接收資料庫路徑、回傳 dict 列表的函式
+            sort_key: 各分片結果共同的排序鍵；None 則依分片順序串接
+        """
+        per_center = self.map_shards(func, centers)
+
+        tagged = []
+        for center, rows in per_center.items():
+            tagged.append([dict(row, center=center) for row in rows or []])
+
+        if sort_key is None:
+            return [row for rows in tagged for row in rows]
+
+        # 各分片已依相同條件排序，k 路合併即可
+        return list(heapq.merge(*tagged, key=sort_key))
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+統計結果快取：結果連同計算時的寫入版本存在 stat_cache，版本相同才沿用
+"""
+import json
+
+from storage import get_backend
+
+class StatCache:
+    def __init__(self, db_path='course_management.db'):
+        self.db_path = db_path
+
+    def _get_connection(self):
+        return get_backend(self.db_path).connect()
+
+    def get(self, key, version):
+        """版本相同時回傳快取的結果，否則回傳 None"""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT version, payload FROM stat_cache WHERE cache_key = ?', (key,))
+        row = cursor.fetchone()
+        conn.close()
+
+        if row is None or row[0] != version:
+            return None
+        return json.loads(row[1])
+
+    def put(self, key, version, payload, prefix=None, keep=8):
+        """
+        存入結果
+
+        Args:
+            prefix: 鍵中含日期等會一直變化的參數時傳入鍵的前綴，
+                    同前綴的其他鍵刪除版本已過期的，其餘只保留最近 keep 個，避免表格無限增長
+            keep: 同前綴保留的鍵數（含這次存入的）
+        """
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO stat_cache (cache_key, version, payload) VALUES (?, ?, ?)
+            ON CONFLICT(cache_key) DO UPDATE SET
+                version = excluded.version,
+                payload = excluded.payload,
+                computed_at = CURRENT_TIMESTAMP
+        ''', (key, version, json.dumps(payload, ensure_ascii=False, default=str)))
+        if prefix is not None:
+            # 以 substr 比對前綴：前綴中的 _ 在 LIKE 是萬用字元
+            cursor.execute('''
+                DELETE FROM stat_cache
+                WHERE substr(cache_key, 1, ?) = ? AND cache_key != ?
+                  AND (version < ? OR cache_key NOT IN (
+                      SELECT cache_key FROM stat_cache
+                      WHERE substr(cache_key, 1, ?) = ? AND cache_key != ?
+                      ORDER BY computed_at DESC, cache_key DESC
+                      LIMIT ?
+                  ))
+            ''', (len(prefix), prefix, key, version, len(prefix), prefix, key, max(keep - 1, 0)))
+        conn.commit()
+        conn.close()
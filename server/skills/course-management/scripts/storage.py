@@ -0,0 +1,616 @@
+#!/usr/bin/env python3
+"""
+儲存後端：管理器透過後端取得連線，可使用 SQLite 檔案或 PostgreSQL 連線池
+"""
+from contextlib import contextmanager
+import os
+from pathlib import Path
+import random
+import re
+import sqlite3
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+POSTGRES_SCHEMES = ('postgres://', 'postgresql://')
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+# 目前執行緒是否在 read_only_connections() 區塊內
+_read_only = threading.local()
+
+# 目前執行緒在 shared_connections() 區塊內共用的連線：{後端: 連線}
+_shared = threading.local()
+
+
+def is_postgres_url(db_path):
+    return isinstance(db_path, str) and db_path.startswith(POSTGRES_SCHEMES)
+
+
+def get_backend(db_path):
+    """
+    依資料庫路徑取得後端（同一路徑共用同一個後端，連線池因此可重複使用）
+
+    Args:
+        db_path: SQLite 檔案路徑，或 postgresql:// 連線字串
+    """
+    backend = _backends.get(db_path)
+    if backend is not None:
+        return backend
+
+    with _backends_lock:
+        backend = _backends.get(db_path)
+        if backend is None:
+            if is_postgres_url(db_path):
+                backend = PostgresBackend(db_path)
+            else:
+                backend = SQLiteBackend(db_path)
+            _backends[db_path] = backend
+        return backend
+
+
+@contextmanager
+def read_only_connections():
+    """
+    區塊內此執行緒取得的 SQLite 連線改為唯讀，且重複使用同一條連線
+    （平行讀取的工作執行緒使用；管理器照常呼叫 close() 不會真的關閉）
+    """
+    previous = getattr(_read_only, 'active', False)
+    _read_only.active = True
+    try:
+        yield
+    finally:
+        _read_only.active = previous
+
+
+@contextmanager
+def shared_connections():
+    """
+    區塊內此執行緒向同一後端取得的連線（未指定連線參數時）都是同一條，離開最外層區塊時才關閉
+
+    管理器照常呼叫 close()，最後一個使用者歸還時結束未提交的交易；
+    區塊因例外結束時回滾未提交的交易，失敗動作留下的交易不會被之後的動作提交
+    （工作單元使用，見 unit_of_work.py）
+    """
+    conns = getattr(_shared, 'conns', None)
+    outermost = conns is None
+    if outermost:
+        conns = _shared.conns = {}
+    try:
+        yield
+    except BaseException:
+        for conn in conns.values():
+            conn._abandon()
+        raise
+    finally:
+        if outermost:
+            _shared.conns = None
+            for conn in conns.values():
+                conn._abandon()
+                conn._shared = False
+                conn.close()
+
+
+def _shared_connection(backend, open_connection):
+    """shared_connections() 區塊內回傳此執行緒共用的連線（第一次時開啟），區塊外回傳 None"""
+    conns = getattr(_shared, 'conns', None)
+    if conns is None:
+        return None
+    conn = conns.get(backend)
+    if conn is None:
+        conn = conns[backend] = open_connection()
+        conn._shared = True
+    conn._users += 1
+    return conn
+
+
+def stream_connection(db_path):
+    """
+    逐筆輸出查詢結果用的連線：不取工作單元共用的連線（離開工作單元時就會關閉），
+    由讀取結果的產生器在讀完或被關閉時關閉
+    """
+    return get_backend(db_path).connect(isolation_level=None)
+
+
+def close_read_connections():
+    """關閉所有執行緒的唯讀連線（工作執行緒結束後呼叫）"""
+    for backend in list(_backends.values()):
+        backend.close_read_connections()
+
+
+class SQLiteBackend:
+    """
+    SQLite 後端：處理多個程序同時寫入時的鎖定
+
+    - busy_timeout：每次嘗試取得寫入鎖時，由 SQLite 等待的毫秒數
+    - 寫入交易一律以 BEGIN IMMEDIATE 開始（一開始就取得寫入鎖，避免讀鎖升級時的死結），
+      取不到鎖時以隨機抖動的指數退避重試，次數有上限
+    - writer_lock：另以鎖定檔讓所有程序的寫入交易依序排隊，不必反覆輪詢 SQLite
+
+    預設值可用環境變數 SKILL_SQLITE_BUSY_TIMEOUT_MS、SKILL_SQLITE_BEGIN_RETRIES、
+    SKILL_SQLITE_WRITER_LOCK=1 調整
+    """
+    dialect = 'sqlite'
+    IntegrityError = sqlite3.IntegrityError
+
+    BACKOFF_BASE = 0.01
+    BACKOFF_CAP = 0.5
+
+    def __init__(self, db_path, busy_timeout_ms=None, retries=None, writer_lock=None):
+        self.db_path = db_path
+        self.busy_timeout_ms = int(busy_timeout_ms if busy_timeout_ms is not None
+                                   else os.environ.get('SKILL_SQLITE_BUSY_TIMEOUT_MS', 500))
+        self.retries = int(retries if retries is not None
+                           else os.environ.get('SKILL_SQLITE_BEGIN_RETRIES', 8))
+        if writer_lock is None:
+            writer_lock = os.environ.get('SKILL_SQLITE_WRITER_LOCK') == '1'
+        self.writer_queue = _WriterQueue(f'{db_path}.writer.lock') if writer_lock else None
+
+        self._local = threading.local()
+        self._read_conns = []
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            'transactions': 0,
+            'retries': 0,
+            'lock_timeouts': 0,
+            'wait_ms_total': 0.0,
+            'wait_ms_max': 0.0,
+            'queue_wait_ms_total': 0.0,
+        }
+
+    def connect(self, **kwargs):
+        """
+        isolation_level=None 時與 sqlite3 相同為自動提交；其他情況在第一個
+        INSERT/UPDATE/DELETE/REPLACE 前自動以 BEGIN IMMEDIATE 開始交易
+        """
+        if getattr(_read_only, 'active', False):
+            return self._read_connection()
+        if not kwargs:
+            shared = _shared_connection(self, self._open)
+            if shared is not None:
+                return shared
+        return self._open(**kwargs)
+
+    def _open(self, **kwargs):
+        implicit = kwargs.pop('isolation_level', '') is not None
+        kwargs.setdefault('timeout', self.busy_timeout_ms / 1000)
+        conn = sqlite3.connect(self.db_path, isolation_level=None, factory=_SQLiteConnection, **kwargs)
+        conn._setup(self, implicit)
+        return conn
+
+    def _read_connection(self):
+        """目前執行緒專用的唯讀連線（mode=ro 開啟，寫入會直接失敗）"""
+        conn = getattr(self._local, 'read_conn', None)
+        if conn is None or not conn._pinned:
+            uri = Path(self.db_path).resolve().as_uri() + '?mode=ro'
+            conn = sqlite3.connect(uri, uri=True, isolation_level=None, factory=_SQLiteConnection,
+                                   timeout=self.busy_timeout_ms / 1000, check_same_thread=False)
+            conn._setup(self, implicit=True)
+            conn._pinned = True
+            self._local.read_conn = conn
+            with self._stats_lock:
+                self._read_conns.append(conn)
+        return conn
+
+    def close_read_connections(self):
+        with self._stats_lock:
+            conns, self._read_conns = self._read_conns, []
+        for conn in conns:
+            conn._pinned = False
+            conn.close()
+
+    def record_wait(self, wait, retries, queue_wait=0.0, timed_out=False, begin=True):
+        """記錄一次取得鎖的等待；begin=False 為交易外的單一語句（如讀取）遇到鎖定後的重試"""
+        wait_ms = wait * 1000
+        with self._stats_lock:
+            stats = self.stats
+            stats['retries'] += retries
+            if timed_out:
+                stats['lock_timeouts'] += 1
+            elif begin:
+                stats['transactions'] += 1
+            if begin:
+                stats['wait_ms_total'] = round(stats['wait_ms_total'] + wait_ms, 3)
+                stats['wait_ms_max'] = round(max(stats['wait_ms_max'], wait_ms), 3)
+                stats['queue_wait_ms_total'] = round(stats['queue_wait_ms_total'] + queue_wait * 1000, 3)
+
+    def close(self):
+        pass
+
+
+def _is_busy(exc):
+    message = str(exc)
+    return 'database is locked' in message or 'database is busy' in message
+
+
+class _WriterQueue:
+    """
+    單一寫入佇列：以 flock 鎖定檔案讓各程序的寫入交易依序執行，
+    等待時由核心喚醒，不佔用 CPU；程序結束時鎖會自動釋放
+
+    同一程序的不同執行緒先以 threading.Lock 排隊；同一執行緒重複取得時只增加計數
+    """
+
+    def __init__(self, path):
+        if fcntl is None:
+            raise RuntimeError("單一寫入佇列需要 fcntl（僅支援 Unix 系統）")
+        self.path = path
+        self._thread_lock = threading.Lock()
+        self._local = threading.local()
+        self._handle = None
+
+    def acquire(self):
+        """取得寫入權，回傳等待秒數"""
+        depth = getattr(self._local, 'depth', 0)
+        if depth:
+            self._local.depth = depth + 1
+            return 0.0
+
+        started = time.perf_counter()
+        self._thread_lock.acquire()
+        try:
+            if self._handle is None:
+                self._handle = open(self.path, 'a')
+            fcntl.flock(self._handle, fcntl.LOCK_EX)
+        except BaseException:
+            self._thread_lock.release()
+            raise
+        self._local.depth = 1
+        return time.perf_counter() - started
+
+    def release(self):
+        self._local.depth -= 1
+        if self._local.depth == 0:
+            fcntl.flock(self._handle, fcntl.LOCK_UN)
+            self._thread_lock.release()
+
+
+_DML = re.compile(r'^\s*(INSERT|UPDATE|DELETE|REPLACE)\b', re.IGNORECASE)
+_BEGIN = re.compile(r'^\s*BEGIN\b', re.IGNORECASE)
+_COMMIT = re.compile(r'^\s*(COMMIT|END)\b', re.IGNORECASE)
+
+
+class _SQLiteConnection(sqlite3.Connection):
+    """交易開始與提交遇到鎖定時重試，並視設定經過單一寫入佇列"""
+
+    def _setup(self, backend, implicit):
+        self.backend = backend
+        self._implicit = implicit
+        self._queued = False
+        self._pinned = False
+        self._shared = False
+        self._users = 0
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or _SQLiteCursor)
+
+    def _retry(self, run, begin):
+        """
+        執行交易外的語句（BEGIN、COMMIT 或自動提交的單一語句），
+        鎖定時以隨機抖動的指數退避重試；begin=True 時先經過單一寫入佇列
+        """
+        backend = self.backend
+        started = time.perf_counter()
+        queue_wait = 0.0
+        if begin and backend.writer_queue is not None and not self._queued:
+            queue_wait = backend.writer_queue.acquire()
+            self._queued = True
+
+        attempt = 0
+        while True:
+            try:
+                result = run()
+                break
+            except sqlite3.OperationalError as exc:
+                if not _is_busy(exc):
+                    self._release_queue()
+                    raise
+                if attempt >= backend.retries:
+                    backend.record_wait(time.perf_counter() - started, attempt, queue_wait,
+                                        timed_out=True, begin=begin)
+                    self._release_queue()
+                    raise
+                attempt += 1
+                time.sleep(random.uniform(0, min(backend.BACKOFF_CAP, backend.BACKOFF_BASE * 2 ** attempt)))
+
+        if begin or attempt:
+            backend.record_wait(time.perf_counter() - started, attempt, queue_wait, begin=begin)
+        return result
+
+    def run_to_completion(self, sql):
+        """
+        以自動提交執行一個語句直到完成，鎖定時重試並視設定經過單一寫入佇列
+
+        sqlite3 模組的 execute() 對沒有結果欄位的語句只執行一步，
+        例如 PRAGMA incremental_vacuum(N) 只會歸還一頁，須改用此方法
+        """
+        try:
+            return self._retry(lambda: self.executescript(sql), begin=True)
+        finally:
+            self._release_queue()
+
+    def begin_read(self):
+        """
+        開始讀取交易，之後的查詢讀同一個快照；已在交易中時回傳 False（沿用現有的交易）
+
+        讀取交易以 BEGIN（DEFERRED）開始，不取得寫入鎖，也不經過單一寫入佇列；結束時呼叫 commit()
+        """
+        if self.in_transaction:
+            return False
+        sqlite3.Connection.execute(self, 'BEGIN')
+        return True
+
+    def _release_queue(self):
+        if self._queued and not self.in_transaction:
+            self._queued = False
+            self.backend.writer_queue.release()
+
+    def _begin(self, cursor, sql):
+        return self._retry(lambda: sqlite3.Cursor.execute(cursor, sql), begin=True)
+
+    def commit(self):
+        try:
+            self._retry(super().commit, begin=False)
+        finally:
+            self._release_queue()
+
+    def rollback(self):
+        try:
+            super().rollback()
+        finally:
+            self._release_queue()
+
+    def _abandon(self):
+        """共用連線的使用權全部收回，並回滾未提交的交易"""
+        self._users = 0
+        if self.in_transaction:
+            self.rollback()
+
+    def close(self):
+        if self._shared:
+            # 工作單元共用的連線：最後一個使用者歸還時結束未提交的交易，由 shared_connections 關閉
+            self._users = max(self._users - 1, 0)
+            if self._users == 0 and self.in_transaction:
+                self.rollback()
+            return
+        if self._pinned:
+            # 執行緒重複使用的唯讀連線：只結束未完成的交易，由 close_read_connections 關閉
+            if self.in_transaction:
+                super().rollback()
+            return
+        try:
+            super().close()
+        finally:
+            if self._queued:
+                self._queued = False
+                self.backend.writer_queue.release()
+
+
+class _SQLiteCursor(sqlite3.Cursor):
+    """在寫入語句前自動開始交易，並將 BEGIN/COMMIT 交給連線重試"""
+
+    def execute(self, sql, params=()):
+        conn = self.connection
+        if _BEGIN.match(sql) and not params:
+            return conn._begin(self, sql)
+        if _COMMIT.match(sql):
+            conn.commit()
+            return self
+        return self._run(super().execute, sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self._run(super().executemany, sql, seq_of_params)
+
+    def _run(self, run, sql, params):
+        conn = self.connection
+        if conn.in_transaction:
+            # 交易中的語句不重試：鎖定錯誤由呼叫端決定是否回滾整個交易
+            return run(sql, params)
+
+        if not (conn._implicit and _DML.match(sql)):
+            # 自動提交的單一語句（讀取或 isolation_level=None 的寫入），失敗時沒有任何效果，可直接重試
+            try:
+                return conn._retry(lambda: run(sql, params), begin=False)
+            finally:
+                conn._release_queue()
+
+        conn._begin(self, 'BEGIN IMMEDIATE')
+        try:
+            return run(sql, params)
+        except Exception:
+            # 為這個語句自動開始的交易，語句失敗就整個回滾，不佔著寫入鎖
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            conn._release_queue()
+
+
+class PostgresBackend:
+    """
+    PostgreSQL 後端（需安裝 psycopg[pool]）
+
+    - 連線池：連線用完呼叫 close() 會歸還池中，而不是真的關閉
+    - prepare_threshold=0：每個語句第一次執行即在伺服器端預備，之後重複使用
+    - copy_rows()：批次寫入使用 COPY
+    """
+    dialect = 'postgresql'
+
+    def __init__(self, dsn, min_size=1, max_size=10):
+        try:
+            import psycopg
+            from psycopg_pool import ConnectionPool
+        except ImportError as exc:
+            raise RuntimeError("使用 PostgreSQL 需要安裝 psycopg[pool]: pip install 'psycopg[binary,pool]'") from exc
+
+        self.IntegrityError = psycopg.IntegrityError
+        self._id_tables = {}
+        self.pool = ConnectionPool(
+            dsn,
+            min_size=min_size,
+            max_size=max_size,
+            kwargs={'prepare_threshold': 0},
+            open=True,
+        )
+
+    def connect(self, **kwargs):
+        # isolation_level 等 SQLite 參數不適用，交易由 psycopg 隱式開始
+        if not kwargs:
+            shared = _shared_connection(self, self._open)
+            if shared is not None:
+                return shared
+        return self._open()
+
+    def _open(self):
+        return _PgConnection(self, self.pool.getconn())
+
+    def close(self):
+        self.pool.close()
+
+    def close_read_connections(self):
+        # 平行讀取時各執行緒由連線池取得各自的連線，沒有另外保留的唯讀連線
+        pass
+
+    def has_id_column(self, raw_conn, table):
+        """表格是否有 id 欄位（INSERT 需要 RETURNING id 才能提供 lastrowid）"""
+        if table not in self._id_tables:
+            with raw_conn.cursor() as cursor:
+                cursor.execute('''
+                    SELECT 1 FROM information_schema.columns
+                    WHERE table_schema = current_schema() AND table_name = %s AND column_name = 'id'
+                ''', (table,))
+                self._id_tables[table] = cursor.fetchone() is not None
+        return self._id_tables[table]
+
+    def copy_rows(self, conn, table, columns, rows):
+        """以 COPY 批次寫入多筆資料"""
+        with conn.raw.cursor() as cursor:
+            with cursor.copy(f"COPY {table} ({', '.join(columns)}) FROM STDIN") as copy:
+                for row in rows:
+                    copy.write_row(row)
+
+
+_PLACEHOLDER = re.compile(r'\?')
+_INSERT = re.compile(r'^\s*INSERT\s+INTO\s+(\w+)', re.IGNORECASE)
+_RETURNING = re.compile(r'\bRETURNING\b', re.IGNORECASE)
+
+
+def _translate(sql):
+    """將 SQLite 風格的 ? 參數轉為 psycopg 的 %s"""
+    return _PLACEHOLDER.sub('%s', sql.replace('%', '%%'))
+
+
+class _PgCursor:
+    """讓 psycopg 游標提供與 sqlite3 相同的介面（? 參數、lastrowid）"""
+
+    def __init__(self, conn, cursor):
+        self._conn = conn
+        self._cursor = cursor
+        self.lastrowid = None
+
+    def execute(self, sql, params=()):
+        insert = _INSERT.match(sql)
+        returning_id = (insert is not None and not _RETURNING.search(sql)
+                        and self._conn.backend.has_id_column(self._conn.raw, insert.group(1)))
+        if returning_id:
+            sql = sql.rstrip().rstrip(';') + ' RETURNING id'
+
+        self._cursor.execute(_translate(sql), tuple(params))
+
+        if returning_id:
+            row = self._cursor.fetchone()
+            self.lastrowid = row[0] if row else None
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        self._cursor.executemany(_translate(sql), [tuple(p) for p in seq_of_params])
+        return self
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+
+class _PgConnection:
+    """連線池中的連線；close() 會歸還連線池"""
+
+    def __init__(self, backend, conn):
+        self.backend = backend
+        self.raw = conn
+        self._shared = False
+        self._users = 0
+
+    def cursor(self):
+        return _PgCursor(self, self.raw.cursor())
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def begin_read(self):
+        """開始 REPEATABLE READ 交易，之後的查詢讀同一個快照；已在交易中時回傳 False"""
+        if self.in_transaction:
+            return False
+        # psycopg 在第一個語句前隱式開始交易，SET TRANSACTION 須是交易的第一個語句
+        self.raw.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+        return True
+
+    def commit(self):
+        self.raw.commit()
+
+    def rollback(self):
+        self.raw.rollback()
+
+    @property
+    def in_transaction(self):
+        from psycopg.pq import TransactionStatus
+        return self.raw.info.transaction_status != TransactionStatus.IDLE
+
+    def _abandon(self):
+        """共用連線的使用權全部收回，並回滾未提交的交易"""
+        self._users = 0
+        if self.raw is not None and self.in_transaction:
+            self.raw.rollback()
+
+    def close(self):
+        if self.raw is None:
+            return
+        if self._shared:
+            # 工作單元共用的連線：最後一個使用者歸還時結束未提交的交易（讀取也會隱式開始交易）
+            self._users = max(self._users - 1, 0)
+            if self._users == 0 and self.in_transaction:
+                self.raw.rollback()
+            return
+        if self.in_transaction:
+            self.raw.rollback()
+        self.backend.pool.putconn(self.raw)
+        self.raw = None
+
+
+def main():
+    """命令列介面：檢查後端連線"""
+    import sys
+
+    if len(sys.argv) < 3 or sys.argv[1] != 'check':
+        print("用法:")
+        print("  檢查連線: python storage.py check <資料庫路徑或 postgresql://...>")
+        return
+
+    backend = get_backend(sys.argv[2])
+    conn = backend.connect()
+    cursor = conn.cursor()
+    cursor.execute('SELECT COUNT(*) FROM students')
+    count = cursor.fetchone()[0]
+    conn.close()
+    backend.close()
+
+    print(f"✅ {backend.dialect} 連線成功，學員數: {count}")
+
+if __name__ == '__main__':
+    main()
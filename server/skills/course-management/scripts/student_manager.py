@@ -2,16 +2,34 @@
 """
 學員管理功能
 """
-import sqlite3
 from datetime import datetime, date
 import json
 
+from storage import get_backend, stream_connection
+from projection import Projection
+from unit_of_work import current_unit
+
+# 列出學員可用的欄位：輸出鍵 → SQL 欄位
+STUDENT_LIST_FIELDS = {
+    'id': 'id',
+    'name': 'name',
+    'birthdate': 'birthdate',
+    'type': 'type',
+    'status': 'status',
+}
+
 class StudentManager:
     def __init__(self, db_path='course_management.db'):
         self.db_path = db_path
     
     def _get_connection(self):
-        return sqlite3.connect(self.db_path)
+        return get_backend(self.db_path).connect()
+    
+    def _forget_students(self):
+        """學員資料變動後清空工作單元的身分對照"""
+        unit = current_unit(self.db_path)
+        if unit is not None:
+            unit.forget_students()
     
     def add_student(self, name, birthdate, student_type='b一般', status='檢測中'):
         """
@@ -41,11 +59,18 @@ class StudentManager:
         student_id = cursor.lastrowid
         conn.commit()
         conn.close()
+        self._forget_students()
         
         return student_id
     
     def get_student_by_name(self, name):
-        """根據姓名查詢學員（支援模糊查詢）"""
+        """根據姓名查詢學員（支援模糊查詢；工作單元內相同的查詢只讀一次資料庫）"""
+        unit = current_unit(self.db_path)
+        if unit is not None:
+            return unit.find_students(name, self._find_by_name)
+        return self._find_by_name(name)
+    
+    def _find_by_name(self, name):
         conn = self._get_connection()
         cursor = conn.cursor()
         
@@ -74,6 +99,12 @@ class StudentManager:
     
     def get_student_by_id(self, student_id):
         """根據ID查詢學員"""
+        unit = current_unit(self.db_path)
+        if unit is not None:
+            return unit.get_student(student_id, self._find_by_id)
+        return self._find_by_id(student_id)
+    
+    def _find_by_id(self, student_id):
         conn = self._get_connection()
         cursor = conn.cursor()
         
@@ -133,47 +164,47 @@ class StudentManager:
         conn.commit()
         success = cursor.rowcount > 0
         conn.close()
+        self._forget_students()
         
         return success
     
-    def list_all_students(self, status=None):
+    def list_all_students(self, status=None, fields=None):
         """
         列出所有學員
         
         Args:
             status: 可選，篩選特定狀態的學員
+            fields: 可選，只回傳這些欄位，如 ['id', 'name'] 只需讀取姓名索引
         """
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        if status:
-            cursor.execute('''
-                SELECT id, name, birthdate, type, status
-                FROM students
-                WHERE status = ?
-                ORDER BY name
-            ''', (status,))
-        else:
-            cursor.execute('''
-                SELECT id, name, birthdate, type, status
-                FROM students
-                ORDER BY name
-            ''')
-        
-        results = cursor.fetchall()
-        conn.close()
+        return list(self.iter_all_students(status, fields))
+    
+    def iter_all_students(self, status=None, fields=None):
+        """
+        與 list_all_students 相同，但由游標逐批讀取、逐筆產生，全部學員不會同時留在記憶體
         
-        students = []
-        for row in results:
-            students.append({
-                'id': row[0],
-                'name': row[1],
-                'birthdate': row[2],
-                'type': row[3],
-                'status': row[4]
-            })
+        查詢在呼叫時即執行（錯誤立即拋出），連線在產生器讀完或關閉時才關閉
+        """
+        projection = Projection(STUDENT_LIST_FIELDS, fields)
         
-        return students
+        query = f'''
+            SELECT {projection.select_list}
+            FROM students
+        '''
+        params = []
+        if status:
+            query += ' WHERE status = ?'
+            params.append(status)
+        query += ' ORDER BY name'
+        
+        conn = stream_connection(self.db_path)
+        try:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+        except Exception:
+            conn.close()
+            raise
+        
+        return projection.stream(conn, cursor)
     
     def calculate_age(self, birthdate_str, reference_date=None):
         """
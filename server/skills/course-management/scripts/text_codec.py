@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+長文字欄位的透明壓縮（zlib + 共用字典）
+
+壓縮後以 BLOB 儲存：MAGIC(2 bytes) + 字典ID(1 byte) + zlib 資料；
+讀取時遇到 MAGIC 開頭的 BLOB 才解壓，未壓縮的 TEXT 原樣回傳
+"""
+import zlib
+from collections import Counter
+
+from storage import get_backend
+
+MAGIC = b'\x00Z'
+ACTIVE_DICT_KEY = 'text_compression_dict'
+
+# 低於此長度（bytes）的文字壓縮效益有限，直接存 TEXT
+MIN_COMPRESS_BYTES = 48
+
+# zlib 視窗為 32KB，字典超過的部分不會被使用
+MAX_DICT_BYTES = 32 * 1024
+
+_dict_cache = {}
+
+def train_dictionary(samples, max_bytes=4 * 1024, min_len=2, max_len=8):
+    """
+    從樣本文字訓練共用字典：取出現頻繁的片語，依節省的位元組數排序
+
+    zlib 對越靠近結尾的字典內容使用越短的距離編碼，最常見的片語放在最後；
+    每次壓縮都要先載入整個字典，4KB 與 16KB 的壓縮率相近但壓縮速度快兩倍以上
+    """
+    counts = Counter()
+    for text in samples:
+        for length in range(min_len, max_len + 1):
+            for i in range(len(text) - length + 1):
+                counts[text[i:i + length]] += 1
+
+    scored = sorted(
+        ((count - 1) * len(phrase.encode('utf-8')), phrase)
+        for phrase, count in counts.items()
+        if count > 1 and phrase.strip()
+    )
+
+    chosen = []
+    joined = ''
+    size = 0
+    for _, phrase in reversed(scored):
+        # 已被選入片語涵蓋的片段不重複放入
+        if phrase in joined:
+            continue
+        encoded = phrase.encode('utf-8')
+        if size + len(encoded) > max_bytes:
+            break
+        chosen.append(phrase)
+        joined += '\x00' + phrase
+        size += len(encoded)
+
+    return ''.join(reversed(chosen)).encode('utf-8')[:MAX_DICT_BYTES]
+
+class TextCodec:
+    def __init__(self, db_path='course_management.db'):
+        self.db_path = db_path
+        self.enabled = get_backend(db_path).dialect == 'sqlite'
+
+    def _get_connection(self):
+        return get_backend(self.db_path).connect()
+
+    def _load(self):
+        """載入所有字典及目前啟用的字典ID（同一資料庫只載入一次）"""
+        cached = _dict_cache.get(self.db_path)
+        if cached is not None:
+            return cached
+
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT id, dictionary FROM compression_dicts')
+        dictionaries = dict(cursor.fetchall())
+        cursor.execute('SELECT value FROM skill_meta WHERE key = ?', (ACTIVE_DICT_KEY,))
+        row = cursor.fetchone()
+        conn.close()
+
+        cached = (dictionaries, int(row[0]) if row else None)
+        _dict_cache[self.db_path] = cached
+        return cached
+
+    def invalidate(self):
+        _dict_cache.pop(self.db_path, None)
+
+    def active_dict_id(self):
+        if not self.enabled:
+            return None
+        return self._load()[1]
+
+    def encode(self, text, dict_id=None):
+        """壓縮文字；未啟用壓縮、文字太短或壓縮後沒有變小時回傳原文字"""
+        if text is None or not self.enabled:
+            return text
+
+        dictionaries, active_id = self._load()
+        dict_id = dict_id or active_id
+        if dict_id is None:
+            return text
+
+        raw = text.encode('utf-8')
+        if len(raw) < MIN_COMPRESS_BYTES:
+            return text
+
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -15, zdict=dictionaries[dict_id])
+        packed = MAGIC + bytes([dict_id]) + compressor.compress(raw) + compressor.flush()
+        return packed if len(packed) < len(raw) else text
+
+    def decode(self, value):
+        """解壓 encode 產生的 BLOB，其他值原樣回傳"""
+        if not isinstance(value, bytes) or not value.startswith(MAGIC):
+            return value
+
+        dictionaries, _ = self._load()
+        if value[2] not in dictionaries:
+            # 其他程序新訓練的字典
+            self.invalidate()
+            dictionaries, _ = self._load()
+        decompressor = zlib.decompressobj(-15, zdict=dictionaries[value[2]])
+        return (decompressor.decompress(value[3:]) + decompressor.flush()).decode('utf-8')
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+時間的整數欄位：'HH:MM' 轉為當天分鐘數、日期轉為自 1970-01-01 起的天數，
+範圍查詢、重疊判斷與排序直接比較整數並使用索引
+
+SQLite 由觸發器在寫入時維護（見 init_database 的遷移 9），PostgreSQL 為 STORED 生成欄位；
+程式寫入時只需提供原本的文字欄位
+"""
+from datetime import date, timedelta
+
+EPOCH = date(1970, 1, 1)
+
+# 各表格的整數欄位：欄位 → (來源欄位, 種類)
+TIME_COLUMNS = {
+    'schedules': {
+        'start_minute': ('start_time', 'minutes'),
+        'end_minute': ('end_time', 'minutes'),
+    },
+    'attendance_records': {
+        'class_day': ('class_date', 'day'),
+        'start_minute': ('start_time', 'minutes'),
+        'end_minute': ('end_time', 'minutes'),
+    },
+    'leave_records': {
+        'leave_day': ('leave_date', 'day'),
+    },
+    'assessment_records': {
+        'assessment_day': ('assessment_date', 'day'),
+    },
+}
+
+_SQL = {
+    'sqlite': {
+        # 允許 '9:00' 這類未補零的時間
+        'minutes': "(CAST(substr({col}, 1, instr({col}, ':') - 1) AS INTEGER) * 60"
+                   " + CAST(substr({col}, instr({col}, ':') + 1) AS INTEGER))",
+        # julianday 的午夜為 .5，減去 1970-01-01 的儒略日即為整數天數
+        'day': "CAST(julianday({col}) - 2440587.5 AS INTEGER)",
+    },
+    'postgresql': {
+        'minutes': "(split_part({col}, ':', 1)::integer * 60 + split_part({col}, ':', 2)::integer)",
+        'day': "({col} - DATE '1970-01-01')",
+    },
+}
+
+def to_minutes(time_str):
+    """'HH:MM' 轉為當天分鐘數"""
+    hour, minute = map(int, time_str.split(':'))
+    return hour * 60 + minute
+
+def format_minutes(minutes):
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+def day_number(value):
+    """date 或 'YYYY-MM-DD' 轉為自 1970-01-01 起的天數"""
+    if isinstance(value, str):
+        value = date.fromisoformat(value[:10])
+    return (value - EPOCH).days
+
+def from_day_number(days):
+    return EPOCH + timedelta(days=days)
+
+def day_sql(column, dialect='sqlite'):
+    """任意日期欄位（如沒有整數欄位的 class_notes.note_date）換算天數的 SQL 運算式"""
+    return _SQL[dialect]['day'].format(col=column)
+
+def column_sql(table, column, dialect='sqlite', alias=None):
+    """由來源欄位計算整數欄位的 SQL 運算式（回填、封存資料讀取使用）"""
+    source, kind = TIME_COLUMNS[table][column]
+    if alias:
+        source = f'{alias}.{source}'
+    return _SQL[dialect][kind].format(col=source)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+工作單元：一次呼叫或一批動作期間，各管理器共用一條連線與學員的身分對照
+
+- 區塊內管理器照常呼叫 _get_connection() / close()，取得的都是同一條連線（見 storage.shared_connections）
+- 學員依姓名或ID查詢過一次後記在身分對照中，同一區塊內再次查詢不必再讀資料庫；
+  新增或修改學員時清空對照
+- 同一個工作單元可在多個執行緒進入（平行讀取的工作執行緒），身分對照共用，連線各執行緒各自一條
+"""
+from contextlib import contextmanager
+import threading
+
+from storage import get_backend, shared_connections
+
+# 目前執行緒進入中的工作單元（由外到內）
+_active = threading.local()
+
+
+def current_unit(db_path):
+    """目前執行緒進入中、屬於這個資料庫的工作單元，沒有時回傳 None"""
+    for unit in reversed(getattr(_active, 'units', ())):
+        if unit.db_path == db_path:
+            return unit
+    return None
+
+
+@contextmanager
+def unit_of_work(db_path):
+    """沿用此執行緒進入中的同一資料庫工作單元，沒有時建立新的"""
+    unit = current_unit(db_path) or UnitOfWork(db_path)
+    with unit:
+        yield unit
+
+
+class UnitOfWork:
+    def __init__(self, db_path='course_management.db'):
+        self.db_path = db_path
+        self._students = {}  # 學員ID → 學員資料
+        self._names = {}     # 姓名查詢字串 → [學員ID, ...]（依查詢結果順序）
+        self._lock = threading.Lock()
+        self._scopes = threading.local()
+        self.stats = {'student_lookups': 0, 'student_hits': 0}
+
+    def __enter__(self):
+        scope = shared_connections()
+        scope.__enter__()
+        if not hasattr(self._scopes, 'stack'):
+            self._scopes.stack = []
+        self._scopes.stack.append(scope)
+        if not hasattr(_active, 'units'):
+            _active.units = []
+        _active.units.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _active.units.pop()
+        return self._scopes.stack.pop().__exit__(exc_type, exc, tb)
+
+    def connection(self):
+        """工作單元共用的連線（close() 只歸還使用權，離開區塊時才真的關閉）"""
+        return get_backend(self.db_path).connect()
+
+    def find_students(self, name, load):
+        """
+        依姓名查詢學員，同一工作單元內相同的查詢只執行一次
+
+        Args:
+            name: 姓名查詢字串
+            load: 實際查詢的函式 load(name)，回傳學員資料列表
+        """
+        with self._lock:
+            self.stats['student_lookups'] += 1
+            ids = self._names.get(name)
+            if ids is not None:
+                self.stats['student_hits'] += 1
+                return [dict(self._students[student_id]) for student_id in ids]
+
+        students = load(name)
+        with self._lock:
+            for student in students:
+                self._students[student['id']] = dict(student)
+            self._names[name] = [student['id'] for student in students]
+        return students
+
+    def get_student(self, student_id, load):
+        """依ID查詢學員；姓名查詢已載入的學員也直接由對照取得"""
+        with self._lock:
+            self.stats['student_lookups'] += 1
+            student = self._students.get(student_id)
+            if student is not None:
+                self.stats['student_hits'] += 1
+                return dict(student)
+
+        student = load(student_id)
+        if student is not None:
+            with self._lock:
+                self._students[student_id] = dict(student)
+        return student
+
+    def forget_students(self):
+        """學員資料有變動（新增、修改）時清空身分對照"""
+        with self._lock:
+            self._students.clear()
+            self._names.clear()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+時段使用率熱圖：以 NumPy 將課程與上課記錄的時間區間累加成「星期 × 時段」矩陣，
+比較排定與實際出席的人數
+"""
+from datetime import datetime, timedelta
+import json
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from storage import get_backend
+from archive_manager import ArchiveManager
+from attendance_manager import AttendanceManager
+from schedule_manager import ScheduleManager
+from time_columns import to_minutes as _to_minutes, format_minutes as _format_minutes, day_number
+
+WEEKDAY_NAMES = ['週一', '週二', '週三', '週四', '週五', '週六', '週日']
+
+def _weekdays(dates):
+    """datetime64[D] 或自 1970-01-01 起的天數陣列轉星期（0=週一）；1970-01-01 為週四"""
+    return (dates.astype('int64') + 3) % 7
+
+class UtilizationAnalyzer:
+    def __init__(self, db_path='course_management.db', granularity=30, capacity=1,
+                 day_start=None, day_end=None):
+        """
+        Args:
+            db_path: 資料庫路徑
+            granularity: 每一格的分鐘數
+            capacity: 每個時段可同時上課的學員數（使用率 = 平均人數 / capacity）
+            day_start / day_end: 營業時間，預設取標準時段的最早與最晚時間
+        """
+        if np is None:
+            raise RuntimeError("使用率分析需要安裝 numpy: pip install numpy")
+
+        self.db_path = db_path
+        self.granularity = granularity
+        self.capacity = capacity
+
+        slots = ScheduleManager(db_path).time_slots
+        self.day_start = _to_minutes(day_start or min(start for start, _ in slots.values()))
+        self.day_end = _to_minutes(day_end or max(end for _, end in slots.values()))
+        self.bins = -(-(self.day_end - self.day_start) // granularity)
+
+    def _get_connection(self):
+        return get_backend(self.db_path).connect()
+
+    def _occupancy(self, weekdays, starts, ends, weights=None):
+        """
+        以差分陣列累加區間：每個區間只在開始格 +w、結束格 -w，再沿時段做累加
+
+        Returns:
+            7 × bins 的矩陣，每格為覆蓋該格的區間權重總和（部分覆蓋也算）
+        """
+        first = np.clip((starts - self.day_start) // self.granularity, 0, self.bins)
+        last = np.clip(-((self.day_start - ends) // self.granularity), 0, self.bins)
+        valid = last > first
+        if weights is None:
+            weights = np.ones(len(weekdays))
+
+        width = self.bins + 1
+        size = 7 * width
+        weekdays, weights = weekdays[valid], weights[valid]
+        diff = (np.bincount(weekdays * width + first[valid], weights, minlength=size)
+                - np.bincount(weekdays * width + last[valid], weights, minlength=size))
+        return np.cumsum(diff.reshape(7, width), axis=1)[:, :self.bins]
+
+    def heatmap(self, start_date=None, end_date=None, student_types=None):
+        """
+        計算每個星期 × 時段的排定與實際出席使用率
+
+        Args:
+            start_date / end_date: 統計區間（預設為最近 12 週）
+            student_types: 只統計這些類型的學員，如 ['a超前', 'c特殊']
+
+        Returns:
+            各格的平均人數與使用率矩陣（列為週一到週日，欄為時段）
+        """
+        parser = AttendanceManager(self.db_path)
+        end = parser._parse_date(end_date) if end_date else datetime.now().date()
+        start = parser._parse_date(start_date) if start_date else end - timedelta(weeks=12) + timedelta(days=1)
+        if start > end:
+            raise ValueError("開始日期不可晚於結束日期")
+
+        type_join = type_filter = ''
+        type_params = []
+        if student_types:
+            if isinstance(student_types, str):
+                student_types = [student_types]
+            type_join = 'JOIN students st ON ar.student_id = st.id'
+            type_filter = f" AND st.type IN ({', '.join('?' for _ in student_types)})"
+            type_params = list(student_types)
+
+        conn = self._get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute(f'''
+            SELECT s.weekday, s.start_minute, s.end_minute,
+                   substr(CAST(s.created_at AS TEXT), 1, 10)
+            FROM schedules s
+            JOIN students st ON s.student_id = st.id
+            WHERE s.is_active = 1{type_filter}
+        ''', type_params)
+        schedules = cursor.fetchall()
+
+        source = ArchiveManager(self.db_path).read_source(
+            conn, 'attendance_records', None, start.isoformat(),
+            ['student_id', 'class_day', 'attendance_status', 'start_minute', 'end_minute'])
+        # 同一天同時段的出席先在資料庫端合併計數，傳回的列數與學員數無關
+        cursor.execute(f'''
+            SELECT ar.class_day, ar.start_minute, ar.end_minute, COUNT(*)
+            FROM {source} ar
+            {type_join}
+            WHERE ar.attendance_status = '出席'
+              AND ar.class_day BETWEEN ? AND ?{type_filter}
+            GROUP BY ar.class_day, ar.start_minute, ar.end_minute
+        ''', [day_number(start), day_number(end)] + type_params)
+        attendance = cursor.fetchall()
+        conn.close()
+
+        first_day = np.datetime64(start, 'D')
+        after_last = np.datetime64(end, 'D') + 1
+        days = np.bincount(_weekdays(np.arange(first_day, after_last)), minlength=7)
+
+        # 排定：每門課在區間內（且建立之後）出現的次數作為權重
+        scheduled = np.zeros((7, self.bins))
+        occurrences = np.zeros(0)
+        if schedules:
+            weekdays = np.array([row[0] for row in schedules], dtype='int64')
+            created = np.array([row[3] or start.isoformat() for row in schedules], dtype='datetime64[D]')
+            begins = np.maximum(created, first_day)
+            occurrences = np.zeros(len(schedules))
+            for weekday in range(7):
+                mask = weekdays == weekday
+                if mask.any():
+                    weekmask = [int(day == weekday) for day in range(7)]
+                    occurrences[mask] = np.busday_count(
+                        begins[mask], np.maximum(begins[mask], after_last), weekmask=weekmask)
+            scheduled = self._occupancy(
+                weekdays,
+                np.array([row[1] for row in schedules], dtype='int64'),
+                np.array([row[2] for row in schedules], dtype='int64'),
+                occurrences,
+            )
+
+        attended = np.zeros((7, self.bins))
+        if attendance:
+            attended = self._occupancy(
+                _weekdays(np.array([row[0] for row in attendance], dtype='int64')),
+                np.array([row[1] for row in attendance], dtype='int64'),
+                np.array([row[2] for row in attendance], dtype='int64'),
+                np.array([row[3] for row in attendance], dtype='float64'),
+            )
+
+        # 換算為該星期每天的平均人數
+        per_day = np.maximum(days, 1)[:, None]
+        scheduled_avg = scheduled / per_day
+        attended_avg = attended / per_day
+        with np.errstate(divide='ignore', invalid='ignore'):
+            attendance_rate = np.where(scheduled > 0, attended / scheduled, np.nan)
+
+        def to_list(matrix, digits=2):
+            return [[None if np.isnan(value) else round(float(value), digits) for value in row]
+                    for row in matrix]
+
+        return {
+            'start_date': start.isoformat(),
+            'end_date': end.isoformat(),
+            'student_types': student_types or None,
+            'granularity': self.granularity,
+            'capacity': self.capacity,
+            'weekdays': WEEKDAY_NAMES,
+            'bins': [_format_minutes(self.day_start + i * self.granularity) for i in range(self.bins)],
+            'days': days.tolist(),
+            'scheduled': to_list(scheduled_avg),
+            'attended': to_list(attended_avg),
+            'scheduled_utilization': to_list(scheduled_avg / self.capacity, 3),
+            'attended_utilization': to_list(attended_avg / self.capacity, 3),
+            'attendance_rate': to_list(attendance_rate, 3),
+            'totals': {
+                'scheduled_sessions': int(occurrences.sum()),
+                'attended_sessions': sum(row[3] for row in attendance),
+            },
+        }
+
+
+def main():
+    """命令列介面"""
+    import sys
+
+    if len(sys.argv) < 2:
+        print("用法:")
+        print("  使用率熱圖: python utilization.py heatmap [開始日期] [結束日期] [學員類型...]")
+        print("\n範例:")
+        print("  python utilization.py heatmap 2024-01-01 2024-12-31 c特殊")
+        return
+
+    action = sys.argv[1]
+
+    if action == 'heatmap':
+        start_date = sys.argv[2] if len(sys.argv) > 2 else None
+        end_date = sys.argv[3] if len(sys.argv) > 3 else None
+        student_types = sys.argv[4:] or None
+
+        analyzer = UtilizationAnalyzer()
+        result = analyzer.heatmap(start_date, end_date, student_types)
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+
+if __name__ == '__main__':
+    main()
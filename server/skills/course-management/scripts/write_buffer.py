@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+寫入緩衝（群組提交）：將同一程序內多個執行緒的 INSERT 合併為同一個交易提交
+
+run_skill.py 每次呼叫只有一個寫入者，不使用緩衝；長時間執行、多執行緒寫入的程式才有效益
+"""
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+from storage import get_backend
+
+_STOP = object()
+
+class WriteBuffer:
+    def __init__(self, db_path='course_management.db', flush_interval_ms=20, max_batch=100):
+        """
+        Args:
+            db_path: 資料庫路徑
+            flush_interval_ms: 收到第一筆寫入後最多等待多久即提交（毫秒）
+            max_batch: 累積到多少筆即立即提交
+        """
+        self.db_path = db_path
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._closed = False
+        self._error = None  # 背景執行緒失敗的原因
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _ensure_started(self):
+        """呼叫端須持有 self._lock"""
+        if self._error is not None:
+            raise RuntimeError(f"寫入緩衝已停止: {self._error}") from self._error
+        if self._closed:
+            raise RuntimeError("寫入緩衝已關閉")
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='write-buffer', daemon=True)
+            self._thread.start()
+
+    def submit(self, sql, params=()):
+        """
+        送出一筆 INSERT，回傳 Future；提交（含 fsync）完成後才會得到新資料的 ID
+        """
+        future = Future()
+        # 檢查與放入佇列在同一個鎖內：背景執行緒失敗後不會再有寫入留在佇列中無人處理
+        with self._lock:
+            self._ensure_started()
+            self._queue.put((sql, tuple(params), future))
+        return future
+
+    def execute(self, sql, params=()):
+        """送出一筆 INSERT 並等待提交完成，回傳新資料的 ID"""
+        return self.submit(sql, params).result()
+
+    def close(self):
+        """提交剩餘的寫入並停止背景執行緒"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join()
+
+    def _collect(self, first):
+        """以第一筆為起點，收集到時間或筆數上限為止"""
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        stop = False
+
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                stop = True
+                break
+            batch.append(item)
+
+        return batch, stop
+
+    def _run(self):
+        batch = []
+        try:
+            conn = get_backend(self.db_path).connect(isolation_level=None)
+            try:
+                # 確認提交後資料已落盤，才回覆呼叫端
+                conn.execute('PRAGMA synchronous = FULL')
+                while True:
+                    first = self._queue.get()
+                    if first is _STOP:
+                        break
+                    batch, stop = self._collect(first)
+                    self._commit_batch(conn, batch)
+                    batch = []
+                    if stop:
+                        break
+            finally:
+                conn.close()
+        except BaseException as exc:
+            self._fail(batch, exc)
+
+    def _fail(self, batch, exc):
+        """背景執行緒無法繼續：關閉緩衝，處理中與佇列中的寫入都以同一個錯誤結束"""
+        with self._lock:
+            self._closed = True
+            self._error = exc
+
+        pending = list(batch)
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                pending.append(item)
+
+        for _, _, future in pending:
+            if not future.done():
+                future.set_exception(exc)
+
+    def _commit_batch(self, conn, batch):
+        results = []
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            for sql, params, future in batch:
+                # 單筆失敗（如 CHECK 約束）只回滾該筆，不影響同批其他寫入
+                cursor.execute('SAVEPOINT item')
+                try:
+                    cursor.execute(sql, params)
+                except sqlite3.Error as exc:
+                    cursor.execute('ROLLBACK TO item')
+                    results.append((future, None, exc))
+                else:
+                    results.append((future, cursor.lastrowid, None))
+                cursor.execute('RELEASE item')
+            cursor.execute('COMMIT')
+        except Exception as exc:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            for _, _, future in batch:
+                future.set_exception(exc)
+            return
+
+        for future, record_id, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(record_id)
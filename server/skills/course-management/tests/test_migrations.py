@@ -0,0 +1,94 @@
+"""資料庫遷移可重新執行（中斷或並行初始化後再次套用不會失敗）"""
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'scripts'))
+
+import init_database
+from time_columns import TIME_COLUMNS
+
+
+def _migrate_to(conn, version):
+    init_database._create_tables(conn.cursor())
+    for target, step in init_database.MIGRATIONS:
+        if target > version:
+            break
+        step(conn.cursor())
+        conn.execute(f'PRAGMA user_version = {target}')
+        conn.commit()
+
+
+def test_time_columns_migration_reruns_when_columns_exist(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'course.db')
+    _migrate_to(conn, 9)
+    conn.execute("INSERT INTO students (name, birthdate, type) VALUES ('王小明', '2018-05-01', 'b一般')")
+    conn.execute('''
+        INSERT INTO schedules (student_id, weekday, start_time, end_time)
+        VALUES (1, 0, '09:30', '10:30')
+    ''')
+    conn.commit()
+
+    # 欄位已新增但 user_version 尚未更新（例如在兩者之間中斷）
+    conn.execute('PRAGMA user_version = 8')
+    init_database._migration_time_columns(conn.cursor())
+    conn.commit()
+
+    for table, columns in TIME_COLUMNS.items():
+        names = [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+        for column in columns:
+            assert names.count(column) == 1
+    row = conn.execute('SELECT start_minute, end_minute FROM schedules').fetchone()
+    assert row == (570, 630)
+    conn.close()
+
+
+def test_failed_migration_rolls_back_with_its_version(tmp_path, monkeypatch):
+    conn = sqlite3.connect(tmp_path / 'course.db')
+    init_database._create_tables(conn.cursor())
+    assert init_database.migrate(conn) == init_database.SCHEMA_VERSION
+
+    def broken(cursor):
+        cursor.execute('CREATE TABLE half_done (id INTEGER)')
+        raise RuntimeError('中斷')
+
+    target = init_database.SCHEMA_VERSION + 1
+    monkeypatch.setattr(init_database, 'MIGRATIONS', init_database.MIGRATIONS + [(target, broken)])
+    with pytest.raises(RuntimeError):
+        init_database.migrate(conn)
+
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == init_database.SCHEMA_VERSION
+    assert conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'half_done'").fetchone() is None
+    conn.close()
+
+
+def test_archive_op_migration_rebuilds_change_log(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'course.db')
+    _migrate_to(conn, 12)
+    conn.execute("INSERT INTO students (name, birthdate, type) VALUES ('王小明', '2018-05-01', 'b一般')")
+    conn.execute("INSERT INTO students (name, birthdate, type) VALUES ('李小華', '2018-06-01', 'b一般')")
+    conn.commit()
+    # 最新的記錄已被壓縮刪除，計數器仍大於現有的最大序號
+    conn.execute('DELETE FROM change_log WHERE seq = (SELECT MAX(seq) FROM change_log)')
+    conn.commit()
+    before = conn.execute('SELECT seq, table_name, row_id, op FROM change_log ORDER BY seq').fetchall()
+    sequence = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'").fetchone()[0]
+
+    init_database._migration_archive_change_op(conn.cursor())
+    conn.commit()
+
+    sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'change_log'").fetchone()[0]
+    assert "'archive'" in sql
+    assert conn.execute('SELECT seq, table_name, row_id, op FROM change_log ORDER BY seq').fetchall() == before
+    assert conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'idx_change_log_table'").fetchone()
+
+    # 其他表格的觸發器仍寫入重建後的 change_log，序號接在計數器之後
+    conn.execute("UPDATE students SET status = '進行中' WHERE id = 1")
+    conn.commit()
+    assert conn.execute('SELECT MAX(seq), op FROM change_log').fetchone() == (sequence + 1, 'update')
+    conn.execute("INSERT INTO change_log (table_name, row_id, op) VALUES ('students', 2, 'archive')")
+    conn.commit()
+    assert conn.execute('PRAGMA integrity_check').fetchone()[0] == 'ok'
+    conn.close()
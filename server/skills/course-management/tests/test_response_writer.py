@@ -0,0 +1,44 @@
+"""逐筆寫出途中讀取失敗時，輸出仍是可解析的 JSON，並標示失敗"""
+import io
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'scripts'))
+
+from response_writer import ResponseWriter
+
+
+def _rows(count, error):
+    for index in range(count):
+        yield {'id': index + 1}
+    raise error
+
+
+def test_list_stream_failure_ends_with_error():
+    stream = io.BytesIO()
+    stats = ResponseWriter(stream).write(True, _rows(2, RuntimeError('database disk image is malformed')))
+
+    payload = json.loads(stream.getvalue())
+    assert payload == {'ok': False, 'error': 'database disk image is malformed',
+                       'result': [{'id': 1}, {'id': 2}]}
+    assert stats['stream_error'] == 'database disk image is malformed'
+    assert stats['items'] == 2
+
+
+def test_field_stream_failure_ends_with_error():
+    stream = io.BytesIO()
+    result = {'changes': _rows(1, RuntimeError('中斷')), 'next_seq': 10}
+    ResponseWriter(stream).write(True, result)
+
+    payload = json.loads(stream.getvalue())
+    assert payload['ok'] is False and payload['error'] == '中斷'
+    assert payload['result'] == {'changes': [{'id': 1}]}
+
+
+def test_completed_stream_is_ok():
+    stream = io.BytesIO()
+    stats = ResponseWriter(stream).write(True, (row for row in [{'id': 1}]))
+
+    assert json.loads(stream.getvalue()) == {'ok': True, 'result': [{'id': 1}]}
+    assert 'stream_error' not in stats
@@ -0,0 +1,21 @@
+"""寫入緩衝的背景執行緒失敗時，呼叫端不會永遠等待"""
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'scripts'))
+
+from write_buffer import WriteBuffer
+
+
+def test_worker_failure_fails_pending_and_later_writes(tmp_path):
+    # 資料庫所在的目錄不存在，背景執行緒連線時即失敗
+    buffer = WriteBuffer(str(tmp_path / 'missing' / 'course.db'))
+    future = buffer.submit('INSERT INTO t VALUES (?)', (1,))
+
+    with pytest.raises(Exception):
+        future.result(timeout=5)
+    with pytest.raises(RuntimeError):
+        buffer.submit('INSERT INTO t VALUES (?)', (2,))
+    buffer.close()